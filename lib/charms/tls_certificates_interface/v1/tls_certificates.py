@@ -116,6 +116,27 @@ if __name__ == "__main__":
     main(ExampleProviderCharm)
 ```
 
+By default the provider stores all certificates of a relation as a single JSON array under the
+`certificates` key. Providers serving many certificates can instead instantiate
+`TLSCertificatesProvidesV1(self, "certificates", sharded_databag=True)` so that each certificate
+is stored under its own `certificate_<csr digest>` key, listed in the `certificates_manifest` key.
+Adding or removing a certificate then only rewrites the entries that changed. Requirers using
+this library version (LIBPATCH 10 or later) understand both layouts.
+
+Providers publishing many certificates in a hook can pass `coalesce_writes=True`, so that the
+changes the library makes to their relation data during the hook are kept in memory and written
+once per relation when the hook ends, on the framework's `pre_commit` event. Keys the charm writes
+to the relation data itself are not affected. Charms can also write the changes earlier by calling
+`flush()`.
+
+CSRs are identified by `csr_digest`, a digest of their DER encoding, wherever the provider and
+requirer match them, so that the same CSR written with different line endings or surrounding
+whitespace is only ever requested and issued once.
+
+Charms can pass an OpenTelemetry compatible tracer to `set_tracer` to record spans for CSR
+requests, relation changes on the provider side and certificate publication. Each span carries
+the digest of the CSRs it handles, as returned by `csr_digest`.
+
 ### Requirer charm
 The requirer charm is the charm requiring certificates from another charm that provides them. In
 this example, the requirer charm is storing its certificates using a peer relation interface called
@@ -217,20 +238,30 @@ if __name__ == "__main__":
 ```
 """  # noqa: D405, D410, D411, D214, D416
 
+import contextlib
 import copy
+import functools
+import hashlib
 import json
 import logging
 import uuid
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, MutableMapping, Optional
 
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.serialization import pkcs12
 from jsonschema import exceptions, validate  # type: ignore[import]
-from ops.charm import CharmBase, CharmEvents, RelationChangedEvent, UpdateStatusEvent
-from ops.framework import EventBase, EventSource, Handle, Object
+from ops.charm import (
+    CharmBase,
+    CharmEvents,
+    RelationBrokenEvent,
+    RelationChangedEvent,
+    UpdateStatusEvent,
+)
+from ops.framework import EventBase, EventSource, Handle, Object, StoredState
+from ops.model import Relation
 
 # The unique Charmhub library identifier, never change it
 LIBID = "afd8c2bccf834997afce12c2706d2ede"
@@ -240,7 +271,7 @@ LIBAPI = 1
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 9
+LIBPATCH = 20
 
 REQUIRER_JSON_SCHEMA = {
     "$schema": "http://json-schema.org/draft-04/schema#",
@@ -330,6 +361,9 @@ PROVIDER_JSON_SCHEMA = {
 }
 
 
+CERTIFICATES_MANIFEST_KEY = "certificates_manifest"
+CERTIFICATE_KEY_PREFIX = "certificate_"
+
 logger = logging.getLogger(__name__)
 
 
@@ -430,6 +464,32 @@ class CertificateCreationRequestEvent(EventBase):
         self.relation_id = snapshot["relation_id"]
 
 
+class CertificateCreationBatchRequestEvent(EventBase):
+    """Charm Event triggered when one or more TLS certificates are required.
+
+    Carries every pending certificate creation request found on a relation changed event.
+    """
+
+    def __init__(self, handle: Handle, certificate_creation_requests: List[Dict]):
+        """CertificateCreationBatchRequestEvent.
+
+        Args:
+            handle (Handle): Juju framework handle
+            certificate_creation_requests (list): Pending requests, each a dictionary with the
+                `certificate_signing_request` and `relation_id` keys.
+        """
+        super().__init__(handle)
+        self.certificate_creation_requests = certificate_creation_requests
+
+    def snapshot(self) -> dict:
+        """Returns snapshot."""
+        return {"certificate_creation_requests": self.certificate_creation_requests}
+
+    def restore(self, snapshot: dict):
+        """Restores snapshot."""
+        self.certificate_creation_requests = snapshot["certificate_creation_requests"]
+
+
 class CertificateRevocationRequestEvent(EventBase):
     """Charm Event triggered when a TLS certificate needs to be revoked."""
 
@@ -484,6 +544,143 @@ def _load_relation_data(raw_relation_data: dict) -> dict:
     return certificate_data
 
 
+def _update_relation_data(databag: Any, key: str, value: str) -> bool:
+    """Writes a value to a relation databag unless the databag already holds it.
+
+    Every change to a databag wakes the units on the other side of the relation, so values are
+    compared with the current content and only written when they differ.
+
+    Args:
+        databag: Relation databag
+        key (str): Key
+        value (str): Serialized value
+
+    Returns:
+        bool: Whether the value was written.
+    """
+    if databag.get(key) == value:
+        return False
+    databag[key] = value
+    return True
+
+
+@functools.lru_cache(maxsize=4096)
+def csr_digest(certificate_signing_request: str) -> str:
+    """Returns the digest identifying a CSR in relation data.
+
+    The digest is computed over the DER encoding of the CSR, so that it does not depend on how
+    the PEM is written. A CSR that cannot be loaded is identified by its PEM text without any
+    whitespace.
+
+    Args:
+        certificate_signing_request (str): Certificate Signing Request
+
+    Returns:
+        str: Hex encoded SHA256 digest of the CSR.
+    """
+    try:
+        csr = x509.load_pem_x509_csr(certificate_signing_request.strip().encode())
+        canonical = csr.public_bytes(serialization.Encoding.DER)
+    except ValueError:
+        canonical = "".join(certificate_signing_request.split()).encode()
+    return hashlib.sha256(canonical).hexdigest()
+
+
+_tracer: Any = None
+
+
+def set_tracer(tracer: Any) -> None:
+    """Sets the tracer recording spans for the certificate flow.
+
+    The tracer must provide `start_as_current_span(name, attributes=...)`, as OpenTelemetry
+    tracers do. Spans carry the digests of the CSRs they handle in their `csr.digest` or
+    `csr.digests` attributes, so that the spans of a certificate can be correlated across the
+    requirer and provider charms. Passing None disables tracing.
+
+    Args:
+        tracer: Tracer, None to disable tracing
+
+    Returns:
+        None
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def _span(name: str, attributes: Dict[str, Any]):
+    """Returns a context manager recording a span with the tracer, if one is set.
+
+    Args:
+        name (str): Span name
+        attributes (dict): Span attributes
+
+    Returns:
+        Context manager yielding the span, or None when tracing is disabled.
+    """
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+def _sharded_certificate_key(digest: str) -> str:
+    """Returns the relation data key under which a sharded certificate is stored.
+
+    Args:
+        digest (str): CSR digest
+
+    Returns:
+        str: Relation data key
+    """
+    return f"{CERTIFICATE_KEY_PREFIX}{digest}"
+
+
+def _load_certificates_manifest(raw_relation_data) -> Optional[List[str]]:
+    """Loads the list of sharded certificate digests from the relation data bag.
+
+    Args:
+        raw_relation_data: Relation data from the databag
+
+    Returns:
+        list: CSR digests, None if the relation data does not use the sharded layout.
+    """
+    raw_manifest = raw_relation_data.get(CERTIFICATES_MANIFEST_KEY)
+    if raw_manifest is None:
+        return None
+    try:
+        manifest = json.loads(raw_manifest)
+    except json.decoder.JSONDecodeError:
+        logger.warning("Could not load certificates manifest from relation data")
+        return []
+    return manifest if isinstance(manifest, list) else []
+
+
+def _load_provider_certificates(raw_relation_data) -> List[Dict]:
+    """Loads the provider certificates from the relation data bag.
+
+    Supports both the legacy layout, where all certificates are stored as a JSON array under the
+    `certificates` key, and the sharded layout, where each certificate is stored under its own key.
+
+    Args:
+        raw_relation_data: Relation data from the databag
+
+    Returns:
+        list: Provider certificates
+    """
+    manifest = _load_certificates_manifest(raw_relation_data)
+    if manifest is None:
+        return _load_relation_data(raw_relation_data).get("certificates", [])
+    certificates = []
+    for digest in manifest:
+        raw_certificate = raw_relation_data.get(_sharded_certificate_key(digest))
+        if not raw_certificate:
+            continue
+        try:
+            certificates.append(json.loads(raw_certificate))
+        except json.decoder.JSONDecodeError:
+            logger.warning("Could not load certificate %s from relation data", digest)
+    return certificates
+
+
 def generate_ca(
     private_key: bytes,
     subject: str,
@@ -704,10 +901,68 @@ def generate_csr(
     return signed_certificate.public_bytes(serialization.Encoding.PEM)
 
 
+class _BufferedRelationData(MutableMapping):
+    """Relation databag whose changes are kept in memory until `write` is called.
+
+    Reads return the pending changes over the current content of the databag, so keys that
+    other code writes to the databag directly are seen and never overwritten or deleted unless
+    they are changed through this object.
+    """
+
+    def __init__(self, relation: Relation, entity: Any):
+        self._relation = relation
+        self._entity = entity
+        self._changes: Dict[str, Optional[str]] = {}
+
+    @property
+    def _databag(self) -> MutableMapping[str, str]:
+        return self._relation.data[self._entity]
+
+    def __getitem__(self, key: str) -> str:
+        if key not in self._changes:
+            return self._databag[key]
+        value = self._changes[key]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self._changes[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._changes[key] = None
+
+    def __iter__(self):
+        databag = self._databag
+        for key in databag:
+            if self._changes.get(key, "") is not None:
+                yield key
+        for key, value in self._changes.items():
+            if value is not None and key not in databag:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def write(self) -> None:
+        """Writes the keys set or deleted through this object to the databag."""
+        databag = self._databag
+        for key, value in self._changes.items():
+            if value is None:
+                if key in databag:
+                    del databag[key]
+            else:
+                _update_relation_data(databag, key, value)
+        self._changes = {}
+
+
 class CertificatesProviderCharmEvents(CharmEvents):
     """List of events that the TLS Certificates provider charm can leverage."""
 
     certificate_creation_request = EventSource(CertificateCreationRequestEvent)
+    certificate_creation_batch_request = EventSource(CertificateCreationBatchRequestEvent)
     certificate_revocation_request = EventSource(CertificateRevocationRequestEvent)
 
 
@@ -724,13 +979,171 @@ class TLSCertificatesProvidesV1(Object):
 
     on = CertificatesProviderCharmEvents()
 
-    def __init__(self, charm: CharmBase, relationship_name: str):
+    def __init__(
+        self,
+        charm: CharmBase,
+        relationship_name: str,
+        sharded_databag: bool = False,
+        batch_creation_requests: bool = False,
+        coalesce_writes: bool = False,
+    ):
+        """Observes relation changed event.
+
+        Args:
+            charm: Charm object
+            relationship_name: Juju relation name
+            sharded_databag (bool): Whether each certificate is stored under its own relation data
+                key instead of a single `certificates` array. Default: False.
+            batch_creation_requests (bool): Whether pending CSRs are emitted as a single
+                certificate_creation_batch_request event instead of one
+                certificate_creation_request event each. Default: False.
+            coalesce_writes (bool): Whether relation data changes are written once per relation
+                at the end of the hook instead of right away. Default: False.
+        """
         super().__init__(charm, relationship_name)
         self.framework.observe(
             charm.on[relationship_name].relation_changed, self._on_relation_changed
         )
         self.charm = charm
         self.relationship_name = relationship_name
+        self.sharded_databag = sharded_databag
+        self.batch_creation_requests = batch_creation_requests
+        self.coalesce_writes = coalesce_writes
+        self._app_data_buffers: Dict[int, _BufferedRelationData] = {}
+        if coalesce_writes:
+            self.framework.observe(self.framework.on.pre_commit, self._on_pre_commit)
+
+    def _app_data(self, relation: Relation) -> MutableMapping[str, str]:
+        """Returns the provider's relation data for a relation.
+
+        When writes are coalesced, the changes made through it are kept in memory until `flush`
+        writes them to the relation.
+
+        Args:
+            relation (Relation): Juju relation
+
+        Returns:
+            Relation data of the provider application
+        """
+        if not self.coalesce_writes:
+            return relation.data[self.model.app]
+        if relation.id not in self._app_data_buffers:
+            self._app_data_buffers[relation.id] = _BufferedRelationData(relation, self.model.app)
+        return self._app_data_buffers[relation.id]
+
+    def flush(self) -> None:
+        """Writes the relation data changes kept in memory, once per relation.
+
+        Only the keys this library set or deleted are written, and only when their value
+        changed. Keys the charm writes to the relation data directly are left as they are. Does
+        nothing unless writes are coalesced.
+        """
+        relation_ids = {relation.id for relation in self.model.relations[self.relationship_name]}
+        for relation_id, buffer in self._app_data_buffers.items():
+            if relation_id in relation_ids:
+                buffer.write()
+        self._app_data_buffers = {}
+
+    def _on_pre_commit(self, event: EventBase) -> None:
+        """Writes the relation data changes made during the hook.
+
+        Args:
+            event: Juju event
+
+        Returns:
+            None
+        """
+        self.flush()
+
+    def _migrate_to_sharded_databag(self, relation: Relation) -> None:
+        """Moves certificates stored in the legacy `certificates` array to sharded keys.
+
+        Args:
+            relation (Relation): Juju relation
+
+        Returns:
+            None
+        """
+        app_relation_data = self._app_data(relation)
+        if _load_certificates_manifest(app_relation_data) is not None:
+            return
+        certificates = _load_provider_certificates(app_relation_data)
+        manifest = []
+        for certificate in certificates:
+            digest = csr_digest(certificate["certificate_signing_request"])
+            _update_relation_data(
+                app_relation_data, _sharded_certificate_key(digest), json.dumps(certificate)
+            )
+            if digest not in manifest:
+                manifest.append(digest)
+        _update_relation_data(app_relation_data, CERTIFICATES_MANIFEST_KEY, json.dumps(manifest))
+        if "certificates" in app_relation_data:
+            del app_relation_data["certificates"]
+
+    def _add_sharded_certificate(self, relation: Relation, new_certificate: Dict) -> None:
+        """Adds certificate to relation data using the sharded layout.
+
+        Only the certificate's own key and, when needed, the manifest are written.
+
+        Args:
+            relation (Relation): Juju relation
+            new_certificate (dict): Certificate data
+
+        Returns:
+            None
+        """
+        self._migrate_to_sharded_databag(relation)
+        app_relation_data = self._app_data(relation)
+        digest = csr_digest(new_certificate["certificate_signing_request"])
+        key = _sharded_certificate_key(digest)
+        raw_certificate = app_relation_data.get(key)
+        if raw_certificate and json.loads(raw_certificate) == new_certificate:
+            logger.info("Certificate already in relation data - Doing nothing")
+            return
+        _update_relation_data(app_relation_data, key, json.dumps(new_certificate))
+        manifest = _load_certificates_manifest(app_relation_data) or []
+        if digest not in manifest:
+            manifest.append(digest)
+            _update_relation_data(
+                app_relation_data, CERTIFICATES_MANIFEST_KEY, json.dumps(manifest)
+            )
+
+    def _remove_sharded_certificate(
+        self,
+        relation: Relation,
+        certificate: Optional[str] = None,
+        certificate_signing_request: Optional[str] = None,
+    ) -> None:
+        """Removes certificate from relation data using the sharded layout.
+
+        Args:
+            relation (Relation): Juju relation
+            certificate (str): Certificate (optional)
+            certificate_signing_request: Certificate signing request (optional)
+
+        Returns:
+            None
+        """
+        self._migrate_to_sharded_databag(relation)
+        app_relation_data = self._app_data(relation)
+        manifest = _load_certificates_manifest(app_relation_data) or []
+        removed_digests = []
+        if certificate_signing_request:
+            removed_digests.append(csr_digest(certificate_signing_request))
+        if certificate:
+            for digest in manifest:
+                raw_certificate = app_relation_data.get(_sharded_certificate_key(digest))
+                if raw_certificate and json.loads(raw_certificate)["certificate"] == certificate:
+                    removed_digests.append(digest)
+        for digest in removed_digests:
+            key = _sharded_certificate_key(digest)
+            if key in app_relation_data:
+                del app_relation_data[key]
+        new_manifest = [digest for digest in manifest if digest not in removed_digests]
+        if new_manifest != manifest:
+            _update_relation_data(
+                app_relation_data, CERTIFICATES_MANIFEST_KEY, json.dumps(new_manifest)
+            )
 
     def _add_certificate(
         self,
@@ -766,14 +1179,21 @@ class TLSCertificatesProvidesV1(Object):
             "ca": ca,
             "chain": chain,
         }
-        provider_relation_data = _load_relation_data(relation.data[self.charm.app])
-        provider_certificates = provider_relation_data.get("certificates", [])
-        certificates = copy.deepcopy(provider_certificates)
-        if new_certificate in certificates:
+        if self.sharded_databag:
+            self._add_sharded_certificate(relation, new_certificate)
+            return
+        provider_certificates = _load_provider_certificates(self._app_data(relation))
+        if new_certificate in provider_certificates:
             logger.info("Certificate already in relation data - Doing nothing")
             return
+        digest = csr_digest(certificate_signing_request)
+        certificates = [
+            copy.deepcopy(certificate_dict)
+            for certificate_dict in provider_certificates
+            if csr_digest(certificate_dict["certificate_signing_request"]) != digest
+        ]
         certificates.append(new_certificate)
-        relation.data[self.model.app]["certificates"] = json.dumps(certificates)
+        _update_relation_data(self._app_data(relation), "certificates", json.dumps(certificates))
 
     def _remove_certificate(
         self,
@@ -799,18 +1219,24 @@ class TLSCertificatesProvidesV1(Object):
             raise RuntimeError(
                 f"Relation {self.relationship_name} with relation id {relation_id} does not exist"
             )
-        provider_relation_data = _load_relation_data(relation.data[self.charm.app])
-        provider_certificates = provider_relation_data.get("certificates", [])
-        certificates = copy.deepcopy(provider_certificates)
-        for certificate_dict in certificates:
-            if certificate and certificate_dict["certificate"] == certificate:
-                certificates.remove(certificate_dict)
-            if (
-                certificate_signing_request
-                and certificate_dict["certificate_signing_request"] == certificate_signing_request
-            ):
-                certificates.remove(certificate_dict)
-        relation.data[self.model.app]["certificates"] = json.dumps(certificates)
+        if self.sharded_databag:
+            self._remove_sharded_certificate(
+                relation,
+                certificate=certificate,
+                certificate_signing_request=certificate_signing_request,
+            )
+            return
+        provider_certificates = _load_provider_certificates(self._app_data(relation))
+        digest = csr_digest(certificate_signing_request) if certificate_signing_request else None
+        certificates = [
+            copy.deepcopy(certificate_dict)
+            for certificate_dict in provider_certificates
+            if not (certificate and certificate_dict["certificate"] == certificate)
+            and not (
+                digest and csr_digest(certificate_dict["certificate_signing_request"]) == digest
+            )
+        ]
+        _update_relation_data(self._app_data(relation), "certificates", json.dumps(certificates))
 
     @staticmethod
     def _relation_data_is_valid(certificates_data: dict) -> bool:
@@ -834,7 +1260,14 @@ class TLSCertificatesProvidesV1(Object):
         This method is meant to be used when the Root CA has changed.
         """
         for relation in self.model.relations[self.relationship_name]:
-            relation.data[self.model.app]["certificates"] = json.dumps([])
+            if not self.sharded_databag:
+                _update_relation_data(self._app_data(relation), "certificates", json.dumps([]))
+                continue
+            app_relation_data = self._app_data(relation)
+            for key in list(app_relation_data.keys()):
+                if key.startswith(CERTIFICATE_KEY_PREFIX) or key == "certificates":
+                    del app_relation_data[key]
+            _update_relation_data(app_relation_data, CERTIFICATES_MANIFEST_KEY, json.dumps([]))
 
     def set_relation_certificate(
         self,
@@ -846,6 +1279,8 @@ class TLSCertificatesProvidesV1(Object):
     ) -> None:
         """Adds certificates to relation data.
 
+        Replaces the certificate previously set for the same CSR, if any.
+
         Args:
             certificate (str): Certificate
             certificate_signing_request (str): Certificate signing request
@@ -861,17 +1296,67 @@ class TLSCertificatesProvidesV1(Object):
         )
         if not certificates_relation:
             raise RuntimeError(f"Relation {self.relationship_name} does not exist")
-        self._remove_certificate(
-            certificate_signing_request=certificate_signing_request.strip(),
-            relation_id=relation_id,
-        )
-        self._add_certificate(
-            relation_id=relation_id,
-            certificate=certificate.strip(),
-            certificate_signing_request=certificate_signing_request.strip(),
-            ca=ca.strip(),
-            chain=[cert.strip() for cert in chain],
+        with _span(
+            "tls_certificates.set_relation_certificate",
+            {
+                "csr.digest": csr_digest(certificate_signing_request),
+                "relation.id": relation_id,
+            },
+        ):
+            self._add_certificate(
+                relation_id=relation_id,
+                certificate=certificate.strip(),
+                certificate_signing_request=certificate_signing_request.strip(),
+                ca=ca.strip(),
+                chain=[cert.strip() for cert in chain],
+            )
+
+    def get_relation_certificates(self, relation_id: int) -> List[Dict]:
+        """Returns the certificates published in a given relation.
+
+        Args:
+            relation_id (int): Juju relation ID
+
+        Returns:
+            list: Certificates, as dictionaries with the `certificate`,
+                `certificate_signing_request`, `ca` and `chain` keys.
+        """
+        certificates_relation = self.model.get_relation(
+            relation_name=self.relationship_name, relation_id=relation_id
         )
+        if not certificates_relation:
+            raise RuntimeError(f"Relation {self.relationship_name} does not exist")
+        return _load_provider_certificates(self._app_data(certificates_relation))
+
+    def get_requirer_csrs(self, relation_id: Optional[int] = None) -> List[Dict]:
+        """Returns the CSRs requirer units have in their relation data.
+
+        Units whose relation data does not pass JSON schema validation are skipped.
+
+        Args:
+            relation_id (int): Juju relation ID, all relations when not given
+
+        Returns:
+            list: CSRs, as dictionaries with the `certificate_signing_request`, `relation_id`
+                and `unit_name` keys.
+        """
+        requirer_csrs = []
+        for relation in self.model.relations[self.relationship_name]:
+            if relation_id is not None and relation.id != relation_id:
+                continue
+            for unit in relation.units:
+                requirer_relation_data = _load_relation_data(relation.data[unit])
+                if not self._relation_data_is_valid(requirer_relation_data):
+                    continue
+                for csr in requirer_relation_data.get("certificate_signing_requests", []):
+                    requirer_csrs.append(
+                        {
+                            "certificate_signing_request": csr["certificate_signing_request"],
+                            "relation_id": relation.id,
+                            "unit_name": unit.name,
+                        }
+                    )
+        return requirer_csrs
 
     def remove_certificate(self, certificate: str) -> None:
         """Removes a given certificate from relation data.
@@ -893,36 +1378,69 @@ class TLSCertificatesProvidesV1(Object):
 
         Looks at the relation data and either emits:
         - certificate request event: If the unit relation data contains a CSR for which
-            a certificate does not exist in the provider relation data.
+            a certificate does not exist in the provider relation data. When batch creation
+            requests are enabled, a single batch event carries all of those CSRs.
         - certificate revocation event: If the provider relation data contains a CSR for which
             a csr does not exist in the requirer relation data.
 
         Args:
             event: Juju event
 
+        Returns:
+            None
+        """
+        assert event.unit is not None
+        with _span(
+            "tls_certificates.provider.relation_changed",
+            {"relation.id": event.relation.id, "unit": event.unit.name},
+        ) as span:
+            self._handle_relation_changed(event, span)
+
+    def _handle_relation_changed(self, event: RelationChangedEvent, span: Any) -> None:
+        """Emits creation and revocation requests for the requirer unit's CSRs.
+
+        Args:
+            event: Juju event
+            span: Span of the relation changed event, None when tracing is disabled
+
         Returns:
             None
         """
         assert event.unit is not None
         requirer_relation_data = _load_relation_data(event.relation.data[event.unit])
-        provider_relation_data = _load_relation_data(event.relation.data[self.charm.app])
         if not self._relation_data_is_valid(requirer_relation_data):
             logger.warning(
                 f"Relation data did not pass JSON Schema validation: {requirer_relation_data}"
             )
             return
-        provider_certificates = provider_relation_data.get("certificates", [])
+        provider_certificates = _load_provider_certificates(self._app_data(event.relation))
         requirer_csrs = requirer_relation_data.get("certificate_signing_requests", [])
-        provider_csrs = [
-            certificate_creation_request["certificate_signing_request"]
-            for certificate_creation_request in provider_certificates
-        ]
-        requirer_unit_csrs = [
-            certificate_creation_request["certificate_signing_request"]
-            for certificate_creation_request in requirer_csrs
-        ]
-        for certificate_signing_request in requirer_unit_csrs:
-            if certificate_signing_request not in provider_csrs:
+        provided_digests = {
+            csr_digest(certificate["certificate_signing_request"])
+            for certificate in provider_certificates
+        }
+        pending_csrs = []
+        for requirer_csr in requirer_csrs:
+            certificate_signing_request = requirer_csr["certificate_signing_request"]
+            digest = csr_digest(certificate_signing_request)
+            if digest not in provided_digests:
+                provided_digests.add(digest)
+                pending_csrs.append(certificate_signing_request)
+        if span is not None:
+            span.set_attribute("csr.digests", [csr_digest(csr) for csr in pending_csrs])
+        if self.batch_creation_requests:
+            if pending_csrs:
+                self.on.certificate_creation_batch_request.emit(
+                    certificate_creation_requests=[
+                        {
+                            "certificate_signing_request": certificate_signing_request,
+                            "relation_id": event.relation.id,
+                        }
+                        for certificate_signing_request in pending_csrs
+                    ]
+                )
+        else:
+            for certificate_signing_request in pending_csrs:
                 self.on.certificate_creation_request.emit(
                     certificate_signing_request=certificate_signing_request,
                     relation_id=event.relation.id,
@@ -946,15 +1464,16 @@ class TLSCertificatesProvidesV1(Object):
         )
         if not certificates_relation:
             raise RuntimeError(f"Relation {self.relationship_name} does not exist")
-        provider_relation_data = _load_relation_data(certificates_relation.data[self.charm.app])
-        list_of_csrs: List[str] = []
+        requested_digests = set()
         for unit in certificates_relation.units:
             requirer_relation_data = _load_relation_data(certificates_relation.data[unit])
             requirer_csrs = requirer_relation_data.get("certificate_signing_requests", [])
-            list_of_csrs.extend(csr["certificate_signing_request"] for csr in requirer_csrs)
-        provider_certificates = provider_relation_data.get("certificates", [])
+            requested_digests.update(
+                csr_digest(csr["certificate_signing_request"]) for csr in requirer_csrs
+            )
+        provider_certificates = _load_provider_certificates(self._app_data(certificates_relation))
         for certificate in provider_certificates:
-            if certificate["certificate_signing_request"] not in list_of_csrs:
+            if csr_digest(certificate["certificate_signing_request"]) not in requested_digests:
                 self.on.certificate_revocation_request.emit(
                     certificate=certificate["certificate"],
                     certificate_signing_request=certificate["certificate_signing_request"],
@@ -968,6 +1487,7 @@ class TLSCertificatesRequiresV1(Object):
     """TLS certificates requirer class to be instantiated by TLS certificates requirers."""
 
     on = CertificatesRequirerCharmEvents()
+    _stored = StoredState()
 
     def __init__(
         self,
@@ -987,9 +1507,13 @@ class TLSCertificatesRequiresV1(Object):
         self.relationship_name = relationship_name
         self.charm = charm
         self.expiry_notification_time = expiry_notification_time
+        self._stored.set_default(delivered_certificates=dict())
         self.framework.observe(
             charm.on[relationship_name].relation_changed, self._on_relation_changed
         )
+        self.framework.observe(
+            charm.on[relationship_name].relation_broken, self._on_relation_broken
+        )
         self.framework.observe(charm.on.update_status, self._on_update_status)
 
     @property
@@ -1009,8 +1533,7 @@ class TLSCertificatesRequiresV1(Object):
             raise RuntimeError(f"Relation {self.relationship_name} does not exist")
         if not relation.app:
             raise RuntimeError(f"Remote app for relation {self.relationship_name} does not exist")
-        provider_relation_data = _load_relation_data(relation.data[relation.app])
-        return provider_relation_data.get("certificates", [])
+        return _load_provider_certificates(relation.data[relation.app])
 
     def _add_requirer_csr(self, csr: str) -> None:
         """Adds CSR to relation data.
@@ -1028,12 +1551,20 @@ class TLSCertificatesRequiresV1(Object):
                 f"The certificate request can't be completed"
             )
         new_csr_dict = {"certificate_signing_request": csr}
-        if new_csr_dict in self._requirer_csrs:
+        digest = csr_digest(csr)
+        if any(
+            csr_digest(csr_dict["certificate_signing_request"]) == digest
+            for csr_dict in self._requirer_csrs
+        ):
             logger.info("CSR already in relation data - Doing nothing")
             return
         requirer_csrs = copy.deepcopy(self._requirer_csrs)
         requirer_csrs.append(new_csr_dict)
-        relation.data[self.model.unit]["certificate_signing_requests"] = json.dumps(requirer_csrs)
+        _update_relation_data(
+            relation.data[self.model.unit],
+            "certificate_signing_requests",
+            json.dumps(requirer_csrs),
+        )
 
     def _remove_requirer_csr(self, csr: str) -> None:
         """Removes CSR from relation data.
@@ -1050,13 +1581,20 @@ class TLSCertificatesRequiresV1(Object):
                 f"Relation {self.relationship_name} does not exist - "
                 f"The certificate request can't be completed"
             )
-        requirer_csrs = copy.deepcopy(self._requirer_csrs)
-        csr_dict = {"certificate_signing_request": csr}
-        if csr_dict not in requirer_csrs:
+        digest = csr_digest(csr)
+        requirer_csrs = [
+            copy.deepcopy(csr_dict)
+            for csr_dict in self._requirer_csrs
+            if csr_digest(csr_dict["certificate_signing_request"]) != digest
+        ]
+        if len(requirer_csrs) == len(self._requirer_csrs):
             logger.info("CSR not in relation data - Doing nothing")
             return
-        requirer_csrs.remove(csr_dict)
-        relation.data[self.model.unit]["certificate_signing_requests"] = json.dumps(requirer_csrs)
+        _update_relation_data(
+            relation.data[self.model.unit],
+            "certificate_signing_requests",
+            json.dumps(requirer_csrs),
+        )
 
     def request_certificate_creation(self, certificate_signing_request: bytes) -> None:
         """Request TLS certificate to provider charm.
@@ -1075,7 +1613,11 @@ class TLSCertificatesRequiresV1(Object):
             )
             logger.error(message)
             raise RuntimeError(message)
-        self._add_requirer_csr(certificate_signing_request.decode().strip())
+        with _span(
+            "tls_certificates.request_certificate_creation",
+            {"csr.digest": csr_digest(certificate_signing_request.decode())},
+        ):
+            self._add_requirer_csr(certificate_signing_request.decode().strip())
         logger.info("Certificate request sent to provider")
 
     def request_certificate_revocation(self, certificate_signing_request: bytes) -> None:
@@ -1135,9 +1677,24 @@ class TLSCertificatesRequiresV1(Object):
         except exceptions.ValidationError:
             return False
 
+    @staticmethod
+    def _certificate_digest(certificate: Dict) -> str:
+        """Returns a digest of the certificate data published by the provider.
+
+        Args:
+            certificate (dict): Certificate data from the provider relation data.
+
+        Returns:
+            str: Hex encoded SHA256 digest.
+        """
+        return hashlib.sha256(json.dumps(certificate, sort_keys=True).encode()).hexdigest()
+
     def _on_relation_changed(self, event: RelationChangedEvent) -> None:
         """Handler triggerred on relation changed events.
 
+        Emits a certificate available event only for certificates that are new or that changed
+        since they were last delivered to this unit.
+
         Args:
             event: Juju event
 
@@ -1151,25 +1708,45 @@ class TLSCertificatesRequiresV1(Object):
         if not relation.app:
             logger.warning(f"No remote app in relation: {self.relationship_name}")
             return
-        provider_relation_data = _load_relation_data(relation.data[relation.app])
+        provider_relation_data = {"certificates": self._provider_certificates}
         if not self._relation_data_is_valid(provider_relation_data):
             logger.warning(
                 f"Provider relation data did not pass JSON Schema validation: "
                 f"{event.relation.data[relation.app]}"
             )
             return
-        requirer_csrs = [
-            certificate_creation_request["certificate_signing_request"]
+        requested_digests = {
+            csr_digest(certificate_creation_request["certificate_signing_request"])
             for certificate_creation_request in self._requirer_csrs
-        ]
+        }
+        delivered_certificates = dict(self._stored.delivered_certificates)
+        current_certificates = {}
         for certificate in self._provider_certificates:
-            if certificate["certificate_signing_request"] in requirer_csrs:
-                self.on.certificate_available.emit(
-                    certificate_signing_request=certificate["certificate_signing_request"],
-                    certificate=certificate["certificate"],
-                    ca=certificate["ca"],
-                    chain=certificate["chain"],
-                )
+            digest = csr_digest(certificate["certificate_signing_request"])
+            if digest not in requested_digests:
+                continue
+            certificate_digest = self._certificate_digest(certificate)
+            current_certificates[digest] = certificate_digest
+            if delivered_certificates.get(digest) == certificate_digest:
+                continue
+            self.on.certificate_available.emit(
+                certificate_signing_request=certificate["certificate_signing_request"],
+                certificate=certificate["certificate"],
+                ca=certificate["ca"],
+                chain=certificate["chain"],
+            )
+        self._stored.delivered_certificates = current_certificates
+
+    def _on_relation_broken(self, event: RelationBrokenEvent) -> None:
+        """Forgets delivered certificates so that they are emitted again on a new relation.
+
+        Args:
+            event: Juju event
+
+        Returns:
+            None
+        """
+        self._stored.delivered_certificates = dict()
 
     def _on_update_status(self, event: UpdateStatusEvent) -> None:
         """Triggered on update status event.
@@ -1191,7 +1768,7 @@ class TLSCertificatesRequiresV1(Object):
         if not relation.app:
             logger.warning(f"No remote app in relation: {self.relationship_name}")
             return
-        provider_relation_data = _load_relation_data(relation.data[relation.app])
+        provider_relation_data = {"certificates": self._provider_certificates}
         if not self._relation_data_is_valid(provider_relation_data):
             logger.warning(
                 f"Provider relation data did not pass JSON Schema validation: "
@@ -0,0 +1,126 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Store of the certificates obtained by the charm, shared by all units."""
+
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from ops.model import Application, Relation
+
+logger = logging.getLogger(__name__)
+
+CERTIFICATE_KEY_PREFIX = "certificate_"
+
+
+class CertificateStore:
+    """Certificates obtained by the charm, replicated through the peer relation.
+
+    Each certificate is stored in the peer application data under its own key, indexed by CSR
+    digest, along with the subject, the CSR, the relation it was requested on, its expiry and
+    the ACME account that obtained it. Only the leader can write to the store, every unit can
+    read it.
+    """
+
+    def __init__(self, relation: Relation, app: Application):
+        self._relation = relation
+        self._app = app
+
+    @property
+    def _data(self):
+        return self._relation.data[self._app]
+
+    def get(self, digest: str) -> Optional[Dict]:
+        """Returns the stored certificate for a CSR digest.
+
+        Args:
+            digest (str): CSR digest
+
+        Returns:
+            dict: Stored certificate, None if the store has no certificate for the CSR.
+        """
+        raw_entry = self._data.get(f"{CERTIFICATE_KEY_PREFIX}{digest}")
+        if not raw_entry:
+            return None
+        return json.loads(raw_entry)
+
+    def get_valid(self, digest: str) -> Optional[Dict]:
+        """Returns the stored certificate for a CSR digest if it is not expired.
+
+        Args:
+            digest (str): CSR digest
+
+        Returns:
+            dict: Stored certificate, None if it is missing or expired.
+        """
+        entry = self.get(digest)
+        if not entry or datetime.fromisoformat(entry["expiry"]) <= datetime.utcnow():
+            return None
+        return entry
+
+    def find_by_subject(self, subject: str) -> List[Dict]:
+        """Returns the stored certificates for a subject.
+
+        Args:
+            subject (str): Certificate subject common name
+
+        Returns:
+            list: Stored certificates
+        """
+        return [entry for entry in self.entries().values() if entry["subject"] == subject]
+
+    def entries(self) -> Dict[str, Dict]:
+        """Returns all stored certificates, keyed by CSR digest."""
+        return {
+            key.split(CERTIFICATE_KEY_PREFIX, 1)[1]: json.loads(value)
+            for key, value in self._data.items()
+            if key.startswith(CERTIFICATE_KEY_PREFIX)
+        }
+
+    def add(
+        self,
+        digest: str,
+        certificate_signing_request: str,
+        relation_id: int,
+        certificates: List[str],
+        account: Optional[str] = None,
+    ) -> None:
+        """Stores a certificate chain.
+
+        Args:
+            digest (str): CSR digest
+            certificate_signing_request (str): Certificate signing request
+            relation_id (int): ID of the relation the CSR was received on
+            certificates (list): Certificate chain, as obtained from lego
+            account (str): URI of the ACME account that obtained the certificate, if known
+        """
+        try:
+            certificate = x509.load_pem_x509_certificate(certificates[0].encode())
+        except ValueError:
+            logger.warning("Could not load certificate, not storing it")
+            return
+        common_names = certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        self._data[f"{CERTIFICATE_KEY_PREFIX}{digest}"] = json.dumps(
+            {
+                "subject": str(common_names[0].value) if common_names else "",
+                "certificate_signing_request": certificate_signing_request,
+                "relation_id": relation_id,
+                "certificates": certificates,
+                "expiry": certificate.not_valid_after.isoformat(),
+                "account": account,
+            }
+        )
+
+    def remove(self, digest: str) -> None:
+        """Removes a certificate from the store.
+
+        Args:
+            digest (str): CSR digest
+        """
+        key = f"{CERTIFICATE_KEY_PREFIX}{digest}"
+        if key in self._data:
+            del self._data[key]
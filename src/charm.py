@@ -12,111 +12,1684 @@ develop a new k8s charm using the Operator Framework:
     https://discourse.charmhub.io/t/4208
 """
 
+import hashlib
+import json
 import logging
-from typing import Dict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 from charms.tls_certificates_interface.v1.tls_certificates import (  # type: ignore[import]
-    CertificateCreationRequestEvent,
+    CertificateCreationBatchRequestEvent,
+    CertificateRevocationRequestEvent,
     TLSCertificatesProvidesV1,
+    csr_digest,
+    set_tracer,
 )
 from cryptography import x509
-from cryptography.x509.oid import NameOID
-from ops.charm import CharmBase
+from ops.charm import ActionEvent, CharmBase
+from ops.framework import StoredState
 from ops.main import main
-from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
-from ops.pebble import ExecError
+from ops.model import ActiveStatus, BlockedStatus, Relation, WaitingStatus
+from ops.pebble import ExecError, ExecProcess
+
+from certificate_store import CertificateStore
+from csr_policy import CSRPolicy
+from dns_propagation import (
+    DNS_PORT,
+    Zone,
+    find_authoritative_nameservers,
+    system_resolver,
+)
+from lego_log import parse_lego_log, phase_durations, revoked_domains
+from lego_output import (
+    LEGO_CERTIFICATES_PATH,
+    acme_account,
+    csr_domains,
+    find_certificate_chain,
+    find_certificate_name,
+    remove_certificate_files,
+)
+from lego_storage import certificate_fingerprint, collect_garbage
+from metrics import (
+    CERTIFICATE_NOT_FOUND,
+    INVALID_CSR,
+    ISSUED,
+    LEGO_ERROR,
+    METRICS_PATH,
+    IssuanceMetrics,
+)
+from public_suffix import registered_domain
+from rate_limits import RateLimitTracker, record_certificate
+from scheduler import NEW, PRIORITY_NAMES, REVOCATION, RequestScheduler, expiry_priority
+from tracing import flush_tracer, setup_tracer, span
 
 logger = logging.getLogger(__name__)
 
+PEER_RELATION_NAME = "replicas"
+ASSIGNMENT_KEY_PREFIX = "assignment_"
+RESULT_KEY_PREFIX = "result_"
+REVOCATION_KEY_PREFIX = "revocation_"
+REVOKED_KEY_PREFIX = "revoked_"
+ACME_ACCOUNT_KEY = "acme_account"
+ISSUED_CERTIFICATES_KEY = "issued_certificates"
+REVOCATION_FILE_PREFIX = "revoke-"
+REVOCATION_BATCH_SIZE = 10
+RECENT_ORDERS_LIMIT = 20
+FAILED_REQUEST_RETRY_INTERVAL = timedelta(hours=1)
+REJECTED_STATUS_PREFIX = "Rejected "
+CONTAINER_POLL_INITIAL_DELAY = 0.25
+CONTAINER_POLL_MAX_DELAY = 2.0
+
+
+class LegoExit(NamedTuple):
+    """Outcome of a lego process and the time it exited at."""
+
+    log: str
+    error: Optional[ExecError]
+    exited: float
+    exited_at: int
+
+
+def wait_for_lego(process: ExecProcess) -> LegoExit:
+    """Waits for a lego process and records when it exits.
+
+    Args:
+        process (ExecProcess): lego process
+
+    Returns:
+        LegoExit: lego's log, or the error it exited with, and its exit time as a monotonic
+            time and in nanoseconds since the epoch.
+    """
+    try:
+        _, lego_log = process.wait_output()
+    except ExecError as e:
+        return LegoExit(e.stderr or "", e, time.monotonic(), time.time_ns())
+    return LegoExit(lego_log or "", None, time.monotonic(), time.time_ns())
+
 
 class LegoOperatorCharm(CharmBase):
     """Charm the service."""
 
+    _stored = StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
-        self._container = self.unit.get_container("lego")
+        self._hook_started = time.monotonic()
+        self._stored.set_default(
+            pending_requests=dict(),
+            failed_requests=dict(),
+            phase_durations=dict(),
+            order_outcomes=dict(),
+            recent_orders=list(),
+            order_times=list(),
+            issued_certificates=list(),
+            relation_turns=dict(),
+            pending_revocations=dict(),
+            garbage_collection=dict(),
+            rejected_requests=dict(),
+        )
         self._email = "ghislain.bourgeois@canonical.com"
         self._server = "https://acme-staging-v02.api.letsencrypt.org/directory"
+        self._metrics = IssuanceMetrics(self._stored)
+        self._rate_limits = RateLimitTracker(self._stored, self._server)
+        self._scheduler = RequestScheduler(self._stored)
+        self._tracer = setup_tracer(
+            otlp_endpoint=self.config["tracing-otlp-endpoint"],
+            trace_file=self.config["tracing-file"],
+            service_name=self.app.name,
+        )
+        set_tracer(self._tracer)
+        self._container = self.unit.get_container("lego")
         self._plugin = "namecheap"
         self._secrets = {
             "NAMECHEAP_API_USER": "",
             "NAMECHEAP_API_KEY": "",
         }
-        self.tls_certificates = TLSCertificatesProvidesV1(self, "certificates")
+        self.tls_certificates = TLSCertificatesProvidesV1(
+            self, "certificates", batch_creation_requests=True, coalesce_writes=True
+        )
         self.framework.observe(self.on.lego_pebble_ready, self._on_lego_pebble_ready)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
+        self.framework.observe(self.framework.on.commit, self._on_commit)
+        self.framework.observe(
+            self.on[PEER_RELATION_NAME].relation_changed, self._on_replicas_relation_changed
+        )
+        self.framework.observe(
+            self.on[PEER_RELATION_NAME].relation_departed, self._on_replicas_relation_departed
+        )
+        self.framework.observe(
+            self.tls_certificates.on.certificate_creation_batch_request,
+            self._on_certificate_creation_batch_request,
+        )
         self.framework.observe(
-            self.tls_certificates.on.certificate_creation_request,
-            self._on_certificate_creation_request,
+            self.tls_certificates.on.certificate_revocation_request,
+            self._on_certificate_revocation_request,
         )
+        self.framework.observe(
+            self.on.certificates_relation_changed, self._on_certificates_relation_changed
+        )
+        self.framework.observe(
+            self.on.get_issuance_stats_action, self._on_get_issuance_stats_action
+        )
+        self.framework.observe(self.on.list_pending_action, self._on_list_pending_action)
 
     def _on_lego_pebble_ready(self, event):
         self.unit.status = ActiveStatus()
+        self._process_pending_requests()
+
+    def _on_update_status(self, event):
+        self._process_pending_requests()
+        self._collect_garbage()
+
+    def _on_config_changed(self, event):
+        """Checks the CSRs rejected by the previous CSR policy again."""
+        if self.unit.is_leader():
+            self._stored.rejected_requests = dict()
+        self._process_pending_requests()
+
+    def _on_leader_elected(self, event):
+        self._republish_stored_certificates()
+        self._process_pending_requests()
 
-    def _on_certificate_creation_request(self, event: CertificateCreationRequestEvent) -> None:
-        logger.info("Received Certificate Creation Request")
+    def _on_commit(self, event) -> None:
+        """Exports the spans recorded during the hook."""
+        flush_tracer(self._tracer)
+
+    def _on_replicas_relation_changed(self, event):
+        if self.unit.is_leader():
+            self._collect_peer_results()
+        self._process_pending_requests()
+
+    def _on_replicas_relation_departed(self, event):
+        self._process_pending_requests()
+
+    def _on_certificate_creation_batch_request(
+        self, event: CertificateCreationBatchRequestEvent
+    ) -> None:
+        logger.info(
+            "Received %d Certificate Creation Request(s)", len(event.certificate_creation_requests)
+        )
         if not self.unit.is_leader():
             return
 
-        if not self._container.can_connect():
-            self.unit.status = WaitingStatus("Waiting for container to be ready")
-            event.defer()
+        with span(
+            self._tracer,
+            "lego.certificate_creation_batch_request",
+            {
+                "csr.digests": [
+                    csr_digest(request["certificate_signing_request"])
+                    for request in event.certificate_creation_requests
+                ]
+            },
+        ):
+            self._queue_creation_requests(event.certificate_creation_requests)
+        self._process_pending_requests()
+
+    def _on_certificate_revocation_request(self, event: CertificateRevocationRequestEvent) -> None:
+        """Queues the revocation of a certificate whose CSR is no longer requested.
+
+        The certificate is removed from the store right away so that it is never served again,
+        keeping the ACME account that obtained it, which is the only one that can revoke it.
+        The relation it was published on and its subject are kept too, so that it is not
+        revoked before the certificate replacing it is published.
+        """
+        if not self.unit.is_leader():
+            return
+        digest = csr_digest(event.certificate_signing_request)
+        account = None
+        certificate_store = self._certificate_store
+        if certificate_store:
+            entry = certificate_store.get(digest)
+            if entry:
+                account = entry.get("account")
+            certificate_store.remove(digest)
+        domains = self._csr_domains(event.certificate_signing_request)
+        self._stored.pending_revocations[digest] = {
+            "certificate": event.certificate,
+            "certificate_signing_request": event.certificate_signing_request,
+            "relation_id": self._certificate_relation_id(event.certificate),
+            "subject": domains[0] if domains else None,
+            "received_at": datetime.utcnow().isoformat(),
+            "account": account,
+        }
+
+    def _certificate_relation_id(self, certificate: str) -> Optional[int]:
+        """Returns the ID of the certificates relation a certificate is published on, if any."""
+        for relation in self.model.relations["certificates"]:
+            for published in self.tls_certificates.get_relation_certificates(relation.id):
+                if published["certificate"] == certificate:
+                    return relation.id
+        return None
+
+    def _on_certificates_relation_changed(self, event) -> None:
+        """Revokes the certificates queued while the library handled the relation change.
+
+        The library requests the revocation of each certificate separately, after the creation
+        requests, so they are revoked together once it is done.
+        """
+        if not self.unit.is_leader() or not self._stored.pending_revocations:
             return
+        self._assign_pending_revocations()
+        assigned_revocations = self._assigned_revocations
+        if assigned_revocations and self._wait_for_container():
+            _, scheduled_revocations = self._schedule_work(
+                self._assigned_requests, assigned_revocations
+            )
+            self._revoke_certificates(scheduled_revocations)
+
+    def _queue_creation_requests(self, requests: List[Dict]) -> None:
+        """Adds requests to the pending requests, unless a stored certificate can be served.
+
+        Requests already pending, assigned to a unit or rejected are left alone, so that they
+        keep the time they were received at and the unit they were assigned to.
 
+        Args:
+            requests (list): Requests, with the CSR and the ID of the relation it was received on
+        """
+        certificate_store = self._certificate_store
+        now = datetime.utcnow()
+        skipped_digests = set(self._stored.pending_requests.keys())
+        skipped_digests.update(self._stored.rejected_requests.keys())
+        skipped_digests.update(self._assigned_digests())
+        for request in requests:
+            digest = csr_digest(request["certificate_signing_request"])
+            if digest in skipped_digests:
+                continue
+            stored_certificate = certificate_store.get_valid(digest) if certificate_store else None
+            if stored_certificate:
+                logger.info("Certificate already obtained, publishing it from the store")
+                self._publish_certificate(
+                    certificate_signing_request=request["certificate_signing_request"],
+                    relation_id=request["relation_id"],
+                    certificates=stored_certificate["certificates"],
+                )
+                continue
+            if self._is_rejected(digest, request):
+                continue
+            self._stored.pending_requests[digest] = {
+                "certificate_signing_request": request["certificate_signing_request"],
+                "relation_id": request["relation_id"],
+                "received_at": now.isoformat(),
+                "priority": self._request_priority(
+                    request["certificate_signing_request"], request["relation_id"], now
+                ),
+            }
+
+    def _is_rejected(self, digest: str, request: Dict) -> bool:
+        """Checks a request against the CSR policy and records it when it is rejected.
+
+        Rejected requests are not checked again until the charm configuration changes, as the
+        verdict cannot change otherwise.
+
+        Args:
+            digest (str): CSR digest
+            request (dict): Request, with the CSR and the ID of the relation it was received on
+
+        Returns:
+            bool: Whether the request is rejected
+        """
         try:
-            csr = x509.load_pem_x509_csr(event.certificate_signing_request.encode())
-            subject_value = csr.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value
-            if isinstance(subject_value, bytes):
-                subject = subject_value.decode()
+            csr = x509.load_pem_x509_csr(request["certificate_signing_request"].encode())
+            rejection = CSRPolicy.from_config(self.config).check(csr)
+        except ValueError:
+            rejection = "CSR cannot be loaded"
+        if not rejection:
+            return False
+        logger.error("Rejected CSR %s: %s", digest, rejection)
+        self._metrics.count_outcome(INVALID_CSR)
+        self._stored.rejected_requests[digest] = {
+            "reason": rejection,
+            "relation_id": request["relation_id"],
+        }
+        return True
+
+    def _update_rejection_status(self) -> None:
+        """Reports the CSRs rejected by the CSR policy in the unit status.
+
+        The status set for rejected CSRs is cleared once none are left.
+        """
+        rejections = list(self._stored.rejected_requests.values())
+        if len(rejections) == 1:
+            self.unit.status = BlockedStatus(
+                f"{REJECTED_STATUS_PREFIX}CSR: {rejections[0]['reason']}"
+            )
+        elif rejections:
+            self.unit.status = BlockedStatus(
+                f"{REJECTED_STATUS_PREFIX}{len(rejections)} CSRs. Check logs for details"
+            )
+        elif isinstance(self.unit.status, BlockedStatus) and self.unit.status.message.startswith(
+            REJECTED_STATUS_PREFIX
+        ):
+            self.unit.status = ActiveStatus()
+
+    def _request_priority(
+        self, certificate_signing_request: str, relation_id: int, now: datetime
+    ) -> int:
+        """Returns the priority of a new request.
+
+        A request replacing a stored certificate for the same subject and relation, as sent by
+        requirers renewing their certificate, is as urgent as that certificate is close to
+        expiry.
+
+        Args:
+            certificate_signing_request (str): Certificate signing request
+            relation_id (int): ID of the relation the CSR was received on
+            now (datetime): Current time
+
+        Returns:
+            int: Priority, as defined by the scheduler
+        """
+        certificate_store = self._certificate_store
+        domains = self._csr_domains(certificate_signing_request)
+        if not certificate_store or not domains:
+            return NEW
+        expiries = [
+            datetime.fromisoformat(entry["expiry"])
+            for entry in certificate_store.find_by_subject(domains[0])
+            if entry["relation_id"] == relation_id
+        ]
+        return expiry_priority(max(expiries) if expiries else None, now)
+
+    def _on_get_issuance_stats_action(self, event: ActionEvent) -> None:
+        """Reports the request queue, orders in flight, recent outcomes and rate limit budget.
+
+        Everything is read from the charm's stored state and the peer relation.
+        """
+        now = datetime.utcnow()
+        queued_requests = self._queued_requests(now)
+        in_flight = [request for request in queued_requests if request["state"] == "assigned"]
+        recent_orders = list(self._stored.recent_orders)
+        issued = len([order for order in recent_orders if order["outcome"] == ISSUED])
+        event.set_results(
+            {
+                "queue": {
+                    "pending": len(queued_requests) - len(in_flight),
+                    "in-flight": len(in_flight),
+                },
+                "in-flight": json.dumps(
+                    [
+                        {
+                            "csr-digest": request["csr-digest"],
+                            "unit": request["unit"],
+                            "elapsed-seconds": self._elapsed_seconds(request["assigned-at"], now),
+                        }
+                        for request in in_flight
+                    ]
+                ),
+                "recent-orders": {
+                    "total": len(recent_orders),
+                    "issued": issued,
+                    "failed": len(recent_orders) - issued,
+                    "success-rate": f"{issued / len(recent_orders):.2f}" if recent_orders else "",
+                },
+                "rate-limits": json.dumps(
+                    self._rate_limits.budget(now, self._issued_certificates)
+                ),
+                "relations": json.dumps(self._relation_certificate_stats()),
+            }
+        )
+
+    def _on_list_pending_action(self, event: ActionEvent) -> None:
+        """Lists the certificate requests that are waiting for a certificate."""
+        queued_requests = self._queued_requests(datetime.utcnow())
+        event.set_results({"count": len(queued_requests), "requests": json.dumps(queued_requests)})
+
+    def _queued_requests(self, now: datetime) -> List[Dict]:
+        """Returns the requests waiting for a certificate.
+
+        Requests the leader has not assigned yet are `pending`, requests assigned to a unit are
+        `assigned` until the leader publishes their outcome.
+
+        Args:
+            now (datetime): Current time
+
+        Returns:
+            list: Requests, with their CSR digest, domains, relation, state, priority and age.
+        """
+        requests = [
+            (digest, dict(request), "pending")
+            for digest, request in self._stored.pending_requests.items()
+        ]
+        peer_relation = self._peer_relation
+        if peer_relation:
+            for key, value in peer_relation.data[self.app].items():
+                if key.startswith(ASSIGNMENT_KEY_PREFIX):
+                    digest = key.split(ASSIGNMENT_KEY_PREFIX, 1)[1]
+                    requests.append((digest, json.loads(value), "assigned"))
+        return [
+            {
+                "csr-digest": digest,
+                "domains": self._csr_domains(request["certificate_signing_request"]),
+                "relation-id": request["relation_id"],
+                "state": state,
+                "priority": PRIORITY_NAMES[request.get("priority", NEW)],
+                "unit": request.get("unit"),
+                "assigned-at": request.get("assigned_at"),
+                "age-seconds": self._elapsed_seconds(request.get("received_at"), now),
+            }
+            for digest, request, state in requests
+        ]
+
+    def _relation_certificate_stats(self) -> List[Dict]:
+        """Returns the number of stored certificates and the nearest expiry of each relation.
+
+        Without the peer relation, the leader counts the certificates published on the
+        certificates relations instead.
+        """
+        certificate_store = self._certificate_store
+        if certificate_store:
+            expiries = [
+                (entry["relation_id"], entry["expiry"])
+                for entry in certificate_store.entries().values()
+            ]
+        elif self.unit.is_leader():
+            expiries = [
+                (relation.id, self._certificate_expiry(certificate["certificate"]))
+                for relation in self.model.relations["certificates"]
+                for certificate in self.tls_certificates.get_relation_certificates(relation.id)
+            ]
+        else:
+            return []
+        stats: Dict[int, Dict] = {}
+        for relation_id, expiry in expiries:
+            relation_stats = stats.setdefault(
+                relation_id,
+                {"relation-id": relation_id, "certificates": 0, "nearest-expiry": None},
+            )
+            relation_stats["certificates"] += 1
+            nearest_expiry = relation_stats["nearest-expiry"]
+            if expiry and (nearest_expiry is None or expiry < nearest_expiry):
+                relation_stats["nearest-expiry"] = expiry
+        return [stats[relation_id] for relation_id in sorted(stats)]
+
+    @staticmethod
+    def _certificate_expiry(certificate: str) -> Optional[str]:
+        """Returns the ISO formatted expiry of a PEM certificate, None if it cannot be loaded."""
+        try:
+            return x509.load_pem_x509_certificate(certificate.encode()).not_valid_after.isoformat()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _elapsed_seconds(since: Optional[str], now: datetime) -> Optional[int]:
+        """Returns the number of seconds elapsed since an ISO formatted time, if known."""
+        if not since:
+            return None
+        return int((now - datetime.fromisoformat(since)).total_seconds())
+
+    @staticmethod
+    def _csr_domains(certificate_signing_request: str) -> List[str]:
+        """Returns the domains of a CSR, none if it cannot be parsed."""
+        try:
+            return csr_domains(x509.load_pem_x509_csr(certificate_signing_request.encode()))
+        except ValueError:
+            return []
+
+    def _process_pending_requests(self) -> None:
+        """Gets certificates for every CSR this unit is responsible for.
+
+        Pending CSRs are kept in the leader's stored state, keyed by CSR digest. When the peer
+        relation exists, the leader assigns each of them to a unit and every unit gets the
+        certificates for its own share. A CSR received several times is only processed once.
+        Runs on every hook, with the leader first reconciling the pending CSRs with the
+        certificates relations. Certificates queued for revocation are spread and revoked the
+        same way, in the same queue as the requests, once the certificates have been obtained.
+        """
+        if self.unit.is_leader():
+            self._reconcile()
+            self._update_rejection_status()
+            self._assign_pending_requests()
+            self._assign_pending_revocations()
+        else:
+            self._prune_peer_results()
+        assigned_requests = self._assigned_requests
+        assigned_revocations = self._assigned_revocations
+        if (assigned_requests or assigned_revocations) and not self._wait_for_container():
+            self.unit.status = WaitingStatus("Waiting for container to be ready")
+            return
+        if not self._container.can_connect():
+            return
+        scheduled_requests, scheduled_revocations = self._schedule_work(
+            assigned_requests, assigned_revocations
+        )
+        if scheduled_requests:
+            self._issue_certificates(scheduled_requests)
+        if scheduled_revocations:
+            self._revoke_certificates(scheduled_revocations)
+        self._publish_acme_account()
+        self._write_metrics()
+
+    def _publish_acme_account(self) -> None:
+        """Publishes the ACME account lego holds for this unit in the peer unit data.
+
+        The leader sends revocations to the unit holding the account that obtained each
+        certificate. The account is lost when the lego container's filesystem is, so it is
+        looked up again on every hook.
+        """
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return
+        account = self._acme_account
+        unit_data = peer_relation.data[self.unit]
+        if account and unit_data.get(ACME_ACCOUNT_KEY) != account:
+            unit_data[ACME_ACCOUNT_KEY] = account
+        elif not account and ACME_ACCOUNT_KEY in unit_data:
+            del unit_data[ACME_ACCOUNT_KEY]
+
+    @property
+    def _acme_account(self) -> Optional[str]:
+        """Returns the URI of the ACME account lego holds for this unit, None if it has none."""
+        return acme_account(self._container, self._server, self._email)
+
+    def _wait_for_container(self) -> bool:
+        """Waits for the lego container to be reachable, for up to `container-ready-timeout`.
+
+        Pebble is polled with an exponential backoff, so that requests received while the
+        container starts are served in the same hook rather than hooks later.
+
+        Returns:
+            bool: Whether the container is reachable.
+        """
+        deadline = time.monotonic() + self.config["container-ready-timeout"]
+        delay = CONTAINER_POLL_INITIAL_DELAY
+        while not self._container.can_connect():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.info("lego container not reachable, leaving requests for later hooks")
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, CONTAINER_POLL_MAX_DELAY)
+        return True
+
+    def _schedule_work(
+        self, requests: Dict[str, Dict], revocations: Dict[str, Dict]
+    ) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        """Orders the requests and revocations assigned to this unit in a single queue.
+
+        Revocations come after every request, so that relations take turns across both and a
+        hook spends its time budget on getting certificates first.
+
+        Args:
+            requests (dict): Requests, keyed by CSR digest
+            revocations (dict): Revocations, keyed by CSR digest
+
+        Returns:
+            tuple: Requests and revocations, each keyed by CSR digest, most urgent first.
+        """
+        work = {f"{ASSIGNMENT_KEY_PREFIX}{digest}": item for digest, item in requests.items()}
+        work.update(
+            {
+                f"{REVOCATION_KEY_PREFIX}{digest}": dict(item, priority=REVOCATION)
+                for digest, item in revocations.items()
+            }
+        )
+        if self.config["consolidate-orders"]:
+            scheduled_work = self._scheduler.schedule(
+                work,
+                group_key=lambda item: self._csr_names_key(item["certificate_signing_request"]),
+            )
+        else:
+            scheduled_work = self._scheduler.schedule(work)
+        scheduled_requests = {}
+        scheduled_revocations = {}
+        for key, item in scheduled_work:
+            if key.startswith(ASSIGNMENT_KEY_PREFIX):
+                scheduled_requests[key.split(ASSIGNMENT_KEY_PREFIX, 1)[1]] = item
             else:
-                subject = subject_value
-        except Exception:
-            logger.exception("Bad CSR received, aborting")
+                scheduled_revocations[key.split(REVOCATION_KEY_PREFIX, 1)[1]] = item
+        return scheduled_requests, scheduled_revocations
+
+    def _issue_certificates(self, assigned_requests: Dict[str, Dict]) -> None:
+        """Gets certificates for the requests assigned to this unit, in the order given.
+
+        Args:
+            assigned_requests (dict): Requests, keyed by CSR digest, most urgent first
+        """
+        for digest, request, certificates in self._generate_certificates(assigned_requests):
+            self._scheduler.record_turn(request["relation_id"])
+            account = self._acme_account if certificates else None
+            self._complete_request(digest, request, certificates, account)
+
+    def _reconcile(self) -> None:
+        """Queues the CSRs of the certificates relations that have no certificate published.
+
+        CSRs whose creation request was missed, because a hook failed or leadership changed,
+        are then served without waiting for their relation to change. CSRs already queued are
+        left alone, and CSRs whose order failed are only queued again after a retry interval.
+        Requests received on relations that were removed are dropped first.
+        """
+        self._drop_requests_of_removed_relations()
+        now = datetime.utcnow()
+        for digest, failed_at in list(self._stored.failed_requests.items()):
+            if datetime.fromisoformat(failed_at) <= now - FAILED_REQUEST_RETRY_INTERVAL:
+                del self._stored.failed_requests[digest]
+        skipped_digests = set(self._stored.pending_requests.keys())
+        skipped_digests.update(self._stored.failed_requests.keys())
+        skipped_digests.update(self._stored.rejected_requests.keys())
+        skipped_digests.update(self._assigned_digests())
+        published_digests: Dict[int, Set[str]] = {}
+        requested_digests = set()
+        missing_requests = []
+        for request in self.tls_certificates.get_requirer_csrs():
+            requested_digests.add(csr_digest(request["certificate_signing_request"]))
+            relation_id = request["relation_id"]
+            if relation_id not in published_digests:
+                published_digests[relation_id] = {
+                    csr_digest(certificate["certificate_signing_request"])
+                    for certificate in self.tls_certificates.get_relation_certificates(relation_id)
+                }
+            digest = csr_digest(request["certificate_signing_request"])
+            if digest in published_digests[relation_id] or digest in skipped_digests:
+                continue
+            skipped_digests.add(digest)
+            missing_requests.append(request)
+        for digest in list(self._stored.rejected_requests.keys()):
+            if digest not in requested_digests:
+                del self._stored.rejected_requests[digest]
+        if missing_requests:
+            logger.info("Found %d CSR(s) without certificate", len(missing_requests))
+            self._queue_creation_requests(missing_requests)
+        self._queue_renewals(requested_digests - skipped_digests, now)
+
+    def _assigned_digests(self) -> Set[str]:
+        """Returns the digests of the CSRs assigned to a unit of the peer relation."""
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return set()
+        return {
+            key.split(ASSIGNMENT_KEY_PREFIX, 1)[1]
+            for key in peer_relation.data[self.app].keys()
+            if key.startswith(ASSIGNMENT_KEY_PREFIX)
+        }
+
+    def _drop_requests_of_removed_relations(self) -> None:
+        """Forgets the pending and assigned requests received on relations that were removed."""
+        for digest, request in list(self._stored.pending_requests.items()):
+            if not self._certificates_relation_exists(request["relation_id"]):
+                logger.info("Relation %d is gone, dropping pending CSR", request["relation_id"])
+                del self._stored.pending_requests[digest]
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return
+        app_data = peer_relation.data[self.app]
+        for key, value in list(app_data.items()):
+            if not key.startswith(ASSIGNMENT_KEY_PREFIX):
+                continue
+            relation_id = json.loads(value)["relation_id"]
+            if not self._certificates_relation_exists(relation_id):
+                logger.info("Relation %d is gone, dropping assigned CSR", relation_id)
+                del app_data[key]
+
+    def _certificates_relation_exists(self, relation_id: int) -> bool:
+        """Returns whether a certificates relation still exists.
+
+        `Model.get_relation` returns a relation for any ID, so the ID is looked up among the
+        current relations instead.
+
+        Args:
+            relation_id (int): Relation ID
+
+        Returns:
+            bool: Whether the relation exists
+        """
+        return any(relation.id == relation_id for relation in self.model.relations["certificates"])
+
+    def _queue_renewals(self, digests: Set[str], now: datetime) -> None:
+        """Queues stored certificates that are expired or expiring for renewal.
+
+        Only certificates whose CSR is still requested and not already queued are renewed. The
+        renewed certificate is obtained for the same CSR and replaces the stored one.
+
+        Args:
+            digests (set): Digests of the CSRs that may be renewed
+            now (datetime): Current time
+        """
+        certificate_store = self._certificate_store
+        if not certificate_store:
             return
+        for digest in digests:
+            entry = certificate_store.get(digest)
+            if not entry:
+                continue
+            priority = expiry_priority(datetime.fromisoformat(entry["expiry"]), now)
+            if priority == NEW or self._is_rejected(digest, entry):
+                continue
+            logger.info(
+                "Renewing %s certificate for %s", PRIORITY_NAMES[priority], entry["subject"]
+            )
+            self._stored.pending_requests[digest] = {
+                "certificate_signing_request": entry["certificate_signing_request"],
+                "relation_id": entry["relation_id"],
+                "received_at": now.isoformat(),
+                "priority": priority,
+            }
 
+    def _write_metrics(self) -> None:
+        """Writes the issuance metrics to the textfile read by Prometheus."""
+        expiries: Dict[str, datetime] = {}
+        certificate_store = self._certificate_store
+        if certificate_store:
+            for entry in certificate_store.entries().values():
+                expiry = datetime.fromisoformat(entry["expiry"])
+                expiries[entry["subject"]] = max(expiry, expiries.get(entry["subject"], expiry))
+        queue_depth = len(self._assigned_requests)
+        if self._peer_relation:
+            queue_depth += len(self._stored.pending_requests)
         self._container.push(
-            path="/tmp/csr.pem", make_dirs=True, source=event.certificate_signing_request.encode()
+            path=METRICS_PATH,
+            make_dirs=True,
+            source=self._metrics.render(queue_depth=queue_depth, expiries=expiries),
         )
 
-        logger.info("Getting certificate for domain %s", subject)
+    def _collect_garbage(self) -> None:
+        """Removes lego's files for certificates that are not served or expired.
+
+        Only the `max-lego-certificates` most recent certificates keep their files.
+        """
+        if not self._container.can_connect():
+            return
+        served = self._served_certificates()
+        if served is None:
+            return
+        collected = collect_garbage(
+            self._container, served, self.config["max-lego-certificates"], datetime.utcnow()
+        )
+        if not collected.removed_files:
+            return
+        logger.info(
+            "Removed %d file(s) from lego's output directory, freeing %d bytes",
+            collected.removed_files,
+            collected.freed_bytes,
+        )
+        self._metrics.count_garbage(collected.removed_files, collected.freed_bytes)
+        self._write_metrics()
+
+    def _served_certificates(self) -> Optional[Set[bytes]]:
+        """Returns the fingerprints of the certificates served to requirers.
+
+        Returns:
+            set: Fingerprints, None if this unit cannot know which certificates are served.
+        """
+        certificate_store = self._certificate_store
+        if certificate_store:
+            certificates = [
+                entry["certificates"][0] for entry in certificate_store.entries().values()
+            ]
+        elif self.unit.is_leader():
+            certificates = [
+                certificate["certificate"]
+                for relation in self.model.relations["certificates"]
+                for certificate in self.tls_certificates.get_relation_certificates(relation.id)
+            ]
+        else:
+            return None
+        fingerprints = {certificate_fingerprint(certificate) for certificate in certificates}
+        return {fingerprint for fingerprint in fingerprints if fingerprint}
+
+    @property
+    def _peer_relation(self) -> Optional[Relation]:
+        return self.model.get_relation(PEER_RELATION_NAME)
+
+    @property
+    def _certificate_store(self) -> Optional[CertificateStore]:
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return None
+        return CertificateStore(peer_relation, self.app)
+
+    @property
+    def _assigned_requests(self) -> Dict[str, Dict]:
+        """Returns the requests this unit has to get certificates for, keyed by CSR digest.
+
+        Requests received on relations that were removed are left out.
+        """
+        assigned_requests = self._assigned_items(
+            ASSIGNMENT_KEY_PREFIX, RESULT_KEY_PREFIX, self._stored.pending_requests
+        )
+        return {
+            digest: request
+            for digest, request in assigned_requests.items()
+            if self._certificates_relation_exists(request["relation_id"])
+        }
+
+    @property
+    def _assigned_revocations(self) -> Dict[str, Dict]:
+        """Returns the certificates this unit has to revoke, keyed by CSR digest."""
+        pending_revocations = {} if self._peer_relation else self._released_revocations()
+        return self._assigned_items(REVOCATION_KEY_PREFIX, REVOKED_KEY_PREFIX, pending_revocations)
+
+    def _released_revocations(self) -> Dict[str, Dict]:
+        """Returns the pending revocations whose certificate is not being replaced anymore.
+
+        A requirer renewing its certificate replaces its CSR with a new one for the same
+        subject, and the library then asks for the old certificate to be revoked. The old
+        certificate is kept valid until the certificate for the new CSR is published on the
+        relation, or until the relation or the requirer unit is gone.
+
+        Returns:
+            dict: Revocations, keyed by CSR digest
+        """
+        if not self._stored.pending_revocations:
+            return {}
+        awaited_replacements = self._awaited_replacements()
+        return {
+            digest: dict(revocation)
+            for digest, revocation in self._stored.pending_revocations.items()
+            if (revocation.get("relation_id"), revocation.get("subject"))
+            not in awaited_replacements
+        }
+
+    def _awaited_replacements(self) -> Set[Tuple[int, str]]:
+        """Returns the relation and subject of each CSR that is waiting for a certificate.
+
+        CSRs rejected by the CSR policy are left out, as they are never served.
+        """
+        published_digests: Dict[int, Set[str]] = {}
+        awaited_replacements = set()
+        for request in self.tls_certificates.get_requirer_csrs():
+            relation_id = request["relation_id"]
+            if relation_id not in published_digests:
+                published_digests[relation_id] = {
+                    csr_digest(certificate["certificate_signing_request"])
+                    for certificate in self.tls_certificates.get_relation_certificates(relation_id)
+                }
+            digest = csr_digest(request["certificate_signing_request"])
+            if (
+                digest in published_digests[relation_id]
+                or digest in self._stored.rejected_requests
+            ):
+                continue
+            domains = self._csr_domains(request["certificate_signing_request"])
+            if domains:
+                awaited_replacements.add((relation_id, domains[0]))
+        return awaited_replacements
+
+    def _assigned_items(self, key_prefix: str, result_key_prefix: str, pending) -> Dict[str, Dict]:
+        """Returns the items assigned to this unit that it has no result for yet.
+
+        Without the peer relation, the leader handles all pending items itself.
+
+        Args:
+            key_prefix (str): Prefix of the assignment keys in the peer application data
+            result_key_prefix (str): Prefix of the result keys in the peer unit data
+            pending: Items the leader has not assigned yet, keyed by CSR digest
+
+        Returns:
+            dict: Items, keyed by CSR digest
+        """
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            if not self.unit.is_leader():
+                return {}
+            return {digest: dict(item) for digest, item in pending.items()}
+        assigned_items = {}
+        for key, value in peer_relation.data[self.app].items():
+            if not key.startswith(key_prefix):
+                continue
+            digest = key.split(key_prefix, 1)[1]
+            assignment = json.loads(value)
+            if assignment["unit"] != self.unit.name:
+                continue
+            if f"{result_key_prefix}{digest}" in peer_relation.data[self.unit]:
+                continue
+            assigned_items[digest] = assignment
+        return assigned_items
+
+    def _assign_pending_requests(self) -> None:
+        """Assigns pending requests to units of the peer relation.
+
+        Requests are spread using rendezvous hashing on the CSR digest, or on the names of the
+        CSR when orders are consolidated, so that the same CSR is always assigned to the same
+        unit while the set of units does not change. Requests assigned to units that left the
+        peer relation are assigned again.
+        """
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return
+        unit_names = sorted([self.unit.name] + [unit.name for unit in peer_relation.units])
+        app_data = peer_relation.data[self.app]
+        for key, value in list(app_data.items()):
+            if not key.startswith(ASSIGNMENT_KEY_PREFIX):
+                continue
+            assignment = json.loads(value)
+            if assignment["unit"] not in unit_names:
+                logger.info("Unit %s left, assigning its requests again", assignment["unit"])
+                digest = key.split(ASSIGNMENT_KEY_PREFIX, 1)[1]
+                self._stored.pending_requests[digest] = {
+                    "certificate_signing_request": assignment["certificate_signing_request"],
+                    "relation_id": assignment["relation_id"],
+                    "received_at": assignment.get("received_at"),
+                    "priority": assignment.get("priority", NEW),
+                }
+                del app_data[key]
+        for digest, request in list(self._stored.pending_requests.items()):
+            app_data[f"{ASSIGNMENT_KEY_PREFIX}{digest}"] = json.dumps(
+                {
+                    "unit": self._pick_unit(
+                        digest, request["certificate_signing_request"], unit_names
+                    ),
+                    "certificate_signing_request": request["certificate_signing_request"],
+                    "relation_id": request["relation_id"],
+                    "received_at": request.get("received_at"),
+                    "assigned_at": datetime.utcnow().isoformat(),
+                    "priority": request.get("priority", NEW),
+                }
+            )
+            del self._stored.pending_requests[digest]
+
+    def _assign_pending_revocations(self) -> None:
+        """Assigns pending revocations to units of the peer relation.
+
+        lego can only revoke a certificate with the ACME account that obtained it, and each
+        unit has its own account in its lego container. A revocation goes to the unit that
+        publishes that account, or to the unit its certificate request would be assigned to
+        when the account is not known. Revocations whose account no unit holds anymore are
+        given up. Revocations assigned to units that left the peer relation are assigned again.
+        Revocations of certificates that are being replaced are only assigned once the
+        replacement is published.
+        """
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return
+        unit_names = sorted([self.unit.name] + [unit.name for unit in peer_relation.units])
+        app_data = peer_relation.data[self.app]
+        for key, value in list(app_data.items()):
+            if not key.startswith(REVOCATION_KEY_PREFIX):
+                continue
+            revocation = json.loads(value)
+            if revocation["unit"] not in unit_names:
+                digest = key.split(REVOCATION_KEY_PREFIX, 1)[1]
+                del revocation["unit"]
+                self._stored.pending_revocations[digest] = revocation
+                del app_data[key]
+        accounts = {
+            unit.name: peer_relation.data[unit].get(ACME_ACCOUNT_KEY)
+            for unit in peer_relation.units | {self.unit}
+        }
+        for digest, revocation in self._released_revocations().items():
+            del self._stored.pending_revocations[digest]
+            account = revocation.get("account")
+            if account:
+                holders = sorted(name for name, held in accounts.items() if held == account)
+                if not holders:
+                    logger.error(
+                        "No unit holds the ACME account that obtained the certificate for CSR "
+                        "%s anymore, it cannot be revoked",
+                        digest,
+                    )
+                    continue
+                unit_name = holders[0]
+            else:
+                unit_name = self._pick_unit(
+                    digest, revocation["certificate_signing_request"], unit_names
+                )
+            app_data[f"{REVOCATION_KEY_PREFIX}{digest}"] = json.dumps(
+                {
+                    "unit": unit_name,
+                    "certificate": revocation["certificate"],
+                    "certificate_signing_request": revocation["certificate_signing_request"],
+                    "relation_id": revocation.get("relation_id"),
+                    "subject": revocation.get("subject"),
+                    "received_at": revocation.get("received_at"),
+                    "account": account,
+                }
+            )
+
+    def _pick_unit(
+        self, digest: str, certificate_signing_request: str, unit_names: List[str]
+    ) -> str:
+        """Returns the unit a request is assigned to, using rendezvous hashing.
+
+        Args:
+            digest (str): CSR digest
+            certificate_signing_request (str): Certificate signing request
+            unit_names (list): Names of the units of the peer relation
+
+        Returns:
+            str: Unit name
+        """
+        assignment_key = self._assignment_key(digest, certificate_signing_request)
+        return max(
+            unit_names,
+            key=lambda name: hashlib.sha256(f"{assignment_key}/{name}".encode()).hexdigest(),
+        )
+
+    def _assignment_key(self, digest: str, certificate_signing_request: str) -> str:
+        """Returns the key used to pick the unit a request is assigned to.
+
+        Args:
+            digest (str): CSR digest
+            certificate_signing_request (str): Certificate signing request
+
+        Returns:
+            str: Names of the CSR when orders are consolidated, its digest otherwise.
+        """
+        if self.config["consolidate-orders"]:
+            return self._csr_names_key(certificate_signing_request) or digest
+        return digest
+
+    def _csr_names_key(self, certificate_signing_request: str) -> str:
+        """Returns the names of a CSR as a single key.
+
+        CSRs for the same names have the same key, whatever their key pair or the order of
+        their names. The ACME server only reuses an account's valid authorizations for the same
+        names, so these are the requests worth sending to the same unit.
+
+        Args:
+            certificate_signing_request (str): Certificate signing request
+
+        Returns:
+            str: Sorted names, empty if the CSR cannot be parsed.
+        """
+        return ",".join(
+            sorted({domain.lower() for domain in self._csr_domains(certificate_signing_request)})
+        )
+
+    @staticmethod
+    def _registered_domain(certificate_signing_request: str) -> str:
+        """Returns the registered domain of the first name of a CSR.
+
+        The registered domain follows the Public Suffix List, as for Let's Encrypt's rate
+        limits. Requests that cannot be parsed have an empty registered domain.
+
+        Args:
+            certificate_signing_request (str): Certificate signing request
+
+        Returns:
+            str: Registered domain
+        """
+        try:
+            domains = csr_domains(x509.load_pem_x509_csr(certificate_signing_request.encode()))
+        except ValueError:
+            return ""
+        if not domains:
+            return ""
+        return registered_domain(domains[0])
+
+    def _complete_request(
+        self,
+        digest: str,
+        request: Dict,
+        certificates: Optional[List[str]],
+        account: Optional[str] = None,
+    ) -> None:
+        """Publishes the outcome of a request or hands it over to the leader.
+
+        Args:
+            digest (str): CSR digest
+            request (dict): Request, with the CSR and the ID of the relation it was received on
+            certificates (list): Certificate chain, None if the certificate could not be obtained
+            account (str): URI of the ACME account that obtained the certificate, if known
+        """
+        peer_relation = self._peer_relation
+        if not self.unit.is_leader():
+            if peer_relation:
+                peer_relation.data[self.unit][f"{RESULT_KEY_PREFIX}{digest}"] = json.dumps(
+                    {"certificates": certificates, "account": account}
+                )
+            return
+        if peer_relation:
+            del peer_relation.data[self.app][f"{ASSIGNMENT_KEY_PREFIX}{digest}"]
+        else:
+            del self._stored.pending_requests[digest]
+        if not certificates:
+            self._stored.failed_requests[digest] = datetime.utcnow().isoformat()
+        else:
+            self._record_issued_certificate(request["certificate_signing_request"], certificates)
+            if peer_relation:
+                CertificateStore(peer_relation, self.app).add(
+                    digest=digest,
+                    certificate_signing_request=request["certificate_signing_request"],
+                    relation_id=request["relation_id"],
+                    certificates=certificates,
+                    account=account,
+                )
+            self._publish_certificate(
+                certificate_signing_request=request["certificate_signing_request"],
+                relation_id=request["relation_id"],
+                certificates=certificates,
+            )
+
+    @property
+    def _issued_certificates(self) -> List[List[str]]:
+        """Returns the time, registered domain and fingerprint of the certificates obtained.
+
+        The list covers the certificates every unit obtained, as the leader records them when it
+        publishes them.
+        """
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return [list(entry) for entry in self._stored.issued_certificates]
+        return json.loads(peer_relation.data[self.app].get(ISSUED_CERTIFICATES_KEY, "[]"))
+
+    def _record_issued_certificate(
+        self, certificate_signing_request: str, certificates: List[str]
+    ) -> None:
+        """Counts a certificate against the certificates per registered domain rate limit.
+
+        Args:
+            certificate_signing_request (str): Certificate signing request
+            certificates (list): Certificate chain obtained for the CSR
+        """
+        issued_certificates = record_certificate(
+            self._issued_certificates,
+            registered_domain=self._registered_domain(certificate_signing_request),
+            fingerprint=hashlib.sha256(certificates[0].encode()).hexdigest(),
+            now=datetime.utcnow(),
+        )
+        peer_relation = self._peer_relation
+        if peer_relation:
+            peer_relation.data[self.app][ISSUED_CERTIFICATES_KEY] = json.dumps(issued_certificates)
+        else:
+            self._stored.issued_certificates = issued_certificates
+
+    def _complete_revocation(self, digest: str, revoked: bool) -> None:
+        """Records the outcome of a revocation or hands it over to the leader.
+
+        Args:
+            digest (str): CSR digest
+            revoked (bool): Whether the certificate was revoked
+        """
+        peer_relation = self._peer_relation
+        if not self.unit.is_leader():
+            if peer_relation:
+                peer_relation.data[self.unit][f"{REVOKED_KEY_PREFIX}{digest}"] = json.dumps(
+                    {"revoked": revoked}
+                )
+            return
+        if peer_relation:
+            del peer_relation.data[self.app][f"{REVOCATION_KEY_PREFIX}{digest}"]
+        else:
+            del self._stored.pending_revocations[digest]
+        if not revoked:
+            logger.error("Could not revoke certificate for CSR %s, giving up", digest)
+
+    def _collect_peer_results(self) -> None:
+        """Publishes the certificates obtained and records the revocations of the other units."""
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return
+        for unit in peer_relation.units:
+            for key, value in peer_relation.data[unit].items():
+                if key.startswith(RESULT_KEY_PREFIX):
+                    digest = key.split(RESULT_KEY_PREFIX, 1)[1]
+                    assignment = self._peer_assignment(ASSIGNMENT_KEY_PREFIX, digest, unit.name)
+                    if assignment:
+                        result = json.loads(value)
+                        self._complete_request(
+                            digest, assignment, result["certificates"], result.get("account")
+                        )
+                elif key.startswith(REVOKED_KEY_PREFIX):
+                    digest = key.split(REVOKED_KEY_PREFIX, 1)[1]
+                    if self._peer_assignment(REVOCATION_KEY_PREFIX, digest, unit.name):
+                        self._complete_revocation(digest, json.loads(value)["revoked"])
+
+    def _peer_assignment(self, key_prefix: str, digest: str, unit_name: str) -> Optional[Dict]:
+        """Returns the assignment of an item to a unit.
+
+        Args:
+            key_prefix (str): Prefix of the assignment keys in the peer application data
+            digest (str): CSR digest
+            unit_name (str): Name of the unit
+
+        Returns:
+            dict: Assignment, None if the item is not assigned to the unit.
+        """
+        value = self._peer_relation.data[self.app].get(f"{key_prefix}{digest}")  # type: ignore
+        if not value:
+            return None
+        assignment = json.loads(value)
+        if assignment["unit"] != unit_name:
+            return None
+        return assignment
+
+    def _prune_peer_results(self) -> None:
+        """Removes this unit's results once the leader has handled them."""
+        peer_relation = self._peer_relation
+        if not peer_relation:
+            return
+        unit_data = peer_relation.data[self.unit]
+        for key in list(unit_data.keys()):
+            for result_key_prefix, key_prefix in (
+                (RESULT_KEY_PREFIX, ASSIGNMENT_KEY_PREFIX),
+                (REVOKED_KEY_PREFIX, REVOCATION_KEY_PREFIX),
+            ):
+                if not key.startswith(result_key_prefix):
+                    continue
+                digest = key.split(result_key_prefix, 1)[1]
+                if f"{key_prefix}{digest}" not in peer_relation.data[self.app]:
+                    del unit_data[key]
+
+    def _republish_stored_certificates(self) -> None:
+        """Publishes stored certificates that are missing from their relation.
+
+        Lets a new leader serve the certificates obtained by a previous leader without placing
+        new ACME orders. Certificates requested on relations that no longer exist are forgotten.
+        """
+        certificate_store = self._certificate_store
+        if not certificate_store:
+            return
+        published_csrs: Dict[int, List[str]] = {}
+        for digest, entry in certificate_store.entries().items():
+            relation_id = entry["relation_id"]
+            if not self._certificates_relation_exists(relation_id):
+                certificate_store.remove(digest)
+                continue
+            if relation_id not in published_csrs:
+                published_csrs[relation_id] = [
+                    csr_digest(certificate["certificate_signing_request"])
+                    for certificate in self.tls_certificates.get_relation_certificates(relation_id)
+                ]
+            if digest in published_csrs[relation_id] or not certificate_store.get_valid(digest):
+                continue
+            self._publish_certificate(
+                certificate_signing_request=entry["certificate_signing_request"],
+                relation_id=relation_id,
+                certificates=entry["certificates"],
+            )
+
+    def _publish_certificate(
+        self, certificate_signing_request: str, relation_id: int, certificates: List[str]
+    ) -> None:
+        """Publishes a certificate chain in the relation the CSR was received on.
+
+        Args:
+            certificate_signing_request (str): Certificate signing request
+            relation_id (int): ID of the relation the CSR was received on
+            certificates (list): Certificate chain, as obtained from lego
+        """
+        if not self._certificates_relation_exists(relation_id):
+            logger.info("Relation %d is gone, dropping certificate", relation_id)
+            return
+        with self._metrics.timer("relation_publish"):
+            self.tls_certificates.set_relation_certificate(
+                certificate=certificates[0],
+                certificate_signing_request=certificate_signing_request,
+                ca=certificates[-1],
+                chain=list(reversed(certificates)),
+                relation_id=relation_id,
+            )
+
+    def _generate_certificates(
+        self, requests: Dict[str, Dict]
+    ) -> Iterator[Tuple[str, Dict, Optional[List[str]]]]:
+        """Gets certificates for several CSRs from the ACME server.
+
+        Up to `max-concurrent-orders` lego processes run at the same time, each for a different
+        registered domain, so that the DNS-01 challenges of several zones are presented and
+        checked in parallel while orders for the same domain stay sequential. Once the hook has
+        run for `hook-time-budget` seconds, no more orders are started and the remaining
+        requests are left for the following hooks.
+
+        Args:
+            requests (dict): Requests, keyed by CSR digest
+
+        Yields:
+            tuple: CSR digest, request and certificate chain, None if the certificate could not
+                be obtained.
+        """
+        resolvers = self._authoritative_resolvers(requests)
+        remaining = list(requests.items())
+        while remaining:
+            if len(remaining) < len(requests) and self._hook_time_budget_spent:
+                logger.info("Hook time budget spent, leaving %d request(s)", len(remaining))
+                return
+            window: List[Tuple[str, Dict]] = []
+            window_domains = set()
+            for digest, request in list(remaining):
+                if len(window) >= self.config["max-concurrent-orders"]:
+                    break
+                domain = self._registered_domain(request["certificate_signing_request"])
+                if domain in window_domains:
+                    continue
+                window_domains.add(domain)
+                window.append((digest, request))
+                remaining.remove((digest, request))
+            orders = []
+            for digest, request in window:
+                process = self._start_order(
+                    digest, request["certificate_signing_request"], resolvers
+                )
+                orders.append((digest, request, process, time.monotonic()))
+            with ThreadPoolExecutor(max_workers=len(orders)) as executor:
+                exits = [
+                    executor.submit(wait_for_lego, process) if process else None
+                    for _, _, process, _ in orders
+                ]
+                for (digest, request, _, started), lego_exit in zip(orders, exits):
+                    certificates = None
+                    if lego_exit:
+                        certificates = self._finish_order(
+                            digest,
+                            lego_exit.result(),
+                            request["certificate_signing_request"],
+                            started,
+                        )
+                    yield digest, request, certificates
+
+    def _revoke_certificates(self, revocations: Dict[str, Dict]) -> None:
+        """Revokes certificates at the ACME server and removes lego's files for them.
+
+        Certificates are revoked in the order given, in batches of REVOCATION_BATCH_SIZE, one
+        `lego revoke` process per batch, with up to `max-concurrent-orders` processes running at
+        the same time. Once the hook has run for `hook-time-budget` seconds, including the time
+        spent getting certificates, no more batches are started.
+
+        Certificates obtained with another ACME account than the one lego holds for this unit,
+        which happens when the lego container's filesystem was lost, are given up.
+
+        Args:
+            revocations (dict): Revocations, keyed by CSR digest, most urgent first
+        """
+        remaining = list(self._revocable(revocations).items())
+        batches = []
+        while remaining:
+            batches.append(remaining[:REVOCATION_BATCH_SIZE])
+            del remaining[:REVOCATION_BATCH_SIZE]
+        while batches:
+            if self._hook_time_budget_spent:
+                logger.info(
+                    "Hook time budget spent, leaving %d revocation batch(es)", len(batches)
+                )
+                return
+            window_size = self.config["max-concurrent-orders"]
+            window = batches[:window_size]
+            del batches[:window_size]
+            processes = [self._start_revocation(batch) for batch in window]
+            for batch, process in zip(window, processes):
+                revoked_names = self._finish_revocation(
+                    process, [f"{REVOCATION_FILE_PREFIX}{digest}" for digest, _ in batch]
+                )
+                for digest, revocation in batch:
+                    revoked = f"{REVOCATION_FILE_PREFIX}{digest}" in revoked_names
+                    if revoked:
+                        name = find_certificate_name(self._container, revocation["certificate"])
+                        if name:
+                            remove_certificate_files(self._container, name)
+                    remove_certificate_files(self._container, f"{REVOCATION_FILE_PREFIX}{digest}")
+                    self._scheduler.record_turn(revocation.get("relation_id"))
+                    self._complete_revocation(digest, revoked)
+
+    def _revocable(self, revocations: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Returns the revocations this unit's ACME account can make, giving up the others.
+
+        Args:
+            revocations (dict): Revocations, keyed by CSR digest
+
+        Returns:
+            dict: Revocations of certificates obtained with this unit's account or an unknown
+                one, keyed by CSR digest
+        """
+        own_account = self._acme_account
+        revocable = {}
+        for digest, revocation in revocations.items():
+            account = revocation.get("account")
+            if account and account != own_account:
+                logger.error(
+                    "ACME account that obtained the certificate for CSR %s is gone, it cannot "
+                    "be revoked",
+                    digest,
+                )
+                self._complete_revocation(digest, False)
+                continue
+            revocable[digest] = revocation
+        return revocable
+
+    def _start_revocation(self, batch: List[Tuple[str, Dict]]) -> ExecProcess:
+        """Starts a lego process revoking a batch of certificates.
+
+        lego revokes the certificates it finds in its output directory under the names it is
+        given, so each certificate is pushed there under a name of its own. lego's files for
+        the certificate may already hold a newer certificate for the same domains.
+
+        Args:
+            batch (list): CSR digests and revocations
+
+        Returns:
+            ExecProcess: lego process
+        """
+        lego_cmd = ["lego", "--email", self._email, "--server", self._server]
+        for digest, revocation in batch:
+            name = f"{REVOCATION_FILE_PREFIX}{digest}"
+            self._container.push(
+                path=f"{LEGO_CERTIFICATES_PATH}/{name}.crt",
+                make_dirs=True,
+                source=revocation["certificate"],
+            )
+            lego_cmd.extend(["--domains", name])
+        lego_cmd.extend(["revoke", "--keep"])
+        logger.info("Revoking %d certificate(s)", len(batch))
+        return self._container.exec(lego_cmd, timeout=300, working_dir="/tmp")
+
+    def _finish_revocation(self, process: ExecProcess, names: List[str]) -> Set[str]:
+        """Waits for a `lego revoke` process and returns the names it revoked.
+
+        lego stops at the first certificate it cannot revoke, the certificates before it are
+        revoked.
+
+        Args:
+            process (ExecProcess): lego process
+            names (list): Names of the certificates, as given to lego
+
+        Returns:
+            set: Names of the revoked certificates
+        """
+        try:
+            process.wait_output()
+        except ExecError as e:
+            self.unit.status = BlockedStatus("Error revoking certificate. Check logs for details")
+            logger.error("Exited with code %d. Stderr:", e.exit_code)
+            for line in e.stderr.splitlines():  # type: ignore
+                logger.error("    %s", line)
+            return set(revoked_domains(e.stderr or "")) & set(names)
+        return set(names)
+
+    @property
+    def _hook_time_budget_spent(self) -> bool:
+        return time.monotonic() - self._hook_started >= self.config["hook-time-budget"]
+
+    def _authoritative_resolvers(self, requests: Dict[str, Dict]) -> Dict[str, Zone]:
+        """Looks up the zone and authoritative nameservers of every name of a batch of requests.
+
+        Args:
+            requests (dict): Requests, keyed by CSR digest
+
+        Returns:
+            dict: Zones, keyed by domain name. Empty unless `authoritative-propagation-check`
+                is enabled.
+        """
+        if not self.config["authoritative-propagation-check"]:
+            return {}
+        resolver = system_resolver()
+        if not resolver:
+            logger.warning("No DNS resolver configured, using lego's default propagation check")
+            return {}
+        domains = set()
+        for request in requests.values():
+            try:
+                csr = x509.load_pem_x509_csr(request["certificate_signing_request"].encode())
+            except ValueError:
+                continue
+            domains.update(csr_domains(csr))
+        return find_authoritative_nameservers(domains, resolver)
+
+    def _start_order(
+        self, digest: str, certificate_signing_request: str, resolvers: Dict[str, Zone]
+    ) -> Optional[ExecProcess]:
+        """Starts a lego process getting a certificate for the CSR from the ACME server.
+
+        lego checks propagation against the authoritative nameservers only when all the names
+        of the CSR are in the same zone, as a nameserver refuses queries for zones it does not
+        serve. Other CSRs use lego's default propagation check.
+
+        Args:
+            digest (str): CSR digest
+            certificate_signing_request (str): Certificate signing request
+            resolvers (dict): Zones to check propagation against, by domain name
+
+        Returns:
+            ExecProcess: lego process, None if the CSR is not valid.
+        """
+        try:
+            with self._metrics.timer("csr_parse"):
+                csr = x509.load_pem_x509_csr(certificate_signing_request.encode())
+                domains = csr_domains(csr)
+        except Exception:
+            logger.exception("Bad CSR received, aborting")
+            self._metrics.count_outcome(INVALID_CSR)
+            return None
+
+        csr_path = f"/tmp/csr-{digest}.pem"
+        with self._metrics.timer("push"):
+            self._container.push(
+                path=csr_path, make_dirs=True, source=certificate_signing_request.encode()
+            )
+
+        logger.info("Getting certificate for domain(s) %s", ", ".join(domains))
         lego_cmd = [
             "lego",
             "--email",
             self._email,
             "--accept-tos",
             "--csr",
-            "/tmp/csr.pem",
+            csr_path,
             "--server",
             self._server,
             "--dns",
             self._plugin,
-            "run",
         ]
+        zones = [zone for zone in (resolvers.get(domain) for domain in domains) if zone]
+        if len(zones) == len(domains) and len({zone.name for zone in zones}) == 1:
+            for nameserver in sorted(zones[0].nameservers):
+                lego_cmd.extend(["--dns.resolvers", f"{nameserver}:{DNS_PORT}"])
+        lego_cmd.append("run")
 
-        process = self._container.exec(
+        return self._container.exec(
             lego_cmd, timeout=300, working_dir="/tmp", environment=self._plugin_configs
         )
-        try:
-            stdout, error = process.wait_output()
-            logger.info(f"Return message: {stdout}, {error}")
-        except ExecError as e:
+
+    def _finish_order(
+        self, digest: str, lego_exit: LegoExit, certificate_signing_request: str, started: float
+    ) -> Optional[List[str]]:
+        """Returns the certificate chain a lego process obtained once it exited.
+
+        The processes of a window are waited for at the same time, each order is timed from the
+        start of its process to its exit.
+
+        Args:
+            digest (str): CSR digest
+            lego_exit (LegoExit): Outcome of the lego process
+            certificate_signing_request (str): Certificate signing request
+            started (float): Monotonic time at which the lego process was started
+
+        Returns:
+            list: Certificate chain, None if the certificate could not be obtained.
+        """
+        exec_seconds = lego_exit.exited - started
+        lego_log = lego_exit.log
+        if lego_exit.error:
+            self._record_order(
+                digest,
+                certificate_signing_request,
+                LEGO_ERROR,
+                exec_seconds,
+                lego_log,
+                lego_exit.exited_at,
+            )
             self.unit.status = BlockedStatus("Error getting certificate. Check logs for details")
-            logger.error("Exited with code %d. Stderr:", e.exit_code)
-            for line in e.stderr.splitlines():  # type: ignore
+            logger.error("Exited with code %d. Stderr:", lego_exit.error.exit_code)
+            for line in lego_log.splitlines():
                 logger.error("    %s", line)
-            return
+            return None
+
+        with self._metrics.timer("pull"):
+            certificates = find_certificate_chain(self._container, certificate_signing_request)
+        if not certificates:
+            self._record_order(
+                digest,
+                certificate_signing_request,
+                CERTIFICATE_NOT_FOUND,
+                exec_seconds,
+                lego_log,
+                lego_exit.exited_at,
+            )
+            self.unit.status = BlockedStatus("Could not find certificate obtained by lego")
+            logger.error("No certificate matching the CSR in lego's output")
+            return None
+        self._record_order(
+            digest,
+            certificate_signing_request,
+            ISSUED,
+            exec_seconds,
+            lego_log,
+            lego_exit.exited_at,
+        )
+        return certificates
+
+    def _record_order(
+        self,
+        digest: str,
+        certificate_signing_request: str,
+        outcome: str,
+        exec_seconds: float,
+        lego_log: Optional[str],
+        exited_at: int,
+    ) -> None:
+        """Records an order in the metrics, the rate limits and the list of recent orders.
 
-        chain_pem = self._container.pull(path=f"/tmp/.lego/certificates/{subject}.crt")
-        certs = []
-        for cert in chain_pem.read().split("\n\n"):
-            certs.append(cert)
+        The steps lego logged are attached to the order, and the time spent in each of them is
+        added to the metrics.
 
-        self.tls_certificates.set_relation_certificate(
-            certificate=certs[0],
-            certificate_signing_request=event.certificate_signing_request,
-            ca=certs[-1],
-            chain=list(reversed(certs)),
-            relation_id=event.relation_id,
+        Args:
+            digest (str): CSR digest
+            certificate_signing_request (str): Certificate signing request
+            outcome (str): Outcome of the order
+            exec_seconds (float): Time lego ran for
+            lego_log (str): lego stderr
+            exited_at (int): Time lego exited at, in nanoseconds since the epoch
+        """
+        events = parse_lego_log(lego_log or "")
+        for event in events:
+            logger.info(
+                "lego %s%s at %s",
+                event.name,
+                f" for {event.domain}" if event.domain else "",
+                event.timestamp.isoformat(),
+            )
+        self._metrics.observe("lego_exec", exec_seconds)
+        for phase, seconds in phase_durations(events).items():
+            self._metrics.observe(f"acme_{phase}", seconds)
+        self._metrics.count_outcome(outcome)
+        self._rate_limits.record_order(datetime.utcnow())
+        if self._tracer:
+            exec_span = self._tracer.start_span(
+                "lego.exec",
+                attributes={"csr.digest": digest, "outcome": outcome},
+                start_time=exited_at - int(exec_seconds * 1e9),
+            )
+            exec_span.end(end_time=exited_at)
+        self._stored.recent_orders.append(
+            {
+                "csr_digest": digest,
+                "finished": datetime.utcfromtimestamp(exited_at / 1e9).isoformat(),
+                "duration": exec_seconds,
+                "outcome": outcome,
+                "events": [
+                    {
+                        "name": event.name,
+                        "timestamp": event.timestamp.isoformat(),
+                        "domain": event.domain,
+                    }
+                    for event in events
+                ],
+            }
         )
+        while len(self._stored.recent_orders) > RECENT_ORDERS_LIMIT:
+            del self._stored.recent_orders[0]
 
     @property
     def _plugin_configs(self) -> Dict[str, str]:
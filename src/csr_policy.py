@@ -0,0 +1,140 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Checks certificate signing requests against what lego and the ACME server can issue.
+
+A CSR is rejected when its signature does not verify, when its key is of a type or size the
+certificate authority refuses, when it has names other than DNS names or more names than
+allowed, or when one of its names is not a valid host name or is outside the domains the DNS
+plugin manages. The limits default to those of Let's Encrypt and can be tightened in the charm
+configuration.
+"""
+
+import re
+from typing import Any, List, Mapping, Optional
+
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+from lego_output import csr_domains
+
+RSA_MAX_KEY_SIZE = 4096
+SUPPORTED_CURVES = ("secp256r1", "secp384r1")
+MAX_DOMAIN_LENGTH = 253
+DNS_LABEL = re.compile(r"^(?!-)[a-z0-9-]{1,63}(?<!-)$")
+
+
+def _split_list(value: str) -> List[str]:
+    return [item.strip().lower().rstrip(".") for item in value.split(",") if item.strip()]
+
+
+class CSRPolicy:
+    """Rules a CSR must follow for the charm to place an ACME order for it."""
+
+    def __init__(
+        self,
+        allowed_domains: List[str],
+        key_types: List[str],
+        min_rsa_key_size: int,
+        max_domains: int,
+    ):
+        self._allowed_domains = allowed_domains
+        self._key_types = key_types
+        self._min_rsa_key_size = min_rsa_key_size
+        self._max_domains = max_domains
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> "CSRPolicy":
+        """Returns the policy set in the charm configuration.
+
+        Args:
+            config: Charm configuration
+
+        Returns:
+            CSRPolicy: Policy
+        """
+        return cls(
+            allowed_domains=_split_list(config["allowed-domains"]),
+            key_types=_split_list(config["allowed-key-types"]),
+            min_rsa_key_size=config["min-rsa-key-size"],
+            max_domains=config["max-csr-domains"],
+        )
+
+    def check(self, csr: x509.CertificateSigningRequest) -> Optional[str]:
+        """Returns why a CSR is rejected.
+
+        Args:
+            csr: Certificate signing request
+
+        Returns:
+            str: Reason for rejecting the CSR, None if it is accepted.
+        """
+        if not csr.is_signature_valid:
+            return "CSR signature is not valid"
+        return self._check_key(csr.public_key()) or self._check_names(csr)
+
+    def _check_key(self, public_key) -> Optional[str]:
+        """Returns why the key of a CSR is rejected, None if it is accepted."""
+        if isinstance(public_key, rsa.RSAPublicKey):
+            if "rsa" not in self._key_types:
+                return "RSA keys are not allowed"
+            if not self._min_rsa_key_size <= public_key.key_size <= RSA_MAX_KEY_SIZE:
+                return (
+                    f"RSA key size {public_key.key_size} is not between "
+                    f"{self._min_rsa_key_size} and {RSA_MAX_KEY_SIZE}"
+                )
+            return None
+        if isinstance(public_key, ec.EllipticCurvePublicKey):
+            if "ecdsa" not in self._key_types:
+                return "ECDSA keys are not allowed"
+            if public_key.curve.name not in SUPPORTED_CURVES:
+                return f"Elliptic curve {public_key.curve.name} is not supported"
+            return None
+        return f"{type(public_key).__name__} keys are not supported"
+
+    def _check_names(self, csr: x509.CertificateSigningRequest) -> Optional[str]:
+        """Returns why the names of a CSR are rejected, None if they are accepted."""
+        try:
+            extension = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+            if len(extension.value) > len(extension.value.get_values_for_type(x509.DNSName)):
+                return "CSR has subject alternative names other than DNS names"
+        except x509.ExtensionNotFound:
+            pass
+        domains = csr_domains(csr)
+        if not domains:
+            return "CSR has neither a common name nor DNS names"
+        if len(domains) > self._max_domains:
+            return f"CSR has {len(domains)} names, at most {self._max_domains} are allowed"
+        for domain in domains:
+            if not self._is_valid_domain(domain):
+                return f"{domain} is not a valid domain name"
+            if not self._is_allowed_domain(domain):
+                return f"{domain} is not in the allowed domains"
+        return None
+
+    @staticmethod
+    def _is_valid_domain(domain: str) -> bool:
+        """Returns whether a name is a host name, or the wildcard of one."""
+        try:
+            ascii_domain = domain.encode("idna").decode().lower()
+        except UnicodeError:
+            return False
+        labels = ascii_domain.split(".")
+        if labels[0] == "*":
+            labels = labels[1:]
+        return (
+            len(ascii_domain) <= MAX_DOMAIN_LENGTH
+            and bool(labels)
+            and all(DNS_LABEL.match(label) for label in labels)
+        )
+
+    def _is_allowed_domain(self, domain: str) -> bool:
+        """Returns whether a name is within one of the allowed domains, if any are set."""
+        if not self._allowed_domains:
+            return True
+        name = domain.lower().rstrip(".")
+        if name.startswith("*."):
+            name = name[2:]
+        return any(
+            name == allowed or name.endswith(f".{allowed}") for allowed in self._allowed_domains
+        )
@@ -0,0 +1,228 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Discovers the authoritative nameservers lego checks DNS-01 challenge propagation against.
+
+lego waits for challenge TXT records to propagate by querying recursive resolvers before asking
+the ACME server to validate them. Pointing that check at the authoritative nameservers of the
+zone holding the challenge records avoids waiting on resolver caches. The zone of a name is found
+by walking up its labels until one has NS records, so that delegated subzones and names under
+multi-label public suffixes resolve to the zone that actually serves them. The lookups for every
+name of a batch run at the same time, with a bounded number of workers and a bounded timeout.
+"""
+
+import logging
+import random
+import socket
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DNS_PORT = 53
+NS_RECORD_TYPE = 2
+IN_CLASS = 1
+NXDOMAIN_CODE = 3
+RESOLV_CONF_PATH = "/etc/resolv.conf"
+
+
+class DNSQueryError(Exception):
+    """Raised when a DNS query fails or returns a malformed response."""
+
+
+class NameNotFoundError(DNSQueryError):
+    """Raised when a DNS query is answered with NXDOMAIN."""
+
+
+class Zone(NamedTuple):
+    """DNS zone and its authoritative nameservers."""
+
+    name: str
+    nameservers: List[str]
+
+
+def _encode_name(name: str) -> bytes:
+    encoded = b""
+    for label in name.rstrip(".").split("."):
+        encoded += struct.pack("!B", len(label)) + label.encode("idna")
+    return encoded + b"\x00"
+
+
+def _read_name(message: bytes, offset: int) -> Tuple[str, int]:
+    """Reads a possibly compressed domain name from a DNS message.
+
+    Args:
+        message (bytes): DNS message
+        offset (int): Offset of the name in the message
+
+    Returns:
+        tuple: Name and offset of the first byte after the name.
+    """
+    labels: List[str] = []
+    end_offset = None
+    for _ in range(len(message)):
+        if offset >= len(message):
+            raise DNSQueryError("Truncated name in DNS response")
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(message):
+                raise DNSQueryError("Truncated name in DNS response")
+            if end_offset is None:
+                end_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            continue
+        if length == 0:
+            return ".".join(labels), end_offset if end_offset is not None else offset + 1
+        label_start = offset + 1
+        offset = label_start + length
+        labels.append(message[label_start:offset].decode())
+    raise DNSQueryError("Name compression loop in DNS response")
+
+
+def _check_response_header(response: bytes, query_id: int, name: str) -> Tuple[int, int]:
+    """Checks the header of a DNS response.
+
+    Args:
+        response (bytes): DNS response
+        query_id (int): ID of the query
+        name (str): Queried name
+
+    Returns:
+        tuple: Number of questions and number of answers in the response.
+    """
+    if len(response) < 12:
+        raise DNSQueryError("Truncated DNS response")
+    response_id, flags, question_count, answer_count, _, _ = struct.unpack(
+        "!HHHHHH", response[:12]
+    )
+    if response_id != query_id:
+        raise DNSQueryError("Unexpected DNS response ID")
+    if flags & 0x000F == NXDOMAIN_CODE:
+        raise NameNotFoundError(f"{name} does not exist")
+    if flags & 0x000F:
+        raise DNSQueryError(f"DNS query for {name} failed with code {flags & 0x000F}")
+    return question_count, answer_count
+
+
+def query_nameservers(zone: str, resolver: Tuple[str, int], timeout: float = 2.0) -> List[str]:
+    """Queries a resolver for the NS records of a zone.
+
+    Args:
+        zone (str): DNS zone
+        resolver (tuple): Resolver address and port
+        timeout (float): Query timeout, in seconds
+
+    Returns:
+        list: Nameserver host names.
+    """
+    query_id = random.randint(0, 0xFFFF)
+    query = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    query += _encode_name(zone) + struct.pack("!HH", NS_RECORD_TYPE, IN_CLASS)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(query, resolver)
+            response, _ = sock.recvfrom(4096)
+        except OSError as e:
+            raise DNSQueryError(f"Could not query {resolver[0]} for {zone}: {e}") from e
+    question_count, answer_count = _check_response_header(response, query_id, zone)
+    offset = 12
+    for _ in range(question_count):
+        _, offset = _read_name(response, offset)
+        offset += 4
+    nameservers = []
+    for _ in range(answer_count):
+        _, offset = _read_name(response, offset)
+        record_start = offset
+        offset = record_start + 10
+        if offset > len(response):
+            raise DNSQueryError("Truncated DNS response")
+        record_type, _, _, data_length = struct.unpack("!HHIH", response[record_start:offset])
+        if record_type == NS_RECORD_TYPE:
+            nameservers.append(_read_name(response, offset)[0])
+        offset += data_length
+    return nameservers
+
+
+def system_resolver() -> Optional[Tuple[str, int]]:
+    """Returns the first IPv4 nameserver configured in resolv.conf.
+
+    Returns:
+        tuple: Resolver address and port, None if none is configured.
+    """
+    try:
+        with open(RESOLV_CONF_PATH) as resolv_conf:
+            for line in resolv_conf:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == "nameserver" and ":" not in fields[1]:
+                    return fields[1], DNS_PORT
+    except OSError:
+        logger.warning("Could not read %s", RESOLV_CONF_PATH)
+    return None
+
+
+def find_zone(domain: str, resolver: Tuple[str, int], timeout: float = 2.0) -> Optional[Zone]:
+    """Finds the zone a name belongs to and its authoritative nameservers.
+
+    The name and then each of its parents are queried for NS records, and the first one that has
+    some is the zone. Top-level domains are never returned.
+
+    Args:
+        domain (str): Domain name, possibly a wildcard
+        resolver (tuple): Resolver address and port
+        timeout (float): Timeout of each query, in seconds
+
+    Returns:
+        Zone: Zone, None if no zone was found.
+    """
+    labels = domain.lower().rstrip(".").split(".")
+    if labels[0] == "*":
+        labels = labels[1:]
+    for index in range(len(labels) - 1):
+        name = ".".join(labels[index:])
+        try:
+            nameservers = query_nameservers(name, resolver, timeout)
+        except NameNotFoundError:
+            continue
+        if nameservers:
+            return Zone(name=name, nameservers=nameservers)
+    return None
+
+
+def find_authoritative_nameservers(
+    domains: Iterable[str],
+    resolver: Tuple[str, int],
+    timeout: float = 2.0,
+    max_workers: int = 8,
+) -> Dict[str, Zone]:
+    """Finds the zones of several names and their authoritative nameservers concurrently.
+
+    Names whose lookup fails are left out, so that lego falls back to its default check for them.
+
+    Args:
+        domains (iterable): Domain names
+        resolver (tuple): Resolver address and port
+        timeout (float): Timeout of each query, in seconds
+        max_workers (int): Maximum number of concurrent lookups
+
+    Returns:
+        dict: Zones, keyed by domain name.
+    """
+    unique_domains = sorted(set(domains))
+    if not unique_domains:
+        return {}
+
+    def lookup(domain: str) -> Tuple[str, Optional[Zone]]:
+        try:
+            zone = find_zone(domain, resolver, timeout)
+        except DNSQueryError as e:
+            logger.warning("Could not find the zone of %s: %s", domain, e)
+            return domain, None
+        if not zone:
+            logger.warning("Could not find the zone of %s", domain)
+        return domain, zone
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_domains))) as executor:
+        results = executor.map(lookup, unique_domains)
+    return {domain: zone for domain, zone in results if zone}
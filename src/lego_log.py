@@ -0,0 +1,116 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Turns lego's log output into structured issuance events.
+
+lego logs every step of an order to stderr, one line per step, prefixed with a timestamp and,
+for steps specific to a domain, the domain in brackets. The steps of interest are recognised by
+their message, which gives the time at which each phase of the order started.
+
+lego does not log the end of the DNS propagation wait, so that wait and the validation of the
+challenge by the ACME server are both covered by the `propagation_check` phase.
+
+`lego revoke` logs without a level, one line when it starts revoking the certificate of a
+domain and one once the certificate is revoked.
+"""
+
+import re
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+LEGO_LOG_LINE = re.compile(
+    r"^(?P<timestamp>\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}) \[(?P<level>[A-Z]+)\] "
+    r"(?:\[(?P<domain>[^\]]+)\] )?(?P<message>.*)$"
+)
+LEGO_TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
+REVOKING_MESSAGE = re.compile(r"Trying to revoke certificate for domain (?P<domain>\S+)")
+REVOKED_MESSAGE = "Certificate was revoked."
+
+EVENT_MESSAGES = (
+    ("account_registration", "acme: Registering account"),
+    ("order_created", "acme: Obtaining"),
+    ("challenge_presented", "acme: Trying to solve DNS-01"),
+    ("propagation_check", "acme: Checking DNS record propagation"),
+    ("validated", "The server validated our request"),
+    ("finalize", "acme: Validations succeeded; requesting certificates"),
+    ("certificate_obtained", "Server responded with a certificate"),
+)
+
+
+class LegoLogEvent(NamedTuple):
+    """Step of an ACME order, as logged by lego."""
+
+    name: str
+    timestamp: datetime
+    domain: Optional[str]
+
+
+def parse_lego_log(output: str) -> List[LegoLogEvent]:
+    """Returns the issuance events found in lego's log output.
+
+    Lines that are not lego log lines, or whose message is not a known step, are skipped.
+
+    Args:
+        output (str): lego stderr
+
+    Returns:
+        list: Events, in the order they were logged.
+    """
+    events = []
+    for line in output.splitlines():
+        match = LEGO_LOG_LINE.match(line.strip())
+        if not match:
+            continue
+        for name, message in EVENT_MESSAGES:
+            if match.group("message").startswith(message):
+                events.append(
+                    LegoLogEvent(
+                        name=name,
+                        timestamp=datetime.strptime(
+                            match.group("timestamp"), LEGO_TIMESTAMP_FORMAT
+                        ),
+                        domain=match.group("domain"),
+                    )
+                )
+                break
+    return events
+
+
+def phase_durations(events: List[LegoLogEvent]) -> Dict[str, float]:
+    """Returns the time spent in each phase of an order.
+
+    A phase starts with an event and lasts until the next one. The durations of the phases of
+    several domains are added up.
+
+    Args:
+        events (list): Events, in the order they were logged
+
+    Returns:
+        dict: Durations in seconds, keyed by the name of the event starting the phase.
+    """
+    durations: Dict[str, float] = {}
+    for event, next_event in zip(events, events[1:]):
+        seconds = (next_event.timestamp - event.timestamp).total_seconds()
+        durations[event.name] = durations.get(event.name, 0.0) + seconds
+    return durations
+
+
+def revoked_domains(output: str) -> List[str]:
+    """Returns the domains whose certificate `lego revoke` revoked.
+
+    Args:
+        output (str): lego stderr
+
+    Returns:
+        list: Domains, as given to lego, in the order they were revoked.
+    """
+    domains = []
+    revoking = None
+    for line in output.splitlines():
+        match = REVOKING_MESSAGE.search(line)
+        if match:
+            revoking = match.group("domain")
+        elif REVOKED_MESSAGE in line and revoking:
+            domains.append(revoking)
+            revoking = None
+    return domains
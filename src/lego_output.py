@@ -0,0 +1,213 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Locates the certificates and ACME account lego keeps in the lego container."""
+
+import json
+import logging
+import os
+from typing import Iterator, List, Optional, Union
+from urllib.parse import urlparse
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.x509.oid import NameOID
+from ops.model import Container
+from ops.pebble import APIError, PathError
+
+logger = logging.getLogger(__name__)
+
+LEGO_CERTIFICATES_PATH = "/tmp/.lego/certificates"
+LEGO_ACCOUNTS_PATH = "/tmp/.lego/accounts"
+LEGO_OUTPUT_EXTENSIONS = (".crt", ".issuer.crt", ".key", ".json", ".pem", ".pfx")
+
+
+def csr_domains(csr: Union[x509.CertificateSigningRequest, x509.Certificate]) -> List[str]:
+    """Returns the domains of a CSR or certificate in the order lego uses them.
+
+    The common name comes first, followed by the DNS subject alternative names. lego names its
+    output files after the first of those domains.
+
+    Args:
+        csr: Certificate signing request or certificate
+
+    Returns:
+        list: Domains, without duplicates.
+    """
+    domains = [
+        str(attribute.value)
+        for attribute in csr.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    ]
+    try:
+        extension = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        domains.extend(extension.value.get_values_for_type(x509.DNSName))
+    except x509.ExtensionNotFound:
+        pass
+    return list(dict.fromkeys(domain for domain in domains if domain))
+
+
+def sanitized_domain(domain: str) -> str:
+    """Returns the file name lego uses for a domain.
+
+    lego replaces the wildcard label with an underscore and stores internationalized names in
+    their ASCII form.
+
+    Args:
+        domain (str): Domain name
+
+    Returns:
+        str: File name, without extension.
+    """
+    try:
+        domain = domain.encode("idna").decode()
+    except UnicodeError:
+        pass
+    return domain.replace("*", "_")
+
+
+def _public_key_bytes(public_key) -> bytes:
+    return public_key.public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+def _candidate_names(container: Container, domains: List[str]) -> Iterator[str]:
+    """Yields the names of the lego output files that may hold the certificate for the domains.
+
+    The file lego is expected to write for the first domain comes first. The JSON resource
+    metadata of the other files is only read when the caller asks for more names, and any file
+    whose metadata lists one of the domains follows.
+
+    Args:
+        container (Container): lego container
+        domains (list): CSR domains
+
+    Yields:
+        str: File names, without extension.
+    """
+    expected_name = sanitized_domain(domains[0]) if domains else None
+    if expected_name:
+        yield expected_name
+    try:
+        metadata_files = container.list_files(LEGO_CERTIFICATES_PATH, pattern="*.json")
+    except APIError:
+        return
+    for metadata_file in metadata_files:
+        name = os.path.splitext(metadata_file.name)[0]
+        if name == expected_name:
+            continue
+        try:
+            metadata = json.loads(container.pull(metadata_file.path).read())
+        except (PathError, ValueError):
+            continue
+        if isinstance(metadata, dict) and metadata.get("domain") in domains:
+            yield name
+
+
+def _read_chain(container: Container, name: str) -> List[str]:
+    """Returns the certificates of a lego output file, empty if the file does not exist."""
+    try:
+        chain_pem = container.pull(f"{LEGO_CERTIFICATES_PATH}/{name}.crt").read()
+    except PathError:
+        return []
+    return [certificate for certificate in chain_pem.split("\n\n") if certificate.strip()]
+
+
+def find_certificate_chain(
+    container: Container, certificate_signing_request: str
+) -> Optional[List[str]]:
+    """Returns the certificate chain lego obtained for a CSR.
+
+    The leaf certificate of each candidate file must carry the CSR's public key, so that a file
+    left over from a previous order for the same domain is never mistaken for the result.
+
+    Args:
+        container (Container): lego container
+        certificate_signing_request (str): Certificate signing request
+
+    Returns:
+        list: PEM certificates, leaf first, None if no matching certificate was found.
+    """
+    csr = x509.load_pem_x509_csr(certificate_signing_request.encode())
+    csr_public_key = _public_key_bytes(csr.public_key())
+    for name in _candidate_names(container, csr_domains(csr)):
+        certificates = _read_chain(container, name)
+        if not certificates:
+            continue
+        try:
+            leaf = x509.load_pem_x509_certificate(certificates[0].encode())
+        except ValueError:
+            logger.warning("Could not load certificate from %s.crt", name)
+            continue
+        if _public_key_bytes(leaf.public_key()) == csr_public_key:
+            return certificates
+        logger.info("Certificate in %s.crt does not match the CSR public key", name)
+    return None
+
+
+def find_certificate_name(container: Container, certificate: str) -> Optional[str]:
+    """Returns the name of the lego output files holding a certificate.
+
+    Args:
+        container (Container): lego container
+        certificate (str): PEM certificate
+
+    Returns:
+        str: File name, without extension, None if no output file holds the certificate.
+    """
+    try:
+        wanted = x509.load_pem_x509_certificate(certificate.encode())
+    except ValueError:
+        return None
+    for name in _candidate_names(container, csr_domains(wanted)):
+        certificates = _read_chain(container, name)
+        if not certificates:
+            continue
+        try:
+            leaf = x509.load_pem_x509_certificate(certificates[0].encode())
+        except ValueError:
+            continue
+        if leaf == wanted:
+            return name
+    return None
+
+
+def acme_account(container: Container, server: str, email: str) -> Optional[str]:
+    """Returns the URI of the ACME account lego registered with a server for an email address.
+
+    lego registers the account on its first order and keeps it in its accounts directory,
+    under the server host name. The account is lost with the lego container's filesystem.
+
+    Args:
+        container (Container): lego container
+        server (str): ACME directory URL
+        email (str): Account email address
+
+    Returns:
+        str: Account URI, None if lego has no account for the server and email address.
+    """
+    host = (urlparse(server).netloc or server).replace(":", "_")
+    path = f"{LEGO_ACCOUNTS_PATH}/{host}/{email}/account.json"
+    if not container.exists(path):
+        return None
+    try:
+        account = json.loads(container.pull(path).read())
+    except (PathError, ValueError):
+        return None
+    registration = account.get("registration") if isinstance(account, dict) else None
+    if not isinstance(registration, dict):
+        return None
+    return registration.get("uri") or None
+
+
+def remove_certificate_files(container: Container, name: str) -> None:
+    """Removes the files lego wrote for a certificate.
+
+    Args:
+        container (Container): lego container
+        name (str): File name, without extension
+    """
+    for extension in LEGO_OUTPUT_EXTENSIONS:
+        path = f"{LEGO_CERTIFICATES_PATH}/{name}{extension}"
+        if container.exists(path):
+            container.remove_path(path)
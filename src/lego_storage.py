@@ -0,0 +1,107 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Garbage collection of lego's output directory in the lego container.
+
+lego writes a certificate, its issuer, its private key and its JSON metadata for every order,
+and never removes them. The files of a certificate are kept only while the certificate is
+served to a requirer and not expired, and only the most recently written certificates are kept
+beyond a given count. Certificates stay available in the charm's certificate store when their
+files are removed.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from ops.model import Container
+from ops.pebble import APIError, FileInfo, FileType, PathError
+
+from lego_output import LEGO_CERTIFICATES_PATH, LEGO_OUTPUT_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+
+class GarbageCollection(NamedTuple):
+    """Files removed by a garbage collection pass."""
+
+    removed_files: int
+    freed_bytes: int
+
+
+def certificate_fingerprint(certificate: str) -> Optional[bytes]:
+    """Returns the SHA-256 fingerprint of a PEM certificate.
+
+    Args:
+        certificate (str): PEM certificate, the first of a chain is used
+
+    Returns:
+        bytes: Fingerprint, None if the certificate cannot be loaded.
+    """
+    try:
+        return x509.load_pem_x509_certificate(certificate.encode()).fingerprint(hashes.SHA256())
+    except ValueError:
+        return None
+
+
+def _output_name(file_name: str) -> str:
+    """Returns the name of the certificate a lego output file belongs to."""
+    for extension in sorted(LEGO_OUTPUT_EXTENSIONS, key=len, reverse=True):
+        if file_name.endswith(extension):
+            return file_name[: -len(extension)]
+    return file_name
+
+
+def _is_served(container: Container, name: str, served: Set[bytes], now: datetime) -> bool:
+    """Returns whether the certificate of a lego output file name is served and not expired."""
+    try:
+        chain = container.pull(f"{LEGO_CERTIFICATES_PATH}/{name}.crt").read()
+        certificate = x509.load_pem_x509_certificate(chain.encode())
+    except (PathError, ValueError):
+        return False
+    if certificate.not_valid_after <= now:
+        return False
+    return certificate.fingerprint(hashes.SHA256()) in served
+
+
+def collect_garbage(
+    container: Container, served: Set[bytes], max_certificates: int, now: datetime
+) -> GarbageCollection:
+    """Removes the files of certificates that are not served, expired or beyond the count cap.
+
+    Args:
+        container (Container): lego container
+        served (set): Fingerprints of the certificates served to requirers
+        max_certificates (int): Maximum number of certificates to keep files for
+        now (datetime): Current time
+
+    Returns:
+        GarbageCollection: Number of files removed and bytes freed
+    """
+    try:
+        files = container.list_files(LEGO_CERTIFICATES_PATH)
+    except APIError:
+        return GarbageCollection(removed_files=0, freed_bytes=0)
+    outputs: Dict[str, List[FileInfo]] = {}
+    for file in files:
+        if file.type == FileType.FILE:
+            outputs.setdefault(_output_name(file.name), []).append(file)
+    garbage: List[FileInfo] = []
+    kept = []
+    for name, output_files in outputs.items():
+        if _is_served(container, name, served, now):
+            kept.append(output_files)
+        else:
+            garbage.extend(output_files)
+    kept.sort(
+        key=lambda output_files: max(file.last_modified for file in output_files), reverse=True
+    )
+    for output_files in kept[max_certificates:]:
+        garbage.extend(output_files)
+    for file in garbage:
+        container.remove_path(file.path)
+    return GarbageCollection(
+        removed_files=len(garbage), freed_bytes=sum(file.size or 0 for file in garbage)
+    )
@@ -0,0 +1,141 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Issuance metrics, exposed to Prometheus as a textfile in the lego container.
+
+Phase timings and order outcomes are kept in the charm's stored state so that they accumulate
+across hooks. The textfile is rewritten with the current queue depth and certificate expiries
+whenever the charm processes requests, for a node exporter textfile collector or any other
+scrape job that can read it.
+"""
+
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List
+
+METRICS_PATH = "/var/lib/lego-operator/metrics/lego.prom"
+
+PHASES = ("csr_parse", "push", "lego_exec", "pull", "relation_publish")
+
+ISSUED = "issued"
+INVALID_CSR = "invalid_csr"
+LEGO_ERROR = "lego_error"
+CERTIFICATE_NOT_FOUND = "certificate_not_found"
+
+
+def _label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class IssuanceMetrics:
+    """Records issuance metrics and renders them in the Prometheus text format.
+
+    The stored state must have `phase_durations`, `order_outcomes` and `garbage_collection`
+    dicts. Phase durations are recorded as a summary, with the total time and number of
+    observations of each phase. The phases of PHASES are always rendered, the steps of ACME
+    orders once they have been observed.
+    """
+
+    def __init__(self, stored):
+        self._stored = stored
+
+    def observe(self, phase: str, seconds: float) -> None:
+        """Records the duration of a phase of issuance.
+
+        Args:
+            phase (str): Phase, one of PHASES or a step of the ACME order
+            seconds (float): Duration of the phase
+        """
+        summary = self._stored.phase_durations.get(phase, {"count": 0, "sum": 0.0})
+        self._stored.phase_durations[phase] = {
+            "count": summary["count"] + 1,
+            "sum": summary["sum"] + seconds,
+        }
+
+    @contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        """Records the time spent in the body of a `with` statement as a phase duration.
+
+        Args:
+            phase (str): Phase, one of PHASES or a step of the ACME order
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.monotonic() - started)
+
+    def count_outcome(self, outcome: str) -> None:
+        """Counts an ACME order outcome.
+
+        Args:
+            outcome (str): Outcome of the order
+        """
+        self._stored.order_outcomes[outcome] = self._stored.order_outcomes.get(outcome, 0) + 1
+
+    def count_garbage(self, removed_files: int, freed_bytes: int) -> None:
+        """Counts the files removed from lego's output directory.
+
+        Args:
+            removed_files (int): Number of files removed
+            freed_bytes (int): Total size of the files removed
+        """
+        totals = self._stored.garbage_collection
+        totals["removed_files"] = totals.get("removed_files", 0) + removed_files
+        totals["freed_bytes"] = totals.get("freed_bytes", 0) + freed_bytes
+
+    def render(self, queue_depth: int, expiries: Dict[str, datetime]) -> str:
+        """Renders the metrics in the Prometheus text exposition format.
+
+        Args:
+            queue_depth (int): Number of requests waiting to be processed
+            expiries (dict): Certificate expiry times, keyed by certificate subject
+
+        Returns:
+            str: Metrics
+        """
+        lines: List[str] = [
+            "# HELP lego_phase_duration_seconds Time spent in each phase of issuance.",
+            "# TYPE lego_phase_duration_seconds summary",
+        ]
+        recorded_phases = set(self._stored.phase_durations.keys()) - set(PHASES)
+        for phase in PHASES + tuple(sorted(recorded_phases)):
+            summary = self._stored.phase_durations.get(phase, {"count": 0, "sum": 0.0})
+            lines.append(f'lego_phase_duration_seconds_sum{{phase="{phase}"}} {summary["sum"]}')
+            lines.append(
+                f'lego_phase_duration_seconds_count{{phase="{phase}"}} {summary["count"]}'
+            )
+        lines.extend(
+            [
+                "# HELP lego_orders_total ACME orders placed by this unit, by outcome.",
+                "# TYPE lego_orders_total counter",
+            ]
+        )
+        for outcome in (ISSUED, INVALID_CSR, LEGO_ERROR, CERTIFICATE_NOT_FOUND):
+            count = self._stored.order_outcomes.get(outcome, 0)
+            lines.append(f'lego_orders_total{{outcome="{outcome}"}} {count}')
+        lines.extend(
+            [
+                "# HELP lego_removed_files_total Files removed from lego's output directory.",
+                "# TYPE lego_removed_files_total counter",
+                "lego_removed_files_total "
+                f"{self._stored.garbage_collection.get('removed_files', 0)}",
+                "# HELP lego_freed_bytes_total Bytes freed in lego's output directory.",
+                "# TYPE lego_freed_bytes_total counter",
+                f"lego_freed_bytes_total {self._stored.garbage_collection.get('freed_bytes', 0)}",
+                "# HELP lego_pending_requests Certificate requests waiting to be processed.",
+                "# TYPE lego_pending_requests gauge",
+                f"lego_pending_requests {queue_depth}",
+                "# HELP lego_certificate_expiry_timestamp_seconds Expiry time of the stored "
+                "certificates.",
+                "# TYPE lego_certificate_expiry_timestamp_seconds gauge",
+            ]
+        )
+        for subject, expiry in sorted(expiries.items()):
+            timestamp = (expiry - datetime(1970, 1, 1)).total_seconds()
+            lines.append(
+                "lego_certificate_expiry_timestamp_seconds"
+                f'{{subject="{_label_value(subject)}"}} {timestamp}'
+            )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,122 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Finds the registered domain of a name with the Public Suffix List.
+
+Let's Encrypt counts certificates per registered domain, the public suffix of a name plus one
+label, as the Public Suffix List defines it, so that `foo.example.co.uk` and `bar.other.co.uk`
+have different registered domains. The list is shipped with the charm at build time, the one of
+the `publicsuffix` package is used otherwise. Without either, the registered domain is
+approximated as the last two labels of the name.
+"""
+
+import functools
+import logging
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_SUFFIX_LIST_PATHS = (
+    Path(__file__).resolve().parents[1] / "public_suffix_list.dat",
+    Path("/usr/share/publicsuffix/public_suffix_list.dat"),
+)
+
+
+class PublicSuffixList:
+    """Rules of the Public Suffix List.
+
+    See https://publicsuffix.org/list/ for the format of the rules and the matching algorithm.
+    """
+
+    def __init__(self, rules: Iterable[str]):
+        self._rules: Set[str] = set()
+        self._wildcards: Set[str] = set()
+        self._exceptions: Set[str] = set()
+        for line in rules:
+            rule = line.strip().split(" ", 1)[0].lower()
+            if not rule or rule.startswith("//"):
+                continue
+            rule = _ascii_name(rule)
+            if rule.startswith("!"):
+                self._exceptions.add(rule[1:])
+            elif rule.startswith("*."):
+                self._wildcards.add(rule[2:])
+            else:
+                self._rules.add(rule)
+
+    @classmethod
+    def from_file(cls, path: Path) -> "PublicSuffixList":
+        """Loads the rules of a Public Suffix List file.
+
+        Args:
+            path (Path): Path of the file
+
+        Returns:
+            PublicSuffixList: Rules of the file
+        """
+        with path.open(encoding="utf-8") as rules:
+            return cls(rules)
+
+    def registered_domain(self, domain: str) -> str:
+        """Returns the registered domain of a name.
+
+        Args:
+            domain (str): Domain name, possibly a wildcard
+
+        Returns:
+            str: Public suffix of the name plus one label, the name itself if it is a public
+                suffix.
+        """
+        labels = _ascii_name(domain.lower().rstrip(".")).split(".")
+        if labels[0] == "*":
+            labels = labels[1:]
+        start = max(len(labels) - self._public_suffix_length(labels) - 1, 0)
+        return ".".join(labels[start:])
+
+    def _public_suffix_length(self, labels: List[str]) -> int:
+        """Returns the number of labels of the public suffix of a name.
+
+        The longest matching rule wins, exception rules win over any other rule and a name no
+        rule matches has its top-level domain as public suffix.
+        """
+        length = 1
+        for index in range(len(labels)):
+            candidate = ".".join(labels[index:])
+            if candidate in self._exceptions:
+                return len(labels) - index - 1
+            parent = candidate.partition(".")[2]
+            if candidate in self._rules or parent in self._wildcards:
+                length = max(length, len(labels) - index)
+        return length
+
+
+def _ascii_name(name: str) -> str:
+    try:
+        return name.encode("idna").decode()
+    except UnicodeError:
+        return name
+
+
+@functools.lru_cache(maxsize=None)
+def _default_list() -> Optional[PublicSuffixList]:
+    for path in PUBLIC_SUFFIX_LIST_PATHS:
+        if path.exists():
+            return PublicSuffixList.from_file(path)
+    logger.warning("No Public Suffix List found, using the last two labels of names")
+    return None
+
+
+def registered_domain(domain: str) -> str:
+    """Returns the registered domain of a name, using the Public Suffix List of the charm.
+
+    Args:
+        domain (str): Domain name, possibly a wildcard
+
+    Returns:
+        str: Registered domain
+    """
+    public_suffix_list = _default_list()
+    if public_suffix_list:
+        return public_suffix_list.registered_domain(domain)
+    return ".".join(domain.lower().rstrip(".").split(".")[-2:])
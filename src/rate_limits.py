@@ -0,0 +1,137 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Tracks the ACME orders and certificates of the charm against the ACME server's rate limits.
+
+The limits are those Let's Encrypt applies to the ACME server the charm orders from, its
+production or its staging environment: new orders per account over three hours and certificates
+per registered domain over a week. The first limit applies to each ACME account, so each unit
+keeps its own orders in its stored state. The second applies to every account together, so the
+certificates obtained by all units are kept in a single list the caller replicates. Both are
+kept for as long as they count against a limit.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+NEW_ORDERS_WINDOW = timedelta(hours=3)
+CERTIFICATES_PER_DOMAIN_WINDOW = timedelta(days=7)
+
+
+class RateLimits(NamedTuple):
+    """Rate limits of an ACME server."""
+
+    new_orders: int
+    certificates_per_domain: int
+
+
+SERVER_RATE_LIMITS = {
+    "https://acme-v02.api.letsencrypt.org/directory": RateLimits(
+        new_orders=300, certificates_per_domain=50
+    ),
+    "https://acme-staging-v02.api.letsencrypt.org/directory": RateLimits(
+        new_orders=1500, certificates_per_domain=30000
+    ),
+}
+
+
+def server_rate_limits(server: str) -> Optional[RateLimits]:
+    """Returns the rate limits of an ACME server.
+
+    Args:
+        server (str): ACME directory URL
+
+    Returns:
+        RateLimits: Rate limits, None if the server's limits are not known.
+    """
+    return SERVER_RATE_LIMITS.get(server.rstrip("/"))
+
+
+def record_certificate(
+    issued_certificates: List[List[str]], registered_domain: str, fingerprint: str, now: datetime
+) -> List[List[str]]:
+    """Adds a certificate to the certificates obtained by all units.
+
+    A certificate served to several requests, as consolidated orders are, is only counted once.
+
+    Args:
+        issued_certificates (list): Time, registered domain and fingerprint of each certificate
+            obtained
+        registered_domain (str): Registered domain of the certificate
+        fingerprint (str): Fingerprint of the certificate
+        now (datetime): Time the certificate was obtained at
+
+    Returns:
+        list: Certificates that still count against the limit, the new one last.
+    """
+    recent_certificates = _recent_certificates(issued_certificates, now)
+    if any(entry[2] == fingerprint for entry in recent_certificates):
+        return recent_certificates
+    return recent_certificates + [[now.isoformat(), registered_domain, fingerprint]]
+
+
+def _recent_certificates(issued_certificates: List[List[str]], now: datetime) -> List[List[str]]:
+    """Returns the certificates that still count against the certificates per domain limit."""
+    return [
+        entry
+        for entry in issued_certificates
+        if datetime.fromisoformat(entry[0]) > now - CERTIFICATES_PER_DOMAIN_WINDOW
+    ]
+
+
+class RateLimitTracker:
+    """Records orders and reports the budget left under each rate limit.
+
+    The stored state must have an `order_times` list, holding the time of each order this unit
+    placed. The budget is reported against the limits of the ACME server orders are placed
+    with.
+    """
+
+    def __init__(self, stored, server: str):
+        self._stored = stored
+        self._server = server
+
+    def record_order(self, now: datetime) -> None:
+        """Records an order placed with the ACME server.
+
+        Args:
+            now (datetime): Time of the order
+        """
+        self._prune(now)
+        self._stored.order_times.append(now.isoformat())
+
+    def budget(self, now: datetime, issued_certificates: List[List[str]]) -> Dict:
+        """Returns the number of orders and certificates left under each rate limit.
+
+        Args:
+            now (datetime): Current time
+            issued_certificates (list): Time, registered domain and fingerprint of each
+                certificate obtained by any unit
+
+        Returns:
+            dict: ACME server, new orders left for this unit, and certificates left for each
+                registered domain that certificates were recently obtained for. Only the server
+                is given when its limits are not known.
+        """
+        self._prune(now)
+        limits = server_rate_limits(self._server)
+        if not limits:
+            return {"server": self._server}
+        certificates_left: Dict[str, int] = {}
+        for _, domain, _ in _recent_certificates(issued_certificates, now):
+            left = certificates_left.get(domain, limits.certificates_per_domain)
+            certificates_left[domain] = left - 1
+        return {
+            "server": self._server,
+            "new-orders-left": max(limits.new_orders - len(self._stored.order_times), 0),
+            "certificates-per-domain-left": {
+                domain: max(left, 0) for domain, left in sorted(certificates_left.items())
+            },
+        }
+
+    def _prune(self, now: datetime) -> None:
+        """Forgets the orders that no longer count against the new orders limit."""
+        while self._stored.order_times and (
+            datetime.fromisoformat(self._stored.order_times[0]) <= now - NEW_ORDERS_WINDOW
+        ):
+            del self._stored.order_times[0]
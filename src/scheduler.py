@@ -0,0 +1,108 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Orders the certificate requests and revocations a unit works on by urgency.
+
+Requests for a subject whose certificate has expired come first, then requests for a subject
+whose certificate expires within the renewal window, then new requests, then revocations of
+certificates that are no longer requested. Within a priority, relations take turns: the oldest
+request of each relation comes first, then the second oldest of each relation and so on, so
+that a requirer sending many CSRs at once does not hold up the requests of the others. Turns
+carry over from one hook to the next.
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+RENEWAL_WINDOW = timedelta(days=30)
+
+EXPIRED = 0
+EXPIRING = 1
+NEW = 2
+REVOCATION = 3
+
+PRIORITY_NAMES = {EXPIRED: "expired", EXPIRING: "expiring", NEW: "new", REVOCATION: "revocation"}
+
+
+def expiry_priority(expiry: Optional[datetime], now: datetime) -> int:
+    """Returns the priority of a request given the expiry of the certificate it replaces.
+
+    Args:
+        expiry (datetime): Expiry of the current certificate, None if there is none
+        now (datetime): Current time
+
+    Returns:
+        int: EXPIRED, EXPIRING or NEW
+    """
+    if expiry is None:
+        return NEW
+    if expiry <= now:
+        return EXPIRED
+    if expiry <= now + RENEWAL_WINDOW:
+        return EXPIRING
+    return NEW
+
+
+class RequestScheduler:
+    """Orders requests by urgency, with relations taking turns.
+
+    The number of requests of each relation worked on so far is kept in the stored state, which
+    must have a `relation_turns` dict, so that relations keep taking turns across hooks. A
+    relation that had no request waiting starts level with the least served waiting relation.
+    """
+
+    def __init__(self, stored):
+        self._stored = stored
+
+    def schedule(
+        self, requests: Dict[str, Dict], group_key: Optional[Callable[[Dict], str]] = None
+    ) -> List[Tuple[str, Dict]]:
+        """Returns requests in the order they should be worked on.
+
+        Args:
+            requests (dict): Requests, keyed by CSR digest
+            group_key (callable): Returns the group of a request. When given, the requests of
+                each relation are worked on group by group, still taking turns with the other
+                relations.
+
+        Returns:
+            list: CSR digests and requests, most urgent first.
+        """
+        self._update_turns({str(request.get("relation_id")) for request in requests.values()})
+        ordered_requests = sorted(
+            requests.items(), key=lambda item: item[1].get("received_at") or ""
+        )
+        if group_key:
+            ordered_requests.sort(key=lambda item: group_key(item[1]))
+        queue_lengths: Dict[Tuple[int, str], int] = {}
+        turns = {}
+        for digest, request in ordered_requests:
+            relation = str(request.get("relation_id"))
+            relation_queue = (request.get("priority", NEW), relation)
+            turns[digest] = self._stored.relation_turns[relation] + queue_lengths.get(
+                relation_queue, 0
+            )
+            queue_lengths[relation_queue] = queue_lengths.get(relation_queue, 0) + 1
+        return sorted(
+            ordered_requests,
+            key=lambda item: (item[1].get("priority", NEW), turns[item[0]]),
+        )
+
+    def record_turn(self, relation_id: Optional[int]) -> None:
+        """Records that a request of a relation was worked on.
+
+        Args:
+            relation_id (int): ID of the relation the request was received on
+        """
+        relation = str(relation_id)
+        self._stored.relation_turns[relation] = self._stored.relation_turns.get(relation, 0) + 1
+
+    def _update_turns(self, waiting_relations: Set[str]) -> None:
+        """Forgets relations with no request waiting and levels relations that have new ones."""
+        for relation in list(self._stored.relation_turns.keys()):
+            if relation not in waiting_relations:
+                del self._stored.relation_turns[relation]
+        start = min(self._stored.relation_turns.values(), default=0)
+        for relation in waiting_relations:
+            if relation not in self._stored.relation_turns:
+                self._stored.relation_turns[relation] = start
@@ -0,0 +1,280 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Optional tracing of the certificate flow.
+
+Spans are exported to an OTLP collector with the OpenTelemetry SDK, or written as JSON lines to
+a local file. Both tracers are handed to the
+tls_certificates library, so that its spans and the charm's share the same export.
+
+Spans exported to a collector are sent in batches by a background thread, and flushed once at
+the end of each hook with a short timeout, so that an unreachable collector never holds a hook
+for more than OTLP_FLUSH_TIMEOUT_MILLIS. Spans that could not be exported by then are dropped.
+
+Spans of the JSON lines tracer that carry a single CSR digest use a trace ID derived from it,
+so the spans of a certificate recorded in different hooks and units belong to the same trace.
+Other spans belong to the trace of their parent span.
+"""
+
+import json
+import logging
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CSR_DIGEST_ATTRIBUTE = "csr.digest"
+OTLP_EXPORT_TIMEOUT = 2
+OTLP_FLUSH_TIMEOUT_MILLIS = 2000
+
+
+class FileSpan:
+    """Span written to a JSON lines file when it ends."""
+
+    def __init__(
+        self,
+        tracer: "JSONLinesTracer",
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str],
+        attributes: Dict[str, Any],
+        start_time: int,
+    ):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes)
+        self.start_time = start_time
+        self.status = "OK"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Sets an attribute of the span.
+
+        Args:
+            key (str): Attribute name
+            value: Attribute value
+        """
+        self.attributes[key] = value
+
+    def end(self, end_time: Optional[int] = None) -> None:
+        """Ends the span and writes it to the file.
+
+        Args:
+            end_time (int): End time in nanoseconds since the epoch, now if not given
+        """
+        self._tracer.write(
+            {
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_span_id": self.parent_span_id,
+                "start_time": self.start_time,
+                "end_time": end_time or time.time_ns(),
+                "status": self.status,
+                "attributes": self.attributes,
+            }
+        )
+
+
+class JSONLinesTracer:
+    """Records spans as JSON lines in a local file.
+
+    Implements the part of the OpenTelemetry tracer API used by the charm and the
+    tls_certificates library.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._active_spans: List[FileSpan] = []
+
+    def start_span(
+        self,
+        name: str,
+        attributes: Optional[Dict[str, Any]] = None,
+        start_time: Optional[int] = None,
+    ) -> FileSpan:
+        """Starts a span, child of the current span if any.
+
+        Args:
+            name (str): Span name
+            attributes (dict): Span attributes
+            start_time (int): Start time in nanoseconds since the epoch, now if not given
+
+        Returns:
+            FileSpan: Span, written to the file when it ends.
+        """
+        attributes = attributes or {}
+        parent = self._active_spans[-1] if self._active_spans else None
+        digest = attributes.get(CSR_DIGEST_ATTRIBUTE)
+        if digest:
+            trace_id = digest[:32]
+        elif parent:
+            trace_id = parent.trace_id
+        else:
+            trace_id = secrets.token_hex(16)
+        return FileSpan(
+            tracer=self,
+            name=name,
+            trace_id=trace_id,
+            parent_span_id=parent.span_id if parent and parent.trace_id == trace_id else None,
+            attributes=attributes,
+            start_time=start_time or time.time_ns(),
+        )
+
+    @contextmanager
+    def start_as_current_span(
+        self, name: str, attributes: Optional[Dict[str, Any]] = None
+    ) -> Iterator[FileSpan]:
+        """Records a span for the body of a `with` statement, as the current span.
+
+        Args:
+            name (str): Span name
+            attributes (dict): Span attributes
+
+        Yields:
+            FileSpan: Span
+        """
+        span = self.start_span(name, attributes)
+        self._active_spans.append(span)
+        try:
+            yield span
+        except Exception:
+            span.status = "ERROR"
+            raise
+        finally:
+            self._active_spans.pop()
+            span.end()
+
+    def write(self, record: Dict) -> None:
+        """Appends a span record to the file.
+
+        Args:
+            record (dict): Span record
+        """
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with open(self._path, "a") as trace_file:
+                trace_file.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.warning("Could not write span to %s: %s", self._path, e)
+
+    def force_flush(self, timeout_millis: int) -> bool:
+        """Does nothing, spans are written to the file when they end.
+
+        Args:
+            timeout_millis (int): Unused
+
+        Returns:
+            bool: Always True
+        """
+        return True
+
+
+class OTLPTracer:
+    """OpenTelemetry tracer whose spans are exported in batches by its tracer provider.
+
+    Implements the tracer API by delegating to the SDK tracer, and adds `force_flush`.
+    """
+
+    def __init__(self, provider: Any):
+        self._provider = provider
+        self._tracer = provider.get_tracer(__name__)
+
+    def __getattr__(self, name: str) -> Any:
+        """Returns the attributes of the SDK tracer."""
+        return getattr(self._tracer, name)
+
+    def force_flush(self, timeout_millis: int) -> bool:
+        """Exports the spans that ended and were not exported yet.
+
+        Args:
+            timeout_millis (int): Time to wait for the export, in milliseconds
+
+        Returns:
+            bool: Whether the spans were exported within the timeout
+        """
+        return self._provider.force_flush(timeout_millis)
+
+
+def _otlp_tracer(endpoint: str, service_name: str) -> OTLPTracer:
+    """Returns a tracer exporting spans to an OTLP collector in batches.
+
+    The OpenTelemetry SDK is only imported when spans are exported, so that hooks do not pay
+    for importing it otherwise. The provider is not shut down when the hook process exits,
+    which would wait for every remaining span to be exported.
+
+    Args:
+        endpoint (str): OTLP/HTTP traces endpoint
+        service_name (str): Name of the service the spans belong to
+
+    Returns:
+        OTLPTracer: Tracer
+    """
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (  # type: ignore
+        OTLPSpanExporter,
+    )
+    from opentelemetry.sdk.resources import Resource  # type: ignore
+    from opentelemetry.sdk.trace import TracerProvider  # type: ignore
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor  # type: ignore
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}), shutdown_on_exit=False
+    )
+    provider.add_span_processor(
+        BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint, timeout=OTLP_EXPORT_TIMEOUT))
+    )
+    return OTLPTracer(provider)
+
+
+def setup_tracer(otlp_endpoint: str, trace_file: str, service_name: str) -> Any:
+    """Returns the tracer configured for the charm.
+
+    Args:
+        otlp_endpoint (str): OTLP/HTTP traces endpoint, empty to not export to a collector
+        trace_file (str): Path of the JSON lines file to write spans to, empty to not write them
+        service_name (str): Name of the service the spans belong to
+
+    Returns:
+        Tracer, None if tracing is disabled.
+    """
+    if otlp_endpoint:
+        return _otlp_tracer(otlp_endpoint, service_name)
+    if trace_file:
+        return JSONLinesTracer(trace_file)
+    return None
+
+
+def flush_tracer(tracer: Any) -> None:
+    """Exports the spans of a tracer at the end of a hook, waiting for a bounded time.
+
+    Args:
+        tracer: Tracer, None if tracing is disabled
+    """
+    if tracer is None:
+        return
+    if not tracer.force_flush(OTLP_FLUSH_TIMEOUT_MILLIS):
+        logger.warning("Could not export spans within %d ms", OTLP_FLUSH_TIMEOUT_MILLIS)
+
+
+@contextmanager
+def span(tracer: Any, name: str, attributes: Dict[str, Any]) -> Iterator[Any]:
+    """Records a span with a tracer, if tracing is enabled.
+
+    Args:
+        tracer: Tracer, None if tracing is disabled
+        name (str): Span name
+        attributes (dict): Span attributes
+
+    Yields:
+        Span, None if tracing is disabled.
+    """
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as current_span:
+        yield current_span
@@ -0,0 +1,26 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+import pytest
+
+RESULTS_DIR = Path(os.environ.get("BENCHMARK_RESULTS_DIR", ".benchmarks"))
+
+
+@pytest.fixture(scope="module")
+def benchmark_results(request) -> Iterator[Callable[[Dict], None]]:
+    """Collects benchmark results and writes them to a JSON file named after the test module."""
+    results: List[Dict] = []
+    yield results.append
+    if not results:
+        return
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    path = RESULTS_DIR / f"{request.module.__name__.split('.')[-1]}.json"
+    path.write_text(json.dumps(results, indent=2))
+    print(f"\nBenchmark results written to {path}")
+    for result in results:
+        print(json.dumps(result))
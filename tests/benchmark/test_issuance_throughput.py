@@ -0,0 +1,334 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Issuance throughput benchmarks against a local Pebble ACME server.
+
+The charm runs in a Harness, with lego executed locally instead of in the container. lego talks
+to a local Pebble ACME server and publishes DNS-01 challenges to pebble-challtestsrv through
+lego's `exec` DNS provider, so the benchmark runs fully offline. The `pebble`,
+`pebble-challtestsrv` and `lego` binaries must be on the PATH, the benchmarks are skipped
+otherwise.
+"""
+
+import ipaddress
+import json
+import math
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+from charms.tls_certificates_interface.v1.tls_certificates import (  # type: ignore[import]
+    generate_csr,
+    generate_private_key,
+)
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from ops import testing
+from ops.pebble import ExecError
+from ops.testing import Harness
+
+from charm import LegoOperatorCharm
+
+testing.SIMULATE_CAN_CONNECT = True
+
+ROOT = Path(__file__).parents[2]
+BATCH_SIZES = [1, 5, 20]
+ACME_PORT = 14000
+CHALLTESTSRV_DNS_PORT = 8053
+CHALLTESTSRV_MANAGEMENT_PORT = 8055
+
+pytestmark = pytest.mark.skipif(
+    not all(shutil.which(binary) for binary in ("pebble", "pebble-challtestsrv", "lego")),
+    reason="pebble, pebble-challtestsrv and lego binaries are required",
+)
+
+CHALLTESTSRV_HOOK = """#!{python}
+import json
+import sys
+import urllib.request
+
+action, fqdn, value = sys.argv[1:4]
+body = {{"host": fqdn, "value": value}} if action == "present" else {{"host": fqdn}}
+endpoint = "set-txt" if action == "present" else "clear-txt"
+urllib.request.urlopen(
+    urllib.request.Request(
+        "http://127.0.0.1:{port}/" + endpoint, data=json.dumps(body).encode()
+    )
+)
+"""
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Returns the nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def wait_for_port(port: int, timeout: float = 15) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"Nothing listening on port {port}")
+
+
+def write_server_certificate(directory: Path) -> Dict[str, Path]:
+    private_key_pem = generate_private_key()
+    private_key = serialization.load_pem_private_key(private_key_pem, password=None)
+    name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, "localhost")])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())  # type: ignore[arg-type]
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.utcnow() - timedelta(minutes=1))
+        .not_valid_after(datetime.utcnow() + timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName(
+                [x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+            ),
+            critical=False,
+        )
+        .sign(private_key, hashes.SHA256())  # type: ignore[arg-type]
+    )
+    paths = {"certificate": directory / "pebble.crt", "private_key": directory / "pebble.key"}
+    paths["certificate"].write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    paths["private_key"].write_bytes(private_key_pem)
+    return paths
+
+
+@pytest.fixture(scope="module")
+def acme_server(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("pebble")
+    server_certificate = write_server_certificate(directory)
+    config = directory / "pebble-config.json"
+    config.write_text(
+        json.dumps(
+            {
+                "pebble": {
+                    "listenAddress": f"127.0.0.1:{ACME_PORT}",
+                    "managementListenAddress": "127.0.0.1:15000",
+                    "certificate": str(server_certificate["certificate"]),
+                    "privateKey": str(server_certificate["private_key"]),
+                    "httpPort": 5002,
+                    "tlsPort": 5001,
+                    "ocspResponderURL": "",
+                    "externalAccountBindingRequired": False,
+                }
+            }
+        )
+    )
+    challtestsrv = subprocess.Popen(
+        [
+            "pebble-challtestsrv",
+            "-management",
+            f":{CHALLTESTSRV_MANAGEMENT_PORT}",
+            "-dns01",
+            f"127.0.0.1:{CHALLTESTSRV_DNS_PORT}",
+            "-http01",
+            "",
+            "-https01",
+            "",
+            "-tlsalpn01",
+            "",
+            "-doh",
+            "",
+            "-defaultIPv4",
+            "127.0.0.1",
+            "-defaultIPv6",
+            "",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    pebble = subprocess.Popen(
+        ["pebble", "-config", str(config), "-dnsserver", f"127.0.0.1:{CHALLTESTSRV_DNS_PORT}"],
+        env={**os.environ, "PEBBLE_VA_NOSLEEP": "1", "PEBBLE_WFE_NONCEREJECT": "0"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    hook = directory / "challtestsrv-hook"
+    hook.write_text(
+        CHALLTESTSRV_HOOK.format(python=sys.executable, port=CHALLTESTSRV_MANAGEMENT_PORT)
+    )
+    hook.chmod(hook.stat().st_mode | stat.S_IEXEC)
+    try:
+        wait_for_port(ACME_PORT)
+        wait_for_port(CHALLTESTSRV_MANAGEMENT_PORT)
+        yield {
+            "directory": f"https://127.0.0.1:{ACME_PORT}/dir",
+            "ca_certificate": str(server_certificate["certificate"]),
+            "hook": str(hook),
+        }
+    finally:
+        pebble.terminate()
+        challtestsrv.terminate()
+        pebble.wait()
+        challtestsrv.wait()
+
+
+class LocalLegoProcess:
+    """A local lego process, whose latency is measured when it exits.
+
+    The charm waits for concurrent orders one after the other, so a process that exits while
+    the charm waits for an earlier one would be measured late. A waiter thread per process
+    reads its output and records the time it exits instead.
+    """
+
+    def __init__(self, runner: "LocalLego", command: List[str], process: subprocess.Popen):
+        self.runner = runner
+        self.command = command
+        self.process = process
+        self.started = time.monotonic()
+        self.exited: Optional[float] = None
+        self.output: Tuple[str, str] = ("", "")
+        self.waiter = threading.Thread(target=self._wait, daemon=True)
+        self.waiter.start()
+
+    def _wait(self) -> None:
+        self.output = self.process.communicate()
+        self.exited = time.monotonic()
+
+    def wait_output(self):
+        self.waiter.join(timeout=300)
+        if self.exited is None:
+            self.process.kill()
+            self.waiter.join()
+            raise TimeoutError(f"{self.command[0]} did not exit within 300 seconds")
+        self.runner.latencies.append(self.exited - self.started)
+        stdout, stderr = self.output
+        if self.process.returncode != 0:
+            raise ExecError(self.command, self.process.returncode, stdout, stderr)
+        self.runner.copy_certificates_to_container()
+        return stdout, stderr
+
+
+class LocalLego:
+    """Runs the lego commands the charm sends to its container as local processes.
+
+    The CSR is copied out of the Harness container filesystem and lego's output is copied back
+    in, so the charm's issuance path runs unchanged.
+    """
+
+    def __init__(self, harness: Harness, workdir: Path, acme_server: Dict[str, str]):
+        self.harness = harness
+        self.workdir = workdir
+        self.acme_server = acme_server
+        self.latencies: List[float] = []
+
+    @property
+    def client(self):
+        return self.harness._backend._pebble_clients["lego"]
+
+    def __call__(self, command: List[str], **kwargs) -> LocalLegoProcess:
+        command = list(command)
+        csr_index = command.index("--csr") + 1
+        local_csr = self.workdir / Path(command[csr_index]).name
+        local_csr.write_text(self.client.pull(command[csr_index]).read())
+        command[csr_index] = str(local_csr)
+        run_index = command.index("run")
+        command[run_index:run_index] = [
+            "--path",
+            str(self.workdir / ".lego"),
+            "--dns.resolvers",
+            f"127.0.0.1:{CHALLTESTSRV_DNS_PORT}",
+        ]
+        environment = {
+            **os.environ,
+            **(kwargs.get("environment") or {}),
+            "LEGO_CA_CERTIFICATES": self.acme_server["ca_certificate"],
+            "EXEC_PATH": self.acme_server["hook"],
+            "EXEC_POLLING_INTERVAL": "1",
+            "EXEC_PROPAGATION_TIMEOUT": "30",
+        }
+        process = subprocess.Popen(
+            command,
+            cwd=self.workdir,
+            env=environment,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        return LocalLegoProcess(self, command, process)
+
+    def copy_certificates_to_container(self) -> None:
+        for path in (self.workdir / ".lego" / "certificates").iterdir():
+            self.client.push(
+                f"/tmp/.lego/certificates/{path.name}", source=path.read_bytes(), make_dirs=True
+            )
+
+
+@pytest.fixture
+def harness(tmp_path, acme_server):
+    harness = Harness(
+        LegoOperatorCharm,
+        meta=(ROOT / "metadata.yaml").read_text(),
+        config=(ROOT / "config.yaml").read_text(),
+    )
+    harness.set_leader(True)
+    harness.set_can_connect("lego", True)
+    harness.begin()
+    harness.charm._server = acme_server["directory"]
+    harness.charm._plugin = "exec"
+    harness.charm._email = "benchmark@example.com"
+    harness.charm._secrets = {}
+    yield harness
+    harness.cleanup()
+
+
+@pytest.mark.parametrize("max_concurrent_orders", [1, 4])
+@pytest.mark.parametrize("batch_size", BATCH_SIZES)
+def test_issuance_throughput(
+    harness, tmp_path, acme_server, benchmark_results, batch_size, max_concurrent_orders
+):
+    harness.update_config({"max-concurrent-orders": max_concurrent_orders})
+    lego = LocalLego(harness, tmp_path, acme_server)
+    harness._backend._pebble_clients["lego"].exec = lego
+    relation_id = harness.add_relation("certificates", "requirer")
+    harness.add_relation_unit(relation_id, "requirer/0")
+    csrs = [
+        generate_csr(generate_private_key(), subject=f"host{index}.zone{index % 4}.test")
+        .decode()
+        .strip()
+        for index in range(batch_size)
+    ]
+
+    started = time.monotonic()
+    harness.update_relation_data(
+        relation_id,
+        "requirer/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs]
+            )
+        },
+    )
+    hook_duration = time.monotonic() - started
+
+    published = harness.charm.tls_certificates.get_relation_certificates(relation_id)
+    assert len(published) == batch_size
+    benchmark_results(
+        {
+            "batch_size": batch_size,
+            "max_concurrent_orders": max_concurrent_orders,
+            "hook_duration_seconds": round(hook_duration, 3),
+            "certificates_per_minute": round(batch_size / hook_duration * 60, 2),
+            "order_latency_p50_seconds": round(percentile(lego.latencies, 50), 3),
+            "order_latency_p99_seconds": round(percentile(lego.latencies, 99), 3),
+        }
+    )
@@ -0,0 +1,210 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Scale benchmarks for the provider side of the tls_certificates library.
+
+Builds a `certificates` relation with many requirer units, each with several CSRs and a
+published certificate per CSR, then measures the CPU time, the JSON bytes loaded and dumped and
+the events emitted by the library for typical hooks.
+"""
+
+import json
+import time
+from typing import Dict, List
+
+import pytest
+from charms.tls_certificates_interface.v1 import (  # type: ignore[import]
+    tls_certificates,
+)
+from charms.tls_certificates_interface.v1.tls_certificates import (  # type: ignore[import]
+    CertificateCreationRequestEvent,
+    CertificateRevocationRequestEvent,
+    TLSCertificatesProvidesV1,
+    generate_private_key,
+)
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509.oid import NameOID
+from ops.charm import CharmBase
+from ops.testing import Harness
+
+UNIT_COUNTS = [10, 100, 1000]
+CSRS_PER_UNIT = 2
+
+METADATA = """
+name: provider
+provides:
+  certificates:
+    interface: tls-certificates
+"""
+
+
+class CountingJSON:
+    """Stands in for the json module in the library and counts the bytes it processes."""
+
+    def __init__(self):
+        self.bytes_loaded = 0
+        self.bytes_dumped = 0
+
+    def __getattr__(self, name):  # noqa: D105
+        return getattr(json, name)
+
+    def loads(self, data, *args, **kwargs):
+        self.bytes_loaded += len(data)
+        return json.loads(data, *args, **kwargs)
+
+    def dumps(self, obj, *args, **kwargs):
+        data = json.dumps(obj, *args, **kwargs)
+        self.bytes_dumped += len(data)
+        return data
+
+
+class ProviderCharm(CharmBase):
+    sharded_databag = False
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.certificates = TLSCertificatesProvidesV1(
+            self, "certificates", sharded_databag=self.sharded_databag
+        )
+        self.events_emitted = 0
+        self.framework.observe(
+            self.certificates.on.certificate_creation_request, self._on_certificate_request
+        )
+        self.framework.observe(
+            self.certificates.on.certificate_revocation_request, self._on_revocation_request
+        )
+
+    def _on_certificate_request(self, event: CertificateCreationRequestEvent) -> None:
+        self.events_emitted += 1
+        self.certificates.set_relation_certificate(
+            relation_id=event.relation_id,
+            **served_certificate(event.certificate_signing_request),
+        )
+
+    def _on_revocation_request(self, event: CertificateRevocationRequestEvent) -> None:
+        self.events_emitted += 1
+
+
+@pytest.fixture(scope="module")
+def csrs() -> List[str]:
+    """Returns enough CSRs for the largest relation, signed with a single key to save time."""
+    private_key = serialization.load_pem_private_key(generate_private_key(), password=None)
+    return [
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(
+            x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, f"unit{index}.example.com")])
+        )
+        .sign(private_key, hashes.SHA256())  # type: ignore[arg-type]
+        .public_bytes(serialization.Encoding.PEM)
+        .decode()
+        .strip()
+        for index in range(max(UNIT_COUNTS) * CSRS_PER_UNIT + 1)
+    ]
+
+
+def served_certificate(csr: str) -> Dict:
+    return {
+        "certificate": f"certificate for {csr[-80:]}",
+        "certificate_signing_request": csr,
+        "ca": "ca",
+        "chain": ["ca"],
+    }
+
+
+def build_relation(harness: Harness, unit_count: int, csrs: List[str]) -> int:
+    """Adds a certificates relation with every CSR already served, without running hooks.
+
+    The certificates are written to the legacy array in one go, then moved to the sharded layout
+    by the library itself when the charm uses it.
+    """
+    relation_id = harness.add_relation("certificates", "requirer")
+    served_csrs = csrs[: unit_count * CSRS_PER_UNIT]
+    with harness.hooks_disabled():
+        for unit_index in range(unit_count):
+            first_csr = unit_index * CSRS_PER_UNIT
+            last_csr = first_csr + CSRS_PER_UNIT
+            harness.add_relation_unit(relation_id, f"requirer/{unit_index}")
+            harness.update_relation_data(
+                relation_id,
+                f"requirer/{unit_index}",
+                {
+                    "certificate_signing_requests": json.dumps(
+                        [{"certificate_signing_request": csr} for csr in csrs[first_csr:last_csr]]
+                    )
+                },
+            )
+        harness.update_relation_data(
+            relation_id,
+            harness.charm.app.name,
+            {"certificates": json.dumps([served_certificate(csr) for csr in served_csrs])},
+        )
+        harness.charm.certificates.set_relation_certificate(
+            relation_id=relation_id, **served_certificate(served_csrs[0])
+        )
+    return relation_id
+
+
+def measure(harness: Harness, counting_json: CountingJSON, action) -> Dict:
+    counting_json.bytes_loaded = counting_json.bytes_dumped = 0
+    harness.charm.events_emitted = 0
+    started = time.process_time()
+    action()
+    return {
+        "cpu_seconds": round(time.process_time() - started, 6),
+        "json_bytes_loaded": counting_json.bytes_loaded,
+        "json_bytes_dumped": counting_json.bytes_dumped,
+        "events_emitted": harness.charm.events_emitted,
+    }
+
+
+@pytest.mark.parametrize("sharded_databag", [False, True])
+@pytest.mark.parametrize("unit_count", UNIT_COUNTS)
+def test_provider_relation_scale(
+    monkeypatch, csrs, benchmark_results, unit_count, sharded_databag
+):
+    monkeypatch.setattr(ProviderCharm, "sharded_databag", sharded_databag)
+    harness = Harness(ProviderCharm, meta=METADATA)
+    harness.set_leader(True)
+    harness.begin()
+    relation_id = build_relation(harness, unit_count, csrs)
+    counting_json = CountingJSON()
+    monkeypatch.setattr(tls_certificates, "json", counting_json)
+    unit_csrs = csrs[:CSRS_PER_UNIT]
+
+    def update_unit(unit_csrs_after: List[str]):
+        harness.update_relation_data(
+            relation_id,
+            "requirer/0",
+            {
+                "certificate_signing_requests": json.dumps(
+                    [{"certificate_signing_request": csr} for csr in unit_csrs_after]
+                )
+            },
+        )
+
+    phases = {
+        "relation_changed_unrelated_key": lambda: harness.update_relation_data(
+            relation_id, "requirer/0", {"unrelated": "value"}
+        ),
+        "relation_changed_new_csr": lambda: update_unit(unit_csrs + [csrs[-1]]),
+        "relation_changed_removed_csr": lambda: update_unit(unit_csrs),
+        "set_relation_certificate": lambda: harness.charm.certificates.set_relation_certificate(
+            certificate="renewed certificate",
+            certificate_signing_request=unit_csrs[0],
+            ca="ca",
+            chain=["ca"],
+            relation_id=relation_id,
+        ),
+    }
+    for phase, action in phases.items():
+        benchmark_results(
+            {
+                "phase": phase,
+                "units": unit_count,
+                "csrs_per_unit": CSRS_PER_UNIT,
+                "sharded_databag": sharded_databag,
+                **measure(harness, counting_json, action),
+            }
+        )
+    harness.cleanup()
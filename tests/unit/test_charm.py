@@ -3,25 +3,39 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 import json
+import time
+from datetime import datetime, timedelta
 from functools import partial
 from pathlib import Path
 from unittest.mock import Mock
 
 import pytest
 import yaml
+from charms.tls_certificates_interface.v1 import (  # type: ignore[import]
+    tls_certificates,
+)
 from charms.tls_certificates_interface.v1.tls_certificates import (  # type: ignore[import]
+    csr_digest,
+    generate_ca,
+    generate_certificate,
     generate_csr,
     generate_private_key,
 )
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509.oid import NameOID
 from ops import testing
 from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
 from ops.pebble import ExecError
 from ops.testing import Harness
 
 from charm import LegoOperatorCharm
+from dns_propagation import Zone
+from metrics import METRICS_PATH
+from tracing import JSONLinesTracer
 
 testing.SIMULATE_CAN_CONNECT = True
-test_lego = Path(__file__).parent / "test_lego.crt"
+config_yaml = Path(__file__).parents[2] / "config.yaml"
 
 
 @pytest.fixture(scope="function")
@@ -33,11 +47,14 @@ def harness():
                 "name": "lego",
                 "containers": {"lego": {"resource": "lego-image"}},
                 "provides": {"certificates": {"interface": "tls-certificates"}},
+                "peers": {"replicas": {"interface": "lego-replica"}},
             }
         ),
+        config=config_yaml.read_text(),
     )
 
     harness.set_leader(True)
+    harness.update_config({"container-ready-timeout": 0})
     setup_lego_container(harness)
     harness.begin()
     yield harness
@@ -79,22 +96,71 @@ def request_cert(harness):
     )
 
 
-def check_exec_args(harness, return_value, *args, **kwargs):
-    assert args == (
-        [
-            "lego",
-            "--email",
-            harness._charm._email,
-            "--accept-tos",
-            "--csr",
-            "/tmp/csr.pem",
-            "--server",
-            harness._charm._server,
-            "--dns",
-            harness._charm._plugin,
-            "run",
-        ],
+def push_acme_account(harness, uri):
+    harness._backend._pebble_clients["lego"].push(
+        "/tmp/.lego/accounts/acme-staging-v02.api.letsencrypt.org/"
+        f"{harness.charm._email}/account.json",
+        source=json.dumps({"email": harness.charm._email, "registration": {"uri": uri}}),
+        make_dirs=True,
     )
+
+
+class FakeLego:
+    """Stands in for lego: signs the pushed CSR and writes lego's output files."""
+
+    def __init__(self, harness, file_name=None, log="", account="https://acme.example/acct/1"):
+        self.harness = harness
+        self.file_name = file_name
+        self.log = log
+        self.account = account
+        self.revoked = []
+        self.ca_key = generate_private_key()
+        self.ca = generate_ca(self.ca_key, subject="ca")
+
+    def __call__(self, command, **kwargs):
+        client = self.harness._backend._pebble_clients["lego"]
+        if "revoke" in command:
+            return self.revoke(command)
+        csr_pem = client.pull(command[command.index("--csr") + 1]).read().encode()
+        csr = x509.load_pem_x509_csr(csr_pem)
+        common_names = csr.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        if common_names:
+            domain = common_names[0].value
+        else:
+            san = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+            domain = san.value.get_values_for_type(x509.DNSName)[0]
+        file_name = self.file_name or domain
+        certificate = generate_certificate(csr_pem, self.ca, self.ca_key)
+        chain = certificate.decode() + "\n" + self.ca.decode()
+        client.push(f"/tmp/.lego/certificates/{file_name}.crt", source=chain, make_dirs=True)
+        client.push(
+            f"/tmp/.lego/certificates/{file_name}.json", source=json.dumps({"domain": domain})
+        )
+        if self.account and self.harness.charm._acme_account is None:
+            push_acme_account(self.harness, self.account)
+        return Mock(wait_output=lambda: ("", self.log))
+
+    def revoke(self, command):
+        names = [command[index + 1] for index, arg in enumerate(command) if arg == "--domains"]
+        self.revoked.extend(names)
+        return Mock(wait_output=lambda: ("", ""))
+
+
+def check_exec_args(harness, fake_lego, *args, **kwargs):
+    command = args[0]
+    assert command[5].startswith("/tmp/csr-")
+    assert command[:5] + command[6:] == [
+        "lego",
+        "--email",
+        harness._charm._email,
+        "--accept-tos",
+        "--csr",
+        "--server",
+        harness._charm._server,
+        "--dns",
+        harness._charm._plugin,
+        "run",
+    ]
     assert kwargs == {
         "timeout": 300,
         "working_dir": "/tmp",
@@ -110,28 +176,166 @@ def check_exec_args(harness, return_value, *args, **kwargs):
         "stdout": None,
     }
 
-    return return_value
+    return fake_lego(*args, **kwargs)
 
 
 def test_request(harness):
     harness._backend._pebble_clients["lego"].exec = partial(
-        check_exec_args, harness, Mock(wait_output=lambda: (None, None))
+        check_exec_args, harness, FakeLego(harness)
     )
-    harness._backend._pebble_clients["lego"].push(
-        "/tmp/.lego/certificates/foo.crt", source=test_lego.read_bytes(), make_dirs=True
+
+    request_cert(harness)
+
+    relation = harness.model.get_relation("certificates")
+    harness.framework.commit()
+    provider_certificates = json.loads(
+        harness.get_relation_data(relation.id, harness.charm.app.name)["certificates"]
     )
+    assert len(provider_certificates) == 1
+
+
+def test_certificate_at_expected_path_is_found_without_scanning_metadata(harness, monkeypatch):
+    client = harness._backend._pebble_clients["lego"]
+    for index in range(3):
+        client.push(
+            f"/tmp/.lego/certificates/other{index}.json",
+            source=json.dumps({"domain": f"other{index}"}),
+            make_dirs=True,
+        )
+    client.exec = FakeLego(harness)
+    list_files = Mock(wraps=client.list_files)
+    monkeypatch.setattr(client, "list_files", list_files)
 
     request_cert(harness)
 
+    harness.framework.commit()
+    relation = harness.model.get_relation("certificates")
+    assert json.loads(
+        harness.get_relation_data(relation.id, harness.charm.app.name)["certificates"]
+    )
+    assert "/tmp/.lego/certificates" not in [call.args[0] for call in list_files.call_args_list]
+
+
+def generate_san_only_csr(private_key: bytes, domain: str) -> bytes:
+    return (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([]))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(domain)]), critical=False)
+        .sign(serialization.load_pem_private_key(private_key, password=None), hashes.SHA256())
+        .public_bytes(serialization.Encoding.PEM)
+    )
+
+
+def test_wildcard_san_only_request_is_matched_by_public_key(harness):
+    client = harness._backend._pebble_clients["lego"]
+    stale_csr = generate_san_only_csr(generate_private_key(), "*.example.com")
+    client.push("/tmp/stale.pem", source=stale_csr, make_dirs=True)
+    FakeLego(harness, file_name="_.example.com")(["lego", "--csr", "/tmp/stale.pem"])
+    client.exec = FakeLego(harness, file_name="renamed")
+    private_key = generate_private_key()
+    csr = generate_san_only_csr(private_key, "*.example.com")
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr.decode().strip()}]
+            )
+        },
+    )
+
+    harness.framework.commit()
+    provider_certificates = json.loads(
+        harness.get_relation_data(r_id, harness.charm.app.name)["certificates"]
+    )
+    certificate = x509.load_pem_x509_certificate(provider_certificates[0]["certificate"].encode())
+    assert certificate.public_key().public_numbers() == (
+        x509.load_pem_x509_csr(csr).public_key().public_numbers()
+    )
+
+
+def test_batch_request_issues_every_pending_csr(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = [generate_csr(generate_private_key(), subject="foo").decode() for _ in range(2)]
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr.strip()} for csr in csrs]
+            )
+        },
+    )
+
+    assert exec_mock.call_count == 2
+    harness.framework.commit()
+    provider_certificates = json.loads(
+        harness.get_relation_data(r_id, harness.charm.app.name)["certificates"]
+    )
+    assert [cert["certificate_signing_request"] for cert in provider_certificates] == [
+        csr.strip() for csr in csrs
+    ]
+
+
+def test_csr_outside_allowed_domains_is_rejected_without_order(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    harness.update_config({"allowed-domains": "example.com"})
+
+    request_cert(harness)
+
+    exec_mock.assert_not_called()
+    assert harness.model.unit.status == BlockedStatus(
+        "Rejected CSR: foo is not in the allowed domains"
+    )
+
+
+def test_rejected_csr_is_not_checked_again_until_config_changes(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    harness.update_config({"allowed-domains": "example.com"})
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    csr = generate_csr(generate_private_key(), subject="bar").decode().strip()
+    harness.update_relation_data(
+        relation.id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr}]
+                + json.loads(
+                    harness.get_relation_data(relation.id, "remote/0")[
+                        "certificate_signing_requests"
+                    ]
+                )
+            )
+        },
+    )
+    assert harness.model.unit.status == BlockedStatus("Rejected 2 CSRs. Check logs for details")
+
+    harness.charm.on.update_status.emit()
+
+    exec_mock.assert_not_called()
+    assert harness.charm._stored.order_outcomes["invalid_csr"] == 2
+
+    harness.update_config({"allowed-domains": ""})
+
+    assert exec_mock.call_count == 2
+    assert harness.model.unit.status == ActiveStatus()
+
 
 def test_failing_request(harness):
     harness._backend._pebble_clients["lego"].exec = partial(
         check_exec_args,
         harness,
-        Mock(**{"wait_output.side_effect": ExecError("lego", 1, "barf", "rip")}),
-    )
-    harness._backend._pebble_clients["lego"].push(
-        "/tmp/.lego/certificates/foo.crt", source=test_lego.read_bytes(), make_dirs=True
+        Mock(
+            return_value=Mock(**{"wait_output.side_effect": ExecError("lego", 1, "barf", "rip")})
+        ),
     )
 
     request_cert(harness)
@@ -140,7 +344,1127 @@ def test_failing_request(harness):
     )
 
 
+def test_metrics_are_written_after_processing_requests(harness):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    harness.add_relation("replicas", harness.charm.app.name)
+
+    request_cert(harness)
+
+    metrics = harness._backend._pebble_clients["lego"].pull(METRICS_PATH).read()
+    assert 'lego_orders_total{outcome="issued"} 1' in metrics
+    assert 'lego_phase_duration_seconds_count{phase="lego_exec"} 1' in metrics
+    assert 'lego_phase_duration_seconds_count{phase="relation_publish"} 1' in metrics
+    assert "lego_pending_requests 0" in metrics
+    assert 'lego_certificate_expiry_timestamp_seconds{subject="foo"}' in metrics
+
+
+def test_lego_log_events_are_attached_to_the_order(harness):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(
+        harness,
+        log=(
+            "2022/10/19 12:00:01 [INFO] [foo] acme: Obtaining SAN certificate given a CSR\n"
+            "2022/10/19 12:00:04 [INFO] [foo] acme: Checking DNS record propagation using []\n"
+            "2022/10/19 12:00:34 [INFO] [foo] The server validated our request\n"
+        ),
+    )
+
+    request_cert(harness)
+
+    (order,) = harness.charm._stored.recent_orders
+    assert order["outcome"] == "issued"
+    assert [(event["name"], event["timestamp"]) for event in order["events"]] == [
+        ("order_created", "2022-10-19T12:00:01"),
+        ("propagation_check", "2022-10-19T12:00:04"),
+        ("validated", "2022-10-19T12:00:34"),
+    ]
+    assert harness.charm._stored.phase_durations["acme_propagation_check"] == {
+        "count": 1,
+        "sum": 30.0,
+    }
+
+
+def test_concurrent_orders_are_timed_until_their_own_process_exits(harness):
+    harness.update_config({"max-concurrent-orders": 2})
+    fake_lego = FakeLego(harness)
+    delays = {"slow.example.com": 0.5, "fast.example.org": 0.0}
+
+    def exec_lego(command, **kwargs):
+        fake_lego(command, **kwargs)
+        csr = harness._backend._pebble_clients["lego"].pull(command[command.index("--csr") + 1])
+        subject = x509.load_pem_x509_csr(csr.read().encode()).subject
+        delay = delays[subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value]
+        return Mock(wait_output=lambda: time.sleep(delay) or ("", ""))
+
+    harness._backend._pebble_clients["lego"].exec = exec_lego
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = {
+        subject: generate_csr(generate_private_key(), subject=subject).decode().strip()
+        for subject in delays
+    }
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs.values()]
+            )
+        },
+    )
+
+    durations = {
+        order["csr_digest"]: order["duration"] for order in harness.charm._stored.recent_orders
+    }
+    assert durations[csr_digest(csrs["slow.example.com"])] >= 0.5
+    assert durations[csr_digest(csrs["fast.example.org"])] < 0.25
+
+
+def test_certificate_flow_spans_are_written_to_trace_file(harness, monkeypatch, tmp_path):
+    trace_file = tmp_path / "traces.jsonl"
+    tracer = JSONLinesTracer(str(trace_file))
+    monkeypatch.setattr(harness.charm, "_tracer", tracer)
+    monkeypatch.setattr(tls_certificates, "_tracer", tracer)
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+
+    request_cert(harness)
+
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    relation = harness.model.get_relation("certificates")
+    (certificate,) = harness.charm.tls_certificates.get_relation_certificates(relation.id)
+    digest = csr_digest(certificate["certificate_signing_request"])
+    assert {span["name"] for span in spans if span["trace_id"] == digest[:32]} == {
+        "lego.exec",
+        "tls_certificates.set_relation_certificate",
+    }
+    (relation_changed,) = [
+        span for span in spans if span["name"] == "tls_certificates.provider.relation_changed"
+    ]
+    assert relation_changed["attributes"]["csr.digests"] == [digest]
+    (batch_request,) = [
+        span for span in spans if span["name"] == "lego.certificate_creation_batch_request"
+    ]
+    assert batch_request["parent_span_id"] == relation_changed["span_id"]
+
+
+def test_get_issuance_stats_action(harness):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    request_cert(harness)
+    harness.add_relation_unit(peer_id, "lego/1")
+    harness.set_can_connect("lego", False)
+    relation = harness.model.get_relation("certificates")
+    requests = json.loads(
+        harness.get_relation_data(relation.id, "remote/0")["certificate_signing_requests"]
+    )
+    csrs = [generate_csr(generate_private_key(), subject="foo").decode().strip() for _ in range(4)]
+    harness.update_relation_data(
+        relation.id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                requests + [{"certificate_signing_request": csr} for csr in csrs]
+            )
+        },
+    )
+    event = Mock()
+
+    harness.charm._on_get_issuance_stats_action(event)
+
+    results = event.set_results.call_args[0][0]
+    assert results["queue"] == {"pending": 0, "in-flight": 4}
+    assert {request["unit"] for request in json.loads(results["in-flight"])} <= {
+        "lego/0",
+        "lego/1",
+    }
+    assert results["recent-orders"] == {
+        "total": 1,
+        "issued": 1,
+        "failed": 0,
+        "success-rate": "1.00",
+    }
+    rate_limits = json.loads(results["rate-limits"])
+    assert rate_limits["server"] == harness.charm._server
+    assert rate_limits["new-orders-left"] == 1499
+    assert rate_limits["certificates-per-domain-left"] == {"foo": 29999}
+    (relation_stats,) = json.loads(results["relations"])
+    assert relation_stats["relation-id"] == relation.id
+    assert relation_stats["certificates"] == 1
+
+
+def test_get_issuance_stats_action_without_peer_relation(harness):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    event = Mock()
+
+    harness.charm._on_get_issuance_stats_action(event)
+
+    results = event.set_results.call_args[0][0]
+    rate_limits = json.loads(results["rate-limits"])
+    assert rate_limits["certificates-per-domain-left"] == {"foo": 29999}
+    (relation_stats,) = json.loads(results["relations"])
+    assert relation_stats["relation-id"] == relation.id
+    assert relation_stats["certificates"] == 1
+    assert relation_stats["nearest-expiry"]
+
+
+def test_certificates_obtained_by_peer_units_count_against_the_domain_limit(harness):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    harness.add_relation_unit(peer_id, "lego/1")
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = {
+        csr_digest(csr): csr
+        for csr in (
+            generate_csr(generate_private_key(), subject="foo").decode().strip() for _ in range(6)
+        )
+    }
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs.values()]
+            )
+        },
+    )
+    peer_digests = [
+        key.split("assignment_", 1)[1]
+        for key, value in harness.get_relation_data(peer_id, harness.charm.app.name).items()
+        if key.startswith("assignment_") and json.loads(value)["unit"] == "lego/1"
+    ]
+    assert peer_digests
+    ca_key = generate_private_key()
+    ca = generate_ca(ca_key, subject="ca")
+    harness.update_relation_data(
+        peer_id,
+        "lego/1",
+        {
+            f"result_{digest}": json.dumps(
+                {
+                    "certificates": [
+                        generate_certificate(csrs[digest].encode(), ca, ca_key).decode(),
+                        ca.decode(),
+                    ]
+                }
+            )
+            for digest in peer_digests
+        },
+    )
+    event = Mock()
+
+    harness.charm._on_get_issuance_stats_action(event)
+
+    rate_limits = json.loads(event.set_results.call_args[0][0]["rate-limits"])
+    assert rate_limits["new-orders-left"] == 1500 - (len(csrs) - len(peer_digests))
+    assert rate_limits["certificates-per-domain-left"] == {"foo": 30000 - len(csrs)}
+
+
+def test_list_pending_action(harness):
+    harness.set_can_connect("lego", False)
+    request_cert(harness)
+    event = Mock()
+
+    harness.charm._on_list_pending_action(event)
+
+    results = event.set_results.call_args[0][0]
+    assert results["count"] == 1
+    (request,) = json.loads(results["requests"])
+    assert request["domains"] == ["foo"]
+    assert request["state"] == "pending"
+    assert request["priority"] == "new"
+    assert request["age-seconds"] == 0
+
+
+def test_csr_missed_by_relation_changed_is_served_on_update_status(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    with harness.hooks_disabled():
+        request_cert(harness)
+    assert exec_mock.call_count == 0
+
+    harness.charm.on.update_status.emit()
+
+    assert exec_mock.call_count == 1
+    relation = harness.model.get_relation("certificates")
+    assert len(harness.charm.tls_certificates.get_relation_certificates(relation.id)) == 1
+
+    harness.charm.on.update_status.emit()
+
+    assert exec_mock.call_count == 1
+
+
+def test_failed_csr_is_not_retried_on_every_hook(harness):
+    exec_mock = Mock(
+        return_value=Mock(**{"wait_output.side_effect": ExecError("lego", 1, "barf", "rip")})
+    )
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    request_cert(harness)
+
+    harness.charm.on.update_status.emit()
+
+    assert exec_mock.call_count == 1
+    assert len(harness.charm._stored.failed_requests) == 1
+
+
+def test_orders_beyond_hook_time_budget_are_left_for_later_hooks(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    harness.update_config({"hook-time-budget": 0})
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = [generate_csr(generate_private_key(), subject="foo").decode().strip() for _ in range(2)]
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs]
+            )
+        },
+    )
+
+    assert exec_mock.call_count == 1
+    assert len(harness.charm._stored.pending_requests) == 1
+
+    harness.charm.on.update_status.emit()
+
+    assert exec_mock.call_count == 2
+    assert len(harness.charm.tls_certificates.get_relation_certificates(r_id)) == 2
+
+
+def set_stored_expiry(harness, peer_id, expiry):
+    updates = {}
+    for key, value in harness.get_relation_data(peer_id, harness.charm.app.name).items():
+        if key.startswith("certificate_"):
+            updates[key] = json.dumps({**json.loads(value), "expiry": expiry.isoformat()})
+    with harness.hooks_disabled():
+        harness.update_relation_data(peer_id, harness.charm.app.name, updates)
+
+
+def test_expiring_stored_certificate_is_renewed(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    request_cert(harness)
+    set_stored_expiry(harness, peer_id, datetime.utcnow() + timedelta(days=2))
+
+    harness.charm.on.update_status.emit()
+
+    assert exec_mock.call_count == 2
+    (entry,) = harness.charm._certificate_store.entries().values()
+    assert datetime.fromisoformat(entry["expiry"]) > datetime.utcnow() + timedelta(days=300)
+    assert entry["account"] == "https://acme.example/acct/1"
+
+
+def test_request_replacing_expired_certificate_is_processed_first(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    request_cert(harness)
+    set_stored_expiry(harness, peer_id, datetime.utcnow() - timedelta(days=1))
+    with harness.hooks_disabled():
+        harness.update_config({"hook-time-budget": 0})
+    relation = harness.model.get_relation("certificates")
+    new_csr = generate_csr(generate_private_key(), subject="bar").decode().strip()
+    renewal_csr = generate_csr(generate_private_key(), subject="foo").decode().strip()
+
+    harness.update_relation_data(
+        relation.id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [
+                    {"certificate_signing_request": new_csr},
+                    {"certificate_signing_request": renewal_csr},
+                ]
+            )
+        },
+    )
+
+    run_commands = [call[0][0] for call in exec_mock.call_args_list if "run" in call[0][0]]
+    assert len(run_commands) == 2
+    command = run_commands[-1]
+    assert command[command.index("--csr") + 1] == f"/tmp/csr-{csr_digest(renewal_csr)}.pem"
+
+
+def test_busy_relation_does_not_hold_up_other_relations(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    harness.update_config({"hook-time-budget": 0})
+    harness.set_can_connect("lego", False)
+    busy_id = harness.add_relation("certificates", "busy")
+    harness.add_relation_unit(busy_id, "busy/0")
+    harness.update_relation_data(
+        busy_id,
+        "busy/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [
+                    {
+                        "certificate_signing_request": generate_csr(
+                            generate_private_key(), subject="busy"
+                        )
+                        .decode()
+                        .strip()
+                    }
+                    for _ in range(3)
+                ]
+            )
+        },
+    )
+    request_cert(harness)
+    harness.set_can_connect("lego", True)
+
+    harness.charm.on.update_status.emit()
+    harness.charm.on.update_status.emit()
+
+    assert exec_mock.call_count == 2
+    quiet_id = harness.model.get_relation("certificates", busy_id + 1).id
+    assert len(harness.charm.tls_certificates.get_relation_certificates(quiet_id)) == 1
+
+
+def test_certificates_no_longer_requested_are_revoked_in_batches(harness):
+    fake_lego = FakeLego(harness)
+    exec_mock = Mock(side_effect=fake_lego)
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = [
+        generate_csr(generate_private_key(), subject=f"foo{index}").decode().strip()
+        for index in range(12)
+    ]
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs]
+            )
+        },
+    )
+    exec_mock.reset_mock()
+
+    harness.update_relation_data(
+        r_id, "remote/0", {"certificate_signing_requests": json.dumps([])}
+    )
+
+    revoke_commands = [call[0][0] for call in exec_mock.call_args_list]
+    assert [command[-2:] for command in revoke_commands] == [["revoke", "--keep"]] * 2
+    assert sorted(fake_lego.revoked) == sorted(f"revoke-{csr_digest(csr)}" for csr in csrs)
+    client = harness._backend._pebble_clients["lego"]
+    assert client.list_files("/tmp/.lego/certificates") == []
+    assert not any(
+        key.startswith(("certificate_", "revocation_"))
+        for key in harness.get_relation_data(peer_id, harness.charm.app.name)
+    )
+    assert harness.charm.tls_certificates.get_relation_certificates(r_id) == []
+
+
+def test_certificate_that_could_not_be_revoked_is_kept(harness):
+    fake_lego = FakeLego(harness)
+    harness._backend._pebble_clients["lego"].exec = fake_lego
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+
+    def failing_revoke(command):
+        fake_lego.revoked.append(command)
+        error = ExecError(command, 1, "", "urn:ietf:params:acme:error:unauthorized")
+        return Mock(wait_output=Mock(side_effect=error))
+
+    fake_lego.revoke = failing_revoke
+    harness.update_relation_data(
+        relation.id, "remote/0", {"certificate_signing_requests": json.dumps([])}
+    )
+
+    assert len(fake_lego.revoked) == 1
+    client = harness._backend._pebble_clients["lego"]
+    assert [file.name for file in client.list_files("/tmp/.lego/certificates")] == [
+        "foo.crt",
+        "foo.json",
+    ]
+    assert harness.charm._stored.pending_revocations == {}
+    assert harness.model.unit.status == BlockedStatus(
+        "Error revoking certificate. Check logs for details"
+    )
+
+
+def failing_orders(fake_lego):
+    def exec(command, **kwargs):
+        if "revoke" in command:
+            return fake_lego(command, **kwargs)
+        error = ExecError(command, 1, "", "urn:ietf:params:acme:error:rateLimited")
+        return Mock(wait_output=Mock(side_effect=error))
+
+    return exec
+
+
+def renew_cert(harness, relation_id):
+    csr = generate_csr(generate_private_key(), subject="foo").decode().strip()
+    harness.update_relation_data(
+        relation_id,
+        "remote/0",
+        {"certificate_signing_requests": json.dumps([{"certificate_signing_request": csr}])},
+    )
+    return csr
+
+
+def test_certificate_is_revoked_once_its_replacement_is_published(harness):
+    fake_lego = FakeLego(harness)
+    harness._backend._pebble_clients["lego"].exec = fake_lego
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    (old_certificate,) = harness.charm.tls_certificates.get_relation_certificates(relation.id)
+    old_digest = csr_digest(old_certificate["certificate_signing_request"])
+    harness._backend._pebble_clients["lego"].exec = failing_orders(fake_lego)
+
+    new_csr = renew_cert(harness, relation.id)
+
+    assert fake_lego.revoked == []
+    assert list(harness.charm._stored.pending_revocations) == [old_digest]
+
+    harness._backend._pebble_clients["lego"].exec = fake_lego
+    harness.charm._stored.failed_requests[csr_digest(new_csr)] = (
+        datetime.utcnow() - timedelta(hours=2)
+    ).isoformat()
+    harness.charm.on.update_status.emit()
+    harness.charm.on.update_status.emit()
+
+    (new_certificate,) = harness.charm.tls_certificates.get_relation_certificates(relation.id)
+    assert new_certificate["certificate_signing_request"] == new_csr
+    assert fake_lego.revoked == [f"revoke-{old_digest}"]
+    assert harness.charm._stored.pending_revocations == {}
+
+
+def test_certificate_being_replaced_is_revoked_once_the_relation_is_gone(harness):
+    fake_lego = FakeLego(harness)
+    harness._backend._pebble_clients["lego"].exec = fake_lego
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    harness._backend._pebble_clients["lego"].exec = failing_orders(fake_lego)
+    renew_cert(harness, relation.id)
+    assert harness.charm._stored.pending_revocations
+
+    harness.remove_relation(relation.id)
+    harness.charm.on.update_status.emit()
+
+    assert len(fake_lego.revoked) == 1
+    assert harness.charm._stored.pending_revocations == {}
+
+
+def test_revocations_beyond_hook_time_budget_are_left_for_later_hooks(harness):
+    fake_lego = FakeLego(harness)
+    harness._backend._pebble_clients["lego"].exec = fake_lego
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    harness.update_config({"hook-time-budget": 0})
+
+    harness.update_relation_data(
+        relation.id, "remote/0", {"certificate_signing_requests": json.dumps([])}
+    )
+
+    assert fake_lego.revoked == []
+    assert len(harness.charm._stored.pending_revocations) == 1
+
+    harness.update_config({"hook-time-budget": 60})
+    harness.charm.on.update_status.emit()
+
+    assert len(fake_lego.revoked) == 1
+    assert harness.charm._stored.pending_revocations == {}
+
+
+def store_revocable_certificate(harness, peer_id, account):
+    ca_key = generate_private_key()
+    ca = generate_ca(ca_key, subject="ca")
+    csr = generate_csr(generate_private_key(), subject="foo").decode().strip()
+    certificate = generate_certificate(csr.encode(), ca, ca_key).decode()
+    harness.update_relation_data(
+        peer_id,
+        harness.charm.app.name,
+        {
+            f"certificate_{csr_digest(csr)}": json.dumps(
+                {
+                    "subject": "foo",
+                    "certificate_signing_request": csr,
+                    "relation_id": 0,
+                    "certificates": [certificate, ca.decode()],
+                    "expiry": "2999-01-01T00:00:00",
+                    "account": account,
+                }
+            )
+        },
+    )
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {"certificate_signing_requests": json.dumps([{"certificate_signing_request": csr}])},
+    )
+    return r_id, csr
+
+
+@pytest.mark.parametrize(
+    "account,expected_unit",
+    [
+        ("https://acme.example/acct/2", "lego/2"),
+        ("https://acme.example/acct/3", None),
+    ],
+)
+def test_revocation_is_sent_to_the_unit_holding_the_acme_account(harness, account, expected_unit):
+    exec_mock = Mock()
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    for index in (1, 2):
+        harness.add_relation_unit(peer_id, f"lego/{index}")
+        harness.update_relation_data(
+            peer_id, f"lego/{index}", {"acme_account": f"https://acme.example/acct/{index}"}
+        )
+    r_id, csr = store_revocable_certificate(harness, peer_id, account)
+
+    harness.update_relation_data(
+        r_id, "remote/0", {"certificate_signing_requests": json.dumps([])}
+    )
+
+    app_data = harness.get_relation_data(peer_id, harness.charm.app.name)
+    revocation = app_data.get(f"revocation_{csr_digest(csr)}")
+    if expected_unit:
+        assert json.loads(revocation)["unit"] == expected_unit
+        assert json.loads(revocation)["account"] == account
+    else:
+        assert revocation is None
+    assert harness.charm._stored.pending_revocations == {}
+    exec_mock.assert_not_called()
+
+
+def test_revocation_is_given_up_when_the_acme_account_is_gone(harness):
+    fake_lego = FakeLego(harness)
+    harness._backend._pebble_clients["lego"].exec = fake_lego
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    harness.update_relation_data(
+        peer_id, harness.charm.unit.name, {"acme_account": "https://acme.example/acct/1"}
+    )
+    push_acme_account(harness, "https://acme.example/acct/2")
+    r_id, csr = store_revocable_certificate(harness, peer_id, "https://acme.example/acct/1")
+
+    harness.update_relation_data(
+        r_id, "remote/0", {"certificate_signing_requests": json.dumps([])}
+    )
+
+    assert fake_lego.revoked == []
+    assert f"revocation_{csr_digest(csr)}" not in harness.get_relation_data(
+        peer_id, harness.charm.app.name
+    )
+    assert harness.get_relation_data(peer_id, harness.charm.unit.name)["acme_account"] == (
+        "https://acme.example/acct/2"
+    )
+
+
+def test_update_status_removes_lego_files_of_certificates_not_served(harness):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    harness.add_relation("replicas", harness.charm.app.name)
+    request_cert(harness)
+    client = harness._backend._pebble_clients["lego"]
+    ca_key = generate_private_key()
+    ca = generate_ca(ca_key, subject="ca")
+    leftover = generate_certificate(
+        generate_csr(generate_private_key(), subject="old"), ca, ca_key
+    ).decode()
+    client.push("/tmp/.lego/certificates/old.crt", source=leftover)
+    client.push("/tmp/.lego/certificates/old.key", source="key")
+    client.push("/tmp/.lego/certificates/old.json", source="{}")
+
+    harness.charm.on.update_status.emit()
+
+    assert sorted(file.name for file in client.list_files("/tmp/.lego/certificates")) == [
+        "foo.crt",
+        "foo.json",
+    ]
+    metrics = client.pull(METRICS_PATH).read()
+    assert "lego_removed_files_total 3\n" in metrics
+
+
+def test_update_status_keeps_lego_files_of_most_recent_certificates(harness):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    harness.add_relation("replicas", harness.charm.app.name)
+    harness.update_config({"max-lego-certificates": 0})
+    request_cert(harness)
+
+    harness.charm.on.update_status.emit()
+
+    client = harness._backend._pebble_clients["lego"]
+    assert client.list_files("/tmp/.lego/certificates") == []
+    relation = harness.model.get_relation("certificates")
+    assert len(harness.charm.tls_certificates.get_relation_certificates(relation.id)) == 1
+
+
+def test_csr_rewritten_with_other_line_endings_is_not_ordered_again(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    (request,) = json.loads(
+        harness.get_relation_data(relation.id, "remote/0")["certificate_signing_requests"]
+    )
+    rewritten_csr = request["certificate_signing_request"].replace("\n", "\r\n") + "\r\n"
+
+    harness.update_relation_data(
+        relation.id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": rewritten_csr}]
+            )
+        },
+    )
+
+    assert exec_mock.call_count == 1
+    assert len(harness.charm.tls_certificates.get_relation_certificates(relation.id)) == 1
+
+
+def test_unchanged_relation_data_is_not_written_again(harness, monkeypatch):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    (certificate,) = harness.charm.tls_certificates.get_relation_certificates(relation.id)
+    harness.framework.commit()
+    relation_set = Mock(wraps=harness._backend.relation_set)
+    monkeypatch.setattr(harness._backend, "relation_set", relation_set)
+
+    harness.charm.tls_certificates.set_relation_certificate(
+        certificate=certificate["certificate"],
+        certificate_signing_request=certificate["certificate_signing_request"],
+        ca=certificate["ca"],
+        chain=certificate["chain"],
+        relation_id=relation.id,
+    )
+    harness.charm.tls_certificates.remove_certificate(certificate="not a certificate")
+    harness.charm.tls_certificates.revoke_all_certificates()
+    harness.charm.tls_certificates.revoke_all_certificates()
+    harness.framework.commit()
+
+    assert relation_set.call_count == 1
+
+
+def test_certificates_published_in_a_hook_are_written_once_per_relation(harness, monkeypatch):
+    harness._backend._pebble_clients["lego"].exec = FakeLego(harness)
+    harness.set_can_connect("lego", False)
+    relation_ids = []
+    for remote in ("first", "second"):
+        r_id = harness.add_relation("certificates", remote)
+        harness.add_relation_unit(r_id, f"{remote}/0")
+        csrs = [
+            generate_csr(generate_private_key(), subject=f"{remote}{index}").decode().strip()
+            for index in range(2)
+        ]
+        harness.update_relation_data(
+            r_id,
+            f"{remote}/0",
+            {
+                "certificate_signing_requests": json.dumps(
+                    [{"certificate_signing_request": csr} for csr in csrs]
+                )
+            },
+        )
+        relation_ids.append(r_id)
+    harness.set_can_connect("lego", True)
+    relation_set = Mock(wraps=harness._backend.relation_set)
+    monkeypatch.setattr(harness._backend, "relation_set", relation_set)
+
+    harness.charm.on.update_status.emit()
+
+    assert relation_set.call_count == 0
+    harness.framework.commit()
+    assert sorted(call[0][0] for call in relation_set.call_args_list) == relation_ids
+    for r_id in relation_ids:
+        certificates = json.loads(
+            harness.get_relation_data(r_id, harness.charm.app.name)["certificates"]
+        )
+        assert len(certificates) == 2
+
+
 def test_cannot_connect(harness):
     harness.set_can_connect("lego", False)
     request_cert(harness)
     assert harness.charm.unit.status == WaitingStatus("Waiting for container to be ready")
+    assert len(harness.charm._stored.pending_requests) == 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_request_received_while_container_starts_is_served_in_the_same_hook(harness, monkeypatch):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    harness.update_config({"container-ready-timeout": 10})
+    harness.set_can_connect("lego", False)
+    clock = FakeClock()
+
+    def sleep(seconds):
+        clock.sleep(seconds)
+        if len(clock.sleeps) == 3:
+            harness.set_can_connect("lego", True)
+
+    monkeypatch.setattr("charm.time.monotonic", clock.monotonic)
+    monkeypatch.setattr("charm.time.sleep", sleep)
+
+    request_cert(harness)
+
+    assert clock.sleeps == [0.25, 0.5, 1.0]
+    assert exec_mock.call_count == 1
+
+
+def test_container_readiness_wait_is_bounded(harness, monkeypatch):
+    harness.update_config({"container-ready-timeout": 10})
+    harness.set_can_connect("lego", False)
+    clock = FakeClock()
+    monkeypatch.setattr("charm.time.monotonic", clock.monotonic)
+    monkeypatch.setattr("charm.time.sleep", clock.sleep)
+
+    request_cert(harness)
+
+    assert clock.sleeps == [0.25, 0.5, 1.0, 2.0, 2.0, 2.0, 2.0, 0.25]
+    assert harness.charm.unit.status == WaitingStatus("Waiting for container to be ready")
+    assert len(harness.charm._stored.pending_requests) == 1
+
+
+def test_pending_requests_are_processed_once_on_pebble_ready(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    harness.set_can_connect("lego", False)
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    harness.update_relation_data(relation.id, "remote/0", {"unrelated": "change"})
+    assert len(harness.charm._stored.pending_requests) == 1
+
+    harness.set_can_connect("lego", True)
+    container = harness.model.unit.get_container("lego")
+    harness.charm.on.lego_pebble_ready.emit(container)
+
+    assert exec_mock.call_count == 1
+    assert len(harness.charm._stored.pending_requests) == 0
+
+
+@pytest.mark.parametrize("with_peer_relation", [False, True])
+def test_pending_request_of_removed_relation_is_not_ordered(harness, with_peer_relation):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    if with_peer_relation:
+        peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    harness.set_can_connect("lego", False)
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+
+    harness.remove_relation(relation.id)
+    harness.set_can_connect("lego", True)
+    container = harness.model.unit.get_container("lego")
+    harness.charm.on.lego_pebble_ready.emit(container)
+
+    assert exec_mock.call_count == 0
+    assert len(harness.charm._stored.pending_requests) == 0
+    if with_peer_relation:
+        assert not [
+            key
+            for key in harness.get_relation_data(peer_id, harness.charm.app.name)
+            if key.startswith("assignment_")
+        ]
+
+
+def test_assigned_request_is_not_queued_again_on_requirer_change(harness):
+    harness._backend._pebble_clients["lego"].exec = Mock()
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    harness.add_relation_unit(peer_id, "lego/1")
+    harness.set_can_connect("lego", False)
+    request_cert(harness)
+    relation = harness.model.get_relation("certificates")
+    assignments = {
+        key: value
+        for key, value in harness.get_relation_data(peer_id, harness.charm.app.name).items()
+        if key.startswith("assignment_")
+    }
+    assert len(assignments) == 1
+
+    harness.add_relation_unit(peer_id, "lego/2")
+    harness.update_relation_data(relation.id, "remote/0", {"unrelated": "change"})
+
+    assert harness.charm._stored.pending_requests == {}
+    app_data = harness.get_relation_data(peer_id, harness.charm.app.name)
+    assert {key: app_data[key] for key in assignments} == assignments
+
+
+def test_requests_are_assigned_to_peer_units_and_published_by_leader(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    harness.add_relation_unit(peer_id, "lego/1")
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = [generate_csr(generate_private_key(), subject="foo").decode().strip() for _ in range(8)]
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs]
+            )
+        },
+    )
+
+    assignments = {
+        key: json.loads(value)
+        for key, value in harness.get_relation_data(peer_id, harness.charm.app.name).items()
+        if key.startswith("assignment_")
+    }
+    peer_digests = [
+        key.split("assignment_", 1)[1]
+        for key, assignment in assignments.items()
+        if assignment["unit"] == "lego/1"
+    ]
+    assert 0 < len(peer_digests) < len(csrs)
+    assert exec_mock.call_count == len(csrs) - len(peer_digests)
+
+    ca_key = generate_private_key()
+    ca = generate_ca(ca_key, subject="ca")
+    chain = [generate_certificate(csrs[0].encode(), ca, ca_key).decode(), ca.decode()]
+    harness.update_relation_data(
+        peer_id,
+        "lego/1",
+        {f"result_{digest}": json.dumps({"certificates": chain}) for digest in peer_digests},
+    )
+
+    assert not any(
+        key.startswith("assignment_")
+        for key in harness.get_relation_data(peer_id, harness.charm.app.name)
+    )
+    harness.framework.commit()
+    provider_certificates = json.loads(
+        harness.get_relation_data(r_id, harness.charm.app.name)["certificates"]
+    )
+    assert sorted(
+        csr_digest(cert["certificate_signing_request"]) for cert in provider_certificates
+    ) == sorted(csr_digest(csr) for csr in csrs)
+
+
+def test_non_leader_issues_assigned_requests(harness):
+    exec_mock = Mock(side_effect=FakeLego(harness))
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    harness.set_leader(False)
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    harness.add_relation_unit(peer_id, "lego/1")
+    r_id = harness.add_relation("certificates", "remote")
+    csr = generate_csr(generate_private_key(), subject="foo").decode().strip()
+    digest = csr_digest(csr)
+    harness.update_relation_data(
+        peer_id,
+        harness.charm.app.name,
+        {
+            f"assignment_{digest}": json.dumps(
+                {
+                    "unit": harness.charm.unit.name,
+                    "certificate_signing_request": csr,
+                    "relation_id": r_id,
+                }
+            )
+        },
+    )
+
+    assert exec_mock.call_count == 1
+    result = json.loads(
+        harness.get_relation_data(peer_id, harness.charm.unit.name)[f"result_{digest}"]
+    )
+    assert len(result["certificates"]) == 2
+
+
+def test_stored_certificate_is_served_without_new_order(harness):
+    exec_mock = Mock()
+    harness._backend._pebble_clients["lego"].exec = exec_mock
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    ca_key = generate_private_key()
+    ca = generate_ca(ca_key, subject="ca")
+    csr = generate_csr(generate_private_key(), subject="foo")
+    certificate = generate_certificate(csr, ca, ca_key)
+    digest = csr_digest(csr.decode())
+    harness.update_relation_data(
+        peer_id,
+        harness.charm.app.name,
+        {
+            f"certificate_{digest}": json.dumps(
+                {
+                    "subject": "foo",
+                    "certificate_signing_request": csr.decode().strip(),
+                    "relation_id": 0,
+                    "certificates": [certificate.decode(), ca.decode()],
+                    "expiry": "2999-01-01T00:00:00",
+                }
+            )
+        },
+    )
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr.decode().strip()}]
+            )
+        },
+    )
+
+    exec_mock.assert_not_called()
+    harness.framework.commit()
+    provider_certificates = json.loads(
+        harness.get_relation_data(r_id, harness.charm.app.name)["certificates"]
+    )
+    assert provider_certificates[0]["certificate"] == certificate.decode().strip()
+
+
+def test_consolidated_orders_for_the_same_names_are_assigned_to_one_unit(harness):
+    harness._backend._pebble_clients["lego"].exec = Mock(
+        return_value=Mock(wait_output=lambda: (None, None))
+    )
+    harness.update_config({"consolidate-orders": True})
+    harness.set_can_connect("lego", False)
+    peer_id = harness.add_relation("replicas", harness.charm.app.name)
+    harness.add_relation_unit(peer_id, "lego/1")
+    harness.add_relation_unit(peer_id, "lego/2")
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = [
+        generate_csr(
+            generate_private_key(),
+            subject="host.example.com",
+            sans=["host.example.com", "www.example.com"][:: 1 if i % 2 else -1],
+        )
+        .decode()
+        .strip()
+        for i in range(6)
+    ]
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs]
+            )
+        },
+    )
+
+    assigned_units = {
+        json.loads(value)["unit"]
+        for key, value in harness.get_relation_data(peer_id, harness.charm.app.name).items()
+        if key.startswith("assignment_")
+    }
+    assert len(assigned_units) == 1
+
+
+def test_orders_for_different_zones_run_concurrently(harness, monkeypatch):
+    harness.update_config({"max-concurrent-orders": 2, "authoritative-propagation-check": True})
+    monkeypatch.setattr("charm.system_resolver", lambda: ("127.0.0.1", 53))
+    monkeypatch.setattr(
+        "charm.find_authoritative_nameservers",
+        lambda domains, resolver: {
+            domain: Zone(name="example.com", nameservers=["ns1.example.net"])
+            for domain in domains
+            if domain.endswith("example.com")
+        },
+    )
+    fake_lego = FakeLego(harness)
+    events = []
+
+    def exec_lego(command, **kwargs):
+        events.append(("start", command))
+        fake_lego(command, **kwargs)
+        return Mock(wait_output=lambda: events.append(("wait", command)) or ("", ""))
+
+    harness._backend._pebble_clients["lego"].exec = exec_lego
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csrs = [
+        generate_csr(generate_private_key(), subject=subject).decode().strip()
+        for subject in ("a.example.com", "b.example.com", "c.example.org")
+    ]
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {
+            "certificate_signing_requests": json.dumps(
+                [{"certificate_signing_request": csr} for csr in csrs]
+            )
+        },
+    )
+
+    assert [event for event, _ in events] == ["start", "start", "wait", "wait", "start", "wait"]
+    for _, command in events:
+        domain = (
+            x509.load_pem_x509_csr(
+                harness._backend._pebble_clients["lego"]
+                .pull(command[command.index("--csr") + 1])
+                .read()
+                .encode()
+            )
+            .subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0]
+            .value
+        )
+        has_resolver = "ns1.example.net:53" in command
+        assert has_resolver == domain.endswith("example.com")
+
+
+@pytest.mark.parametrize(
+    "sans,expected_resolvers",
+    [
+        (["a.example.com", "b.example.com"], ["ns1.example.net:53"]),
+        (["a.example.com", "b.example.org"], []),
+        (["a.example.com", "unknown.example.net"], []),
+    ],
+)
+def test_authoritative_nameservers_are_only_used_for_csrs_in_a_single_zone(
+    harness, monkeypatch, sans, expected_resolvers
+):
+    harness.update_config({"authoritative-propagation-check": True})
+    monkeypatch.setattr("charm.system_resolver", lambda: ("127.0.0.1", 53))
+    zones = {
+        "a.example.com": Zone(name="example.com", nameservers=["ns1.example.net"]),
+        "b.example.com": Zone(name="example.com", nameservers=["ns1.example.net"]),
+        "b.example.org": Zone(name="example.org", nameservers=["ns1.example.org"]),
+    }
+    monkeypatch.setattr(
+        "charm.find_authoritative_nameservers",
+        lambda domains, resolver: {domain: zones[domain] for domain in domains if domain in zones},
+    )
+    commands = []
+    fake_lego = FakeLego(harness)
+
+    def exec_lego(command, **kwargs):
+        commands.append(command)
+        return fake_lego(command, **kwargs)
+
+    harness._backend._pebble_clients["lego"].exec = exec_lego
+    r_id = harness.add_relation("certificates", "remote")
+    harness.add_relation_unit(r_id, "remote/0")
+    csr = generate_csr(generate_private_key(), subject=sans[0], sans=sans).decode().strip()
+    harness.update_relation_data(
+        r_id,
+        "remote/0",
+        {"certificate_signing_requests": json.dumps([{"certificate_signing_request": csr}])},
+    )
+
+    assert len(commands) == 1
+    resolvers = [
+        commands[0][index + 1]
+        for index, argument in enumerate(commands[0])
+        if argument == "--dns.resolvers"
+    ]
+    assert resolvers == expected_resolvers
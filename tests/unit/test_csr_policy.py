@@ -0,0 +1,92 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+
+from csr_policy import CSRPolicy
+
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def make_csr(common_name=None, dns_names=(), other_names=(), key=RSA_KEY):
+    builder = x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)] if common_name else [])
+    )
+    names = [x509.DNSName(name) for name in dns_names] + list(other_names)
+    if names:
+        builder = builder.add_extension(x509.SubjectAlternativeName(names), critical=False)
+    return builder.sign(key, hashes.SHA256())
+
+
+def policy(**kwargs):
+    config = {
+        "allowed-domains": "",
+        "allowed-key-types": "rsa,ecdsa",
+        "min-rsa-key-size": 2048,
+        "max-csr-domains": 100,
+    }
+    config.update(kwargs)
+    return CSRPolicy.from_config(config)
+
+
+def test_valid_csr_is_accepted():
+    csr = make_csr("example.com", ["*.example.com", "xn--bcher-kva.example"])
+
+    assert policy().check(csr) is None
+
+
+def test_csr_with_tampered_signature_is_rejected():
+    csr = make_csr("example.com")
+    signature = csr.signature
+    tampered_signature = bytes([signature[0] ^ 0xFF]) + signature[1:]
+    tampered = x509.load_der_x509_csr(
+        csr.public_bytes(Encoding.DER).replace(signature, tampered_signature)
+    )
+
+    assert policy().check(tampered) == "CSR signature is not valid"
+
+
+def test_key_types_and_sizes_are_checked():
+    small_key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+    ec_key = ec.generate_private_key(ec.SECP256R1())
+    unsupported_curve_key = ec.generate_private_key(ec.SECP521R1())
+
+    assert (
+        policy().check(make_csr("example.com", key=small_key))
+        == "RSA key size 1024 is not between 2048 and 4096"
+    )
+    assert policy().check(make_csr("example.com", key=ec_key)) is None
+    assert policy(**{"allowed-key-types": "rsa"}).check(make_csr("example.com", key=ec_key)) == (
+        "ECDSA keys are not allowed"
+    )
+    assert (
+        policy().check(make_csr("example.com", key=unsupported_curve_key))
+        == "Elliptic curve secp521r1 is not supported"
+    )
+
+
+def test_names_are_checked():
+    assert policy().check(make_csr()) == "CSR has neither a common name nor DNS names"
+    assert (
+        policy().check(make_csr("example.com", other_names=[x509.RFC822Name("a@example.com")]))
+        == "CSR has subject alternative names other than DNS names"
+    )
+    assert policy().check(make_csr("bad_name.example.com")) == (
+        "bad_name.example.com is not a valid domain name"
+    )
+    assert policy(**{"max-csr-domains": 2}).check(
+        make_csr("a.example.com", ["b.example.com", "c.example.com"])
+    ) == ("CSR has 3 names, at most 2 are allowed")
+
+
+def test_names_outside_allowed_domains_are_rejected():
+    allowed = policy(**{"allowed-domains": "example.com, example.org."})
+
+    assert allowed.check(make_csr("example.com", ["*.sub.example.org"])) is None
+    assert allowed.check(make_csr("example.com", ["badexample.com"])) == (
+        "badexample.com is not in the allowed domains"
+    )
@@ -0,0 +1,133 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import socket
+import struct
+import threading
+
+import pytest
+
+from dns_propagation import (
+    DNSQueryError,
+    NameNotFoundError,
+    Zone,
+    _encode_name,
+    find_authoritative_nameservers,
+    find_zone,
+    query_nameservers,
+)
+
+ZONES = {
+    "example.com": ["ns1.example.net", "ns2.example.net"],
+    "example.org": ["a.iana-servers.net"],
+    "apps.example.org": ["ns.apps.example.org"],
+    "co.uk": ["nic.uk"],
+    "example.co.uk": ["ns.example.co.uk"],
+}
+
+
+class StandInDNSServer:
+    """Answers NS queries for a fixed set of zones, like an authoritative DNS server would."""
+
+    def __init__(self, zones):
+        self.zones = zones
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def serve(self):
+        while True:
+            try:
+                query, client = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.sock.sendto(self.answer(query), client)
+
+    def answer(self, query):
+        query_id = struct.unpack("!H", query[:2])[0]
+        labels, offset = [], 12
+        while query[offset]:
+            label_start = offset + 1
+            offset = label_start + query[offset]
+            labels.append(query[label_start:offset].decode())
+        question_end = offset + 5
+        question = query[12:question_end]
+        zone = ".".join(labels)
+        self.queries.append(zone)
+        nameservers = self.zones.get(zone)
+        if nameservers is None:
+            return struct.pack("!HHHHHH", query_id, 0x8183, 1, 0, 0, 0) + question
+        response = struct.pack("!HHHHHH", query_id, 0x8180, 1, len(nameservers), 0, 0)
+        response += question
+        for nameserver in nameservers:
+            data = _encode_name(nameserver)
+            response += struct.pack("!HHHIH", 0xC00C, 2, 1, 300, len(data)) + data
+        return response
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def dns_server():
+    server = StandInDNSServer(ZONES)
+    server.thread.start()
+    yield server
+    server.close()
+
+
+def test_query_nameservers(dns_server):
+    assert query_nameservers("example.com", dns_server.address) == ZONES["example.com"]
+
+
+def test_query_nameservers_of_unknown_zone_raises(dns_server):
+    with pytest.raises(NameNotFoundError):
+        query_nameservers("unknown.test", dns_server.address)
+
+
+@pytest.mark.parametrize(
+    "domain,zone",
+    [
+        ("example.com", "example.com"),
+        ("*.www.Example.com.", "example.com"),
+        ("foo.example.co.uk", "example.co.uk"),
+        ("web.apps.example.org", "apps.example.org"),
+        ("www.example.org", "example.org"),
+    ],
+)
+def test_find_zone(dns_server, domain, zone):
+    assert find_zone(domain, dns_server.address) == Zone(name=zone, nameservers=ZONES[zone])
+
+
+def test_find_zone_does_not_return_top_level_domains(dns_server):
+    assert find_zone("unknown.test", dns_server.address) is None
+    assert dns_server.queries == ["unknown.test"]
+
+
+def test_find_authoritative_nameservers_skips_failed_domains(dns_server):
+    zones = find_authoritative_nameservers(
+        ["www.example.com", "example.org", "unknown.test", "www.example.com"],
+        dns_server.address,
+        timeout=1,
+        max_workers=2,
+    )
+
+    assert zones == {
+        "www.example.com": Zone(name="example.com", nameservers=ZONES["example.com"]),
+        "example.org": Zone(name="example.org", nameservers=ZONES["example.org"]),
+    }
+    assert sorted(dns_server.queries) == [
+        "example.com",
+        "example.org",
+        "unknown.test",
+        "www.example.com",
+    ]
+
+
+def test_query_nameservers_times_out():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as silent:
+        silent.bind(("127.0.0.1", 0))
+        with pytest.raises(DNSQueryError):
+            query_nameservers("example.com", silent.getsockname(), timeout=0.1)
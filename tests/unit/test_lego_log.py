@@ -0,0 +1,63 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from datetime import datetime
+
+from lego_log import parse_lego_log, phase_durations, revoked_domains
+
+LEGO_LOG = """2022/10/19 12:00:00 [INFO] acme: Registering account for admin@example.com
+!!!! HEADS UP !!!!
+2022/10/19 12:00:01 [INFO] [example.com] acme: Obtaining SAN certificate given a CSR
+2022/10/19 12:00:02 [INFO] [example.com] AuthURL: https://acme.example.com/authz/1
+2022/10/19 12:00:02 [INFO] [example.com] acme: use dns-01 solver
+2022/10/19 12:00:02 [INFO] [example.com] acme: Preparing to solve DNS-01
+2022/10/19 12:00:04 [INFO] [example.com] acme: Trying to solve DNS-01
+2022/10/19 12:00:04 [INFO] [example.com] acme: Checking DNS record propagation using [ns1:53]
+2022/10/19 12:00:06 [INFO] Wait for propagation [timeout: 1m0s, interval: 2s]
+2022/10/19 12:00:34 [INFO] [example.com] The server validated our request
+2022/10/19 12:00:34 [INFO] [example.com] acme: Cleaning DNS-01 challenge
+2022/10/19 12:00:35 [INFO] [example.com] acme: Validations succeeded; requesting certificates
+2022/10/19 12:00:37 [INFO] [example.com] Server responded with a certificate.
+"""
+
+
+def test_parse_lego_log():
+    events = parse_lego_log(LEGO_LOG)
+
+    assert [event.name for event in events] == [
+        "account_registration",
+        "order_created",
+        "challenge_presented",
+        "propagation_check",
+        "validated",
+        "finalize",
+        "certificate_obtained",
+    ]
+    assert events[0].domain is None
+    assert events[1].domain == "example.com"
+    assert events[4].timestamp == datetime(2022, 10, 19, 12, 0, 34)
+
+
+def test_phase_durations():
+    assert phase_durations(parse_lego_log(LEGO_LOG)) == {
+        "account_registration": 1.0,
+        "order_created": 3.0,
+        "challenge_presented": 0.0,
+        "propagation_check": 30.0,
+        "validated": 1.0,
+        "finalize": 2.0,
+    }
+
+
+def test_unknown_output_has_no_events():
+    assert parse_lego_log("error: something went wrong\n") == []
+
+
+def test_revoked_domains_stop_at_the_first_failure():
+    output = """2022/10/19 12:00:00 Trying to revoke certificate for domain revoke-a
+2022/10/19 12:00:01 Certificate was revoked.
+2022/10/19 12:00:01 Trying to revoke certificate for domain revoke-b
+2022/10/19 12:00:02 acme: error: 400 :: POST :: urn:ietf:params:acme:error:alreadyRevoked
+"""
+
+    assert revoked_domains(output) == ["revoke-a"]
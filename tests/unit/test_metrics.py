@@ -0,0 +1,55 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from datetime import datetime
+from types import SimpleNamespace
+
+from metrics import ISSUED, LEGO_ERROR, IssuanceMetrics
+
+
+def stored_state():
+    return SimpleNamespace(phase_durations={}, order_outcomes={}, garbage_collection={})
+
+
+def test_phase_durations_are_rendered_as_summary():
+    metrics = IssuanceMetrics(stored_state())
+    metrics.observe("lego_exec", 1.5)
+    metrics.observe("lego_exec", 2.5)
+    with metrics.timer("push"):
+        pass
+
+    rendered = metrics.render(queue_depth=0, expiries={})
+
+    assert 'lego_phase_duration_seconds_sum{phase="lego_exec"} 4.0\n' in rendered
+    assert 'lego_phase_duration_seconds_count{phase="lego_exec"} 2\n' in rendered
+    assert 'lego_phase_duration_seconds_count{phase="push"} 1\n' in rendered
+    assert 'lego_phase_duration_seconds_count{phase="pull"} 0\n' in rendered
+
+
+def test_outcomes_queue_depth_and_expiries_are_rendered():
+    metrics = IssuanceMetrics(stored_state())
+    metrics.count_outcome(ISSUED)
+    metrics.count_outcome(ISSUED)
+    metrics.count_outcome(LEGO_ERROR)
+
+    rendered = metrics.render(queue_depth=3, expiries={'quoted "name"': datetime(2023, 1, 1)})
+
+    assert 'lego_orders_total{outcome="issued"} 2\n' in rendered
+    assert 'lego_orders_total{outcome="lego_error"} 1\n' in rendered
+    assert 'lego_orders_total{outcome="invalid_csr"} 0\n' in rendered
+    assert "lego_pending_requests 3\n" in rendered
+    assert (
+        'lego_certificate_expiry_timestamp_seconds{subject="quoted \\"name\\""} 1672531200.0\n'
+        in rendered
+    )
+
+
+def test_garbage_collection_totals_are_rendered():
+    metrics = IssuanceMetrics(stored_state())
+    metrics.count_garbage(removed_files=4, freed_bytes=1000)
+    metrics.count_garbage(removed_files=2, freed_bytes=500)
+
+    rendered = metrics.render(queue_depth=0, expiries={})
+
+    assert "lego_removed_files_total 6\n" in rendered
+    assert "lego_freed_bytes_total 1500\n" in rendered
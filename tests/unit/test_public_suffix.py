@@ -0,0 +1,62 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+
+import public_suffix
+from public_suffix import PublicSuffixList, registered_domain
+
+RULES = """
+// ===BEGIN ICANN DOMAINS===
+com
+uk
+co.uk
+*.ck
+!www.ck
+公司.cn
+// ===BEGIN PRIVATE DOMAINS===
+github.io
+"""
+
+
+@pytest.mark.parametrize(
+    "domain,expected",
+    [
+        ("*.Apps.Example.com.", "example.com"),
+        ("foo.example.co.uk", "example.co.uk"),
+        ("bar.other.co.uk", "other.co.uk"),
+        ("example.uk", "example.uk"),
+        ("co.uk", "co.uk"),
+        ("a.b.example.ck", "b.example.ck"),
+        ("a.www.ck", "www.ck"),
+        ("user.github.io", "user.github.io"),
+        ("a.example.公司.cn", "example.xn--55qx5d.cn"),
+        ("a.example.unlisted", "example.unlisted"),
+    ],
+)
+def test_registered_domain(domain, expected):
+    assert PublicSuffixList(RULES.splitlines()).registered_domain(domain) == expected
+
+
+@pytest.fixture
+def public_suffix_list_paths(monkeypatch, tmp_path):
+    def set_paths(*paths):
+        monkeypatch.setattr(public_suffix, "PUBLIC_SUFFIX_LIST_PATHS", paths)
+        public_suffix._default_list.cache_clear()
+
+    yield set_paths
+    public_suffix._default_list.cache_clear()
+
+
+def test_registered_domain_uses_the_first_list_found(public_suffix_list_paths, tmp_path):
+    path = tmp_path / "public_suffix_list.dat"
+    path.write_text(RULES)
+    public_suffix_list_paths(tmp_path / "missing.dat", path)
+
+    assert registered_domain("foo.example.co.uk") == "example.co.uk"
+
+
+def test_registered_domain_without_list_uses_last_two_labels(public_suffix_list_paths, tmp_path):
+    public_suffix_list_paths(tmp_path / "missing.dat")
+
+    assert registered_domain("*.Apps.Example.co.uk.") == "co.uk"
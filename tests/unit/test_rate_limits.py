@@ -0,0 +1,65 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from rate_limits import RateLimitTracker, record_certificate
+
+PRODUCTION = "https://acme-v02.api.letsencrypt.org/directory"
+STAGING = "https://acme-staging-v02.api.letsencrypt.org/directory"
+
+
+def test_orders_and_certificates_stop_counting_once_out_of_their_window():
+    tracker = RateLimitTracker(SimpleNamespace(order_times=[]), PRODUCTION)
+    now = datetime(2022, 10, 1)
+    issued_certificates = []
+    for registered_domain, fingerprint, age in (
+        ("example.com", "a", timedelta(days=8)),
+        ("example.com", "b", timedelta(days=1)),
+        ("example.org", "c", timedelta(hours=1)),
+    ):
+        issued_certificates = record_certificate(
+            issued_certificates, registered_domain, fingerprint, now - age
+        )
+    for age in (timedelta(hours=4), timedelta(hours=1), timedelta(0)):
+        tracker.record_order(now - age)
+
+    assert tracker.budget(now, issued_certificates) == {
+        "server": PRODUCTION,
+        "new-orders-left": 298,
+        "certificates-per-domain-left": {"example.com": 49, "example.org": 49},
+    }
+
+
+def test_certificate_served_to_several_requests_is_counted_once():
+    now = datetime(2022, 10, 1)
+    issued_certificates = record_certificate([], "example.com", "a", now - timedelta(days=8))
+    issued_certificates = record_certificate(issued_certificates, "example.com", "b", now)
+    issued_certificates = record_certificate(issued_certificates, "example.com", "b", now)
+
+    assert issued_certificates == [[now.isoformat(), "example.com", "b"]]
+
+
+@pytest.mark.parametrize(
+    "server,expected_budget",
+    [
+        (
+            STAGING,
+            {
+                "server": STAGING,
+                "new-orders-left": 1499,
+                "certificates-per-domain-left": {"example.com": 29999},
+            },
+        ),
+        ("https://acme.example/directory", {"server": "https://acme.example/directory"}),
+    ],
+)
+def test_budget_is_reported_against_the_limits_of_the_acme_server(server, expected_budget):
+    tracker = RateLimitTracker(SimpleNamespace(order_times=[]), server)
+    now = datetime(2022, 10, 1)
+    tracker.record_order(now)
+
+    assert tracker.budget(now, record_certificate([], "example.com", "a", now)) == expected_budget
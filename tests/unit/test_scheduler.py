@@ -0,0 +1,133 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from scheduler import EXPIRED, EXPIRING, NEW, REVOCATION, RequestScheduler, expiry_priority
+
+
+def test_expiry_priority():
+    now = datetime(2022, 10, 1)
+
+    assert expiry_priority(None, now) == NEW
+    assert expiry_priority(now - timedelta(seconds=1), now) == EXPIRED
+    assert expiry_priority(now + timedelta(days=10), now) == EXPIRING
+    assert expiry_priority(now + timedelta(days=60), now) == NEW
+
+
+def test_schedule_orders_by_priority_then_age():
+    requests = {
+        "new": {"priority": NEW, "received_at": "2022-10-01T00:00:00", "domain": "a"},
+        "expiring-b": {"priority": EXPIRING, "received_at": "2022-10-01T00:00:01", "domain": "b"},
+        "expiring-a": {"priority": EXPIRING, "received_at": "2022-10-01T00:00:02", "domain": "a"},
+        "expired": {"priority": EXPIRED, "received_at": "2022-10-01T00:00:03", "domain": "c"},
+        "legacy": {"domain": "a"},
+    }
+
+    scheduler = RequestScheduler(SimpleNamespace(relation_turns={}))
+
+    assert [digest for digest, _ in scheduler.schedule(requests)] == [
+        "expired",
+        "expiring-b",
+        "expiring-a",
+        "legacy",
+        "new",
+    ]
+    assert [
+        digest for digest, _ in scheduler.schedule(requests, lambda request: request["domain"])
+    ][1:3] == ["expiring-a", "expiring-b"]
+
+
+def test_revocations_come_after_every_request():
+    requests = {
+        "revocation": {
+            "priority": REVOCATION,
+            "relation_id": 2,
+            "received_at": "2022-10-01T00:00:00",
+        },
+        "new": {"priority": NEW, "relation_id": 1, "received_at": "2022-10-01T00:00:01"},
+        "expired": {"priority": EXPIRED, "relation_id": 1, "received_at": "2022-10-01T00:00:02"},
+    }
+
+    scheduler = RequestScheduler(SimpleNamespace(relation_turns={}))
+
+    assert [digest for digest, _ in scheduler.schedule(requests)] == [
+        "expired",
+        "new",
+        "revocation",
+    ]
+
+
+def test_relations_take_turns_within_a_priority():
+    requests = {
+        f"busy-{index}": {
+            "priority": NEW,
+            "relation_id": 1,
+            "received_at": f"2022-10-01T00:00:0{index}",
+        }
+        for index in range(3)
+    }
+    requests["quiet"] = {"priority": NEW, "relation_id": 2, "received_at": "2022-10-01T00:00:05"}
+    requests["renewal"] = {
+        "priority": EXPIRING,
+        "relation_id": 1,
+        "received_at": "2022-10-01T00:00:09",
+    }
+
+    scheduler = RequestScheduler(SimpleNamespace(relation_turns={}))
+
+    assert [digest for digest, _ in scheduler.schedule(requests)] == [
+        "renewal",
+        "busy-0",
+        "quiet",
+        "busy-1",
+        "busy-2",
+    ]
+
+    scheduler.record_turn(1)
+    del requests["busy-0"]
+
+    assert [digest for digest, _ in scheduler.schedule(requests)][1:] == [
+        "quiet",
+        "busy-1",
+        "busy-2",
+    ]
+
+
+def test_groups_do_not_outrank_relation_turns():
+    requests = {
+        f"a{index}": {
+            "priority": NEW,
+            "relation_id": 1,
+            "received_at": f"2022-10-01T00:00:0{index}",
+            "domain": "a.com" if index % 2 else "b.com",
+        }
+        for index in range(5)
+    }
+    requests["z"] = {
+        "priority": NEW,
+        "relation_id": 2,
+        "received_at": "2022-10-01T00:00:09",
+        "domain": "z.com",
+    }
+
+    scheduler = RequestScheduler(SimpleNamespace(relation_turns={}))
+
+    assert [
+        digest for digest, _ in scheduler.schedule(requests, lambda request: request["domain"])
+    ] == ["a1", "z", "a3", "a0", "a2", "a4"]
+
+
+def test_relation_with_new_requests_starts_level_with_waiting_relations():
+    scheduler = RequestScheduler(SimpleNamespace(relation_turns={"1": 5, "2": 3, "3": 9}))
+
+    scheduler.schedule(
+        {
+            "a": {"relation_id": 1},
+            "b": {"relation_id": 2},
+            "c": {"relation_id": 4},
+        }
+    )
+
+    assert scheduler._stored.relation_turns == {"1": 5, "2": 3, "4": 3}
@@ -0,0 +1,385 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+
+import pytest
+from charms.tls_certificates_interface.v1.tls_certificates import (  # type: ignore[import]
+    CertificateAvailableEvent,
+    CertificateRevocationRequestEvent,
+    TLSCertificatesProvidesV1,
+    TLSCertificatesRequiresV1,
+    csr_digest,
+    generate_csr,
+    generate_private_key,
+)
+from ops.charm import CharmBase
+from ops.testing import Harness
+
+PROVIDER_METADATA = """
+name: provider
+provides:
+  certificates:
+    interface: tls-certificates
+"""
+
+REQUIRER_METADATA = """
+name: requirer
+requires:
+  certificates:
+    interface: tls-certificates
+    limit: 1
+"""
+
+
+class ProviderCharm(CharmBase):
+    options: dict = {}
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.certificates = TLSCertificatesProvidesV1(self, "certificates", **self.options)
+        self.revoked_csrs = []
+        self.framework.observe(
+            self.certificates.on.certificate_revocation_request, self._on_revocation_request
+        )
+
+    def _on_revocation_request(self, event: CertificateRevocationRequestEvent) -> None:
+        self.revoked_csrs.append(event.certificate_signing_request)
+
+
+@pytest.fixture
+def provider():
+    def build(**options):
+        charm_class = type("ProviderCharm", (ProviderCharm,), {"options": options})
+        harness = Harness(charm_class, meta=PROVIDER_METADATA)
+        harness.set_leader(True)
+        harness.begin()
+        harness_list.append(harness)
+        return harness
+
+    harness_list = []
+    yield build
+    for harness in harness_list:
+        harness.cleanup()
+
+
+class RequirerCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.certificates = TLSCertificatesRequiresV1(self, "certificates")
+        self.available_certificates = []
+        self.framework.observe(
+            self.certificates.on.certificate_available, self._on_certificate_available
+        )
+
+    def _on_certificate_available(self, event: CertificateAvailableEvent) -> None:
+        self.available_certificates.append(event.certificate)
+
+
+@pytest.fixture
+def requirer():
+    harness = Harness(RequirerCharm, meta=REQUIRER_METADATA)
+    harness.begin()
+    yield harness
+    harness.cleanup()
+
+
+def new_csr(subject: str) -> str:
+    return generate_csr(generate_private_key(), subject=subject).decode().strip()
+
+
+def certificate_for(csr: str, certificate: str = "certificate") -> dict:
+    return {
+        "certificate": certificate,
+        "certificate_signing_request": csr,
+        "ca": "ca",
+        "chain": ["ca"],
+    }
+
+
+def test_given_coalesced_writes_when_charm_writes_own_key_then_flush_keeps_it(provider):
+    harness = provider(coalesce_writes=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    relation = harness.model.get_relation("certificates", relation_id)
+    csr = new_csr("foo.example.com")
+
+    harness.charm.certificates.set_relation_certificate(
+        relation_id=relation_id, **certificate_for(csr)
+    )
+    relation.data[harness.charm.app]["endpoint"] = "https://provider"
+    harness.framework.commit()
+
+    app_data = harness.get_relation_data(relation_id, harness.charm.app.name)
+    assert app_data["endpoint"] == "https://provider"
+    assert json.loads(app_data["certificates"]) == [certificate_for(csr)]
+
+
+def test_given_coalesced_writes_when_charm_changes_key_then_flush_does_not_revert_it(provider):
+    harness = provider(coalesce_writes=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    relation = harness.model.get_relation("certificates", relation_id)
+    harness.update_relation_data(relation_id, harness.charm.app.name, {"endpoint": "old"})
+    csr = new_csr("foo.example.com")
+
+    harness.charm.certificates.set_relation_certificate(
+        relation_id=relation_id, **certificate_for(csr)
+    )
+    relation.data[harness.charm.app]["endpoint"] = "new"
+    harness.framework.commit()
+
+    assert harness.get_relation_data(relation_id, harness.charm.app.name)["endpoint"] == "new"
+
+
+def test_given_coalesced_writes_when_hook_not_committed_then_relation_data_unchanged(provider):
+    harness = provider(coalesce_writes=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    csr = new_csr("foo.example.com")
+
+    harness.charm.certificates.set_relation_certificate(
+        relation_id=relation_id, **certificate_for(csr)
+    )
+
+    assert "certificates" not in harness.get_relation_data(relation_id, harness.charm.app.name)
+    assert harness.charm.certificates.get_relation_certificates(relation_id) == [
+        certificate_for(csr)
+    ]
+
+
+def test_given_coalesced_writes_when_relation_removed_then_flush_skips_it(provider):
+    harness = provider(coalesce_writes=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    harness.charm.certificates.set_relation_certificate(
+        relation_id=relation_id, **certificate_for(new_csr("foo.example.com"))
+    )
+
+    harness.remove_relation(relation_id)
+    harness.charm.certificates.flush()
+
+    assert harness.charm.certificates._app_data_buffers == {}
+
+
+def sharded_keys(app_data: dict) -> dict:
+    return {key: value for key, value in app_data.items() if key.startswith("certificate")}
+
+
+def test_given_legacy_array_when_sharded_certificate_added_then_certificates_are_migrated(
+    provider,
+):
+    harness = provider(sharded_databag=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    legacy_csrs = [new_csr("a.example.com"), new_csr("b.example.com")]
+    harness.update_relation_data(
+        relation_id,
+        harness.charm.app.name,
+        {"certificates": json.dumps([certificate_for(csr) for csr in legacy_csrs])},
+    )
+    csr = new_csr("c.example.com")
+
+    harness.charm.certificates.set_relation_certificate(
+        relation_id=relation_id, **certificate_for(csr)
+    )
+
+    app_data = harness.get_relation_data(relation_id, harness.charm.app.name)
+    digests = [csr_digest(csr) for csr in legacy_csrs + [csr]]
+    assert sharded_keys(app_data) == {
+        "certificates_manifest": json.dumps(digests),
+        **{
+            f"certificate_{digest}": json.dumps(certificate_for(csr))
+            for digest, csr in zip(digests, legacy_csrs + [csr])
+        },
+    }
+
+
+def test_given_sharded_layout_when_certificate_replaced_then_only_its_key_changes(provider):
+    harness = provider(sharded_databag=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    csrs = [new_csr("a.example.com"), new_csr("b.example.com")]
+    for csr in csrs:
+        harness.charm.certificates.set_relation_certificate(
+            relation_id=relation_id, **certificate_for(csr)
+        )
+    before = dict(harness.get_relation_data(relation_id, harness.charm.app.name))
+
+    harness.charm.certificates.set_relation_certificate(
+        relation_id=relation_id, **certificate_for(csrs[0])
+    )
+    harness.charm.certificates.set_relation_certificate(
+        relation_id=relation_id, **certificate_for(csrs[1], certificate="renewed")
+    )
+
+    after = harness.get_relation_data(relation_id, harness.charm.app.name)
+    changed_keys = {key for key in after if after[key] != before.get(key)}
+    assert changed_keys == {f"certificate_{csr_digest(csrs[1])}"}
+    assert json.loads(after["certificates_manifest"]) == [csr_digest(csr) for csr in csrs]
+
+
+def test_given_sharded_layout_when_certificate_removed_then_key_and_manifest_entry_go(provider):
+    harness = provider(sharded_databag=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    csrs = [new_csr("a.example.com"), new_csr("b.example.com"), new_csr("c.example.com")]
+    for index, csr in enumerate(csrs):
+        harness.charm.certificates.set_relation_certificate(
+            relation_id=relation_id, **certificate_for(csr, certificate=f"certificate-{index}")
+        )
+
+    harness.charm.certificates.remove_certificate(certificate="certificate-0")
+    harness.charm.certificates._remove_certificate(
+        relation_id=relation_id, certificate_signing_request=csrs[1]
+    )
+
+    app_data = harness.get_relation_data(relation_id, harness.charm.app.name)
+    assert sharded_keys(app_data) == {
+        "certificates_manifest": json.dumps([csr_digest(csrs[2])]),
+        f"certificate_{csr_digest(csrs[2])}": json.dumps(
+            certificate_for(csrs[2], certificate="certificate-2")
+        ),
+    }
+
+
+def test_given_sharded_layout_when_csr_no_longer_requested_then_certificate_revoked(provider):
+    harness = provider(sharded_databag=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    harness.add_relation_unit(relation_id, "requirer/0")
+    csrs = [new_csr("a.example.com"), new_csr("b.example.com")]
+    for index, csr in enumerate(csrs):
+        harness.charm.certificates.set_relation_certificate(
+            relation_id=relation_id, **certificate_for(csr, certificate=f"certificate-{index}")
+        )
+
+    harness.update_relation_data(
+        relation_id,
+        "requirer/0",
+        {"certificate_signing_requests": json.dumps([{"certificate_signing_request": csrs[1]}])},
+    )
+
+    assert harness.charm.revoked_csrs == [csrs[0]]
+    app_data = harness.get_relation_data(relation_id, harness.charm.app.name)
+    assert sharded_keys(app_data) == {
+        "certificates_manifest": json.dumps([csr_digest(csrs[1])]),
+        f"certificate_{csr_digest(csrs[1])}": json.dumps(
+            certificate_for(csrs[1], certificate="certificate-1")
+        ),
+    }
+
+
+def test_given_sharded_layout_when_revoke_all_certificates_then_relation_data_is_emptied(
+    provider,
+):
+    harness = provider(sharded_databag=True)
+    relation_id = harness.add_relation("certificates", "requirer")
+    for subject in ("a.example.com", "b.example.com"):
+        harness.charm.certificates.set_relation_certificate(
+            relation_id=relation_id, **certificate_for(new_csr(subject))
+        )
+    harness.update_relation_data(relation_id, harness.charm.app.name, {"endpoint": "kept"})
+
+    harness.charm.certificates.revoke_all_certificates()
+
+    assert harness.get_relation_data(relation_id, harness.charm.app.name) == {
+        "certificates_manifest": "[]",
+        "endpoint": "kept",
+    }
+
+
+def add_provider_relation(harness: Harness, csrs: list) -> int:
+    relation_id = harness.add_relation("certificates", "provider")
+    harness.add_relation_unit(relation_id, "provider/0")
+    for csr in csrs:
+        harness.charm.certificates.request_certificate_creation(csr.encode())
+    return relation_id
+
+
+def test_given_sharded_provider_layout_when_relation_changed_then_certificates_available(
+    requirer,
+):
+    csrs = [new_csr("a.example.com"), new_csr("b.example.com")]
+    relation_id = add_provider_relation(requirer, csrs)
+    digests = [csr_digest(csr) for csr in csrs]
+
+    requirer.update_relation_data(
+        relation_id,
+        "provider",
+        {
+            "certificates_manifest": json.dumps(digests),
+            **{
+                f"certificate_{digest}": json.dumps(
+                    certificate_for(csr, certificate=f"certificate-{index}")
+                )
+                for index, (digest, csr) in enumerate(zip(digests, csrs))
+            },
+        },
+    )
+
+    assert requirer.charm.available_certificates == ["certificate-0", "certificate-1"]
+
+
+def publish_certificates(harness: Harness, relation_id: int, certificates: list) -> None:
+    harness.update_relation_data(
+        relation_id, "provider", {"certificates": json.dumps(certificates)}
+    )
+
+
+def test_given_delivered_certificate_when_unrelated_change_then_not_emitted_again(requirer):
+    csr = new_csr("a.example.com")
+    relation_id = add_provider_relation(requirer, [csr])
+    publish_certificates(requirer, relation_id, [certificate_for(csr)])
+
+    requirer.update_relation_data(relation_id, "provider", {"unrelated": "value"})
+
+    assert requirer.charm.available_certificates == ["certificate"]
+
+
+def test_given_delivered_certificate_when_certificate_changes_then_emitted_again(requirer):
+    csrs = [new_csr("a.example.com"), new_csr("b.example.com")]
+    relation_id = add_provider_relation(requirer, csrs)
+    publish_certificates(
+        requirer,
+        relation_id,
+        [certificate_for(csrs[0], "certificate-a"), certificate_for(csrs[1], "certificate-b")],
+    )
+
+    publish_certificates(
+        requirer,
+        relation_id,
+        [certificate_for(csrs[0], "certificate-a"), certificate_for(csrs[1], "renewed-b")],
+    )
+
+    assert requirer.charm.available_certificates == [
+        "certificate-a",
+        "certificate-b",
+        "renewed-b",
+    ]
+
+
+def test_given_csr_no_longer_requested_when_relation_changed_then_delivery_forgotten(requirer):
+    csrs = [new_csr("a.example.com"), new_csr("b.example.com")]
+    relation_id = add_provider_relation(requirer, csrs)
+    certificates = [certificate_for(csrs[0], "certificate-a"), certificate_for(csrs[1], "b")]
+    publish_certificates(requirer, relation_id, certificates)
+
+    requirer.charm.certificates.request_certificate_revocation(csrs[1].encode())
+    requirer.update_relation_data(relation_id, "provider", {"unrelated": "value"})
+
+    assert dict(requirer.charm.certificates._stored.delivered_certificates).keys() == {
+        csr_digest(csrs[0])
+    }
+
+    requirer.charm.certificates.request_certificate_creation(csrs[1].encode())
+    requirer.update_relation_data(relation_id, "provider", {"unrelated": "other value"})
+
+    assert requirer.charm.available_certificates == ["certificate-a", "b", "b"]
+
+
+def test_given_delivered_certificate_when_relation_broken_then_emitted_on_new_relation(
+    requirer,
+):
+    csr = new_csr("a.example.com")
+    relation_id = add_provider_relation(requirer, [csr])
+    publish_certificates(requirer, relation_id, [certificate_for(csr)])
+
+    requirer.remove_relation(relation_id)
+
+    assert dict(requirer.charm.certificates._stored.delivered_certificates) == {}
+    relation_id = add_provider_relation(requirer, [csr])
+    publish_certificates(requirer, relation_id, [certificate_for(csr)])
+    assert requirer.charm.available_certificates == ["certificate", "certificate"]
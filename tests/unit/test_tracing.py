@@ -0,0 +1,93 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+
+import pytest
+
+from tracing import (
+    OTLP_FLUSH_TIMEOUT_MILLIS,
+    JSONLinesTracer,
+    OTLPTracer,
+    flush_tracer,
+    setup_tracer,
+)
+
+
+def read_spans(path):
+    return {span["name"]: span for span in map(json.loads, path.read_text().splitlines())}
+
+
+def test_spans_with_csr_digest_use_it_as_trace_id(tmp_path):
+    trace_file = tmp_path / "traces" / "spans.jsonl"
+    tracer = JSONLinesTracer(str(trace_file))
+    digest = "ab" * 32
+
+    with tracer.start_as_current_span("parent", attributes={"relation.id": 1}):
+        with tracer.start_as_current_span("child"):
+            pass
+        with tracer.start_as_current_span("request", attributes={"csr.digest": digest}):
+            pass
+
+    spans = read_spans(trace_file)
+    assert spans["child"]["trace_id"] == spans["parent"]["trace_id"]
+    assert spans["child"]["parent_span_id"] == spans["parent"]["span_id"]
+    assert spans["request"]["trace_id"] == digest[:32]
+    assert spans["request"]["parent_span_id"] is None
+
+
+def test_failing_span_is_recorded_with_error_status(tmp_path):
+    trace_file = tmp_path / "spans.jsonl"
+    tracer = JSONLinesTracer(str(trace_file))
+
+    with pytest.raises(ValueError):
+        with tracer.start_as_current_span("failing"):
+            raise ValueError()
+
+    assert read_spans(trace_file)["failing"]["status"] == "ERROR"
+
+
+def test_setup_tracer_prefers_otlp_endpoint_over_trace_file(tmp_path, monkeypatch):
+    otlp_tracer = object()
+    monkeypatch.setattr("tracing._otlp_tracer", lambda endpoint, service_name: otlp_tracer)
+    trace_file = str(tmp_path / "spans.jsonl")
+
+    assert setup_tracer("", "", "lego") is None
+    assert isinstance(setup_tracer("", trace_file, "lego"), JSONLinesTracer)
+    assert setup_tracer("http://collector:4318/v1/traces", trace_file, "lego") is otlp_tracer
+
+
+class FakeTracerProvider:
+    def __init__(self, exported):
+        self.exported = exported
+        self.flush_timeouts = []
+
+    def get_tracer(self, name):
+        return self
+
+    def start_span(self, name, attributes=None, start_time=None):
+        return name
+
+    def force_flush(self, timeout_millis):
+        self.flush_timeouts.append(timeout_millis)
+        return self.exported
+
+
+def test_otlp_tracer_delegates_spans_and_flushes_provider():
+    provider = FakeTracerProvider(exported=True)
+    tracer = OTLPTracer(provider)
+
+    assert tracer.start_span("span", attributes={}) == "span"
+    flush_tracer(tracer)
+
+    assert provider.flush_timeouts == [OTLP_FLUSH_TIMEOUT_MILLIS]
+
+
+def test_flush_tracer_gives_up_after_timeout(caplog):
+    provider = FakeTracerProvider(exported=False)
+
+    flush_tracer(OTLPTracer(provider))
+    flush_tracer(None)
+
+    assert provider.flush_timeouts == [OTLP_FLUSH_TIMEOUT_MILLIS]
+    assert "Could not export spans" in caplog.text